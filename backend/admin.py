@@ -1,5 +1,9 @@
 from django.contrib import admin
-from .models import User, Teacher, Student, Question, Subject, Subtopic, BKT, Quiz
+from .bkt import delete_rows, save_row
+from .models import (
+    User, Teacher, Student, Question, Subject, Subtopic, BKT, Quiz, QuizSession,
+    AnswerEvent, StudentMastery, SubtopicMastery, ClassMastery, MasterySeries, Job
+)
 
 ''' Each of the following registers the applicable model within the Django admin site.
 This allows for developers to easily view the data within the database and update this 
@@ -11,5 +15,32 @@ admin.site.register(Student)
 admin.site.register(Question)
 admin.site.register(Subject)
 admin.site.register(Subtopic)
-admin.site.register(BKT)
-admin.site.register(Quiz)
\ No newline at end of file
+admin.site.register(Quiz)
+admin.site.register(QuizSession)
+admin.site.register(AnswerEvent)
+admin.site.register(StudentMastery)
+admin.site.register(SubtopicMastery)
+admin.site.register(ClassMastery)
+admin.site.register(MasterySeries)
+admin.site.register(Job)
+
+
+''' BKT rows edited in the admin site are saved in the same way as through the API, so that
+the progress rollups are kept up to date and answers being saved at the same time are not lost. '''
+
+@admin.register(BKT)
+class BKTAdmin(admin.ModelAdmin):
+    readonly_fields = ['version']
+
+    def save_model(self, request, obj, form, change):
+        def save(version):
+            obj.version = version
+            obj.save()
+            return obj
+        save_row(obj.bkt_id, save)
+
+    def delete_model(self, request, obj):
+        delete_rows(BKT.objects.filter(bkt_id=obj.bkt_id))
+
+    def delete_queryset(self, request, queryset):
+        delete_rows(queryset)
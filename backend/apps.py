@@ -0,0 +1,11 @@
+from django.apps import AppConfig
+
+
+# The question bank, cache and rollups are imported when the app is ready, so that their signals are connected
+# before any models are saved.
+
+class BackendConfig(AppConfig):
+    name = 'backend'
+
+    def ready(self):
+        from backend import cache, question_bank, rollups  # noqa: F401
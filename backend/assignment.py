@@ -0,0 +1,57 @@
+# Quizzes are assigned here, so that the createQuiz action and the background job that assigns quizzes to a whole
+# year group use exactly the same rules.
+
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+
+from backend.models import Quiz, Student, Subject
+
+
+# Quizzes are assigned for each subject to every student in the given forms and every given student.
+# If no forms or students are given, the teacher's form is used, and if no subjects are given, the teacher's subject.
+# Returns the new quizzes and a dictionary of the open quiz ids that already existed, keyed by (student, subject).
+
+def assign_quizzes(teacher, subject_ids=None, forms=None, student_ids=None):
+    subject_ids = subject_ids or [teacher.subject_id]
+    forms = forms or []
+    student_ids = student_ids or []
+    if not forms and not student_ids:
+        forms = [teacher.form]
+
+    subject_ids = list(Subject.objects.filter(subject_id__in=subject_ids).values_list('subject_id', flat=True))
+    student_ids = list(
+        Student.objects
+        .filter(Q(form__in=forms) | Q(student_id__in=student_ids))
+        .order_by('student_id')
+        .values_list('student_id', flat=True)
+    )
+
+
+    # Students who already have an open quiz for a subject are not given another one, so that
+    # sending the same request again does not assign duplicate quizzes. The existing quiz ids are returned
+    # instead. If another request assigns the same quizzes at the same time, the check is run again.
+
+    for attempt in range(3):
+        try:
+            with transaction.atomic():
+                existing_quizzes = dict(
+                    ((student_id, subject_id), quiz_id)
+                    for quiz_id, student_id, subject_id in Quiz.objects.filter(
+                        student_id__in=student_ids,
+                        subject_id__in=subject_ids,
+                        completed=False
+                    ).values_list('quiz_id', 'student_id', 'subject_id')
+                )
+                new_quizzes = Quiz.objects.bulk_create(
+                    [
+                        Quiz(teacher=teacher, student_id=student_id, subject_id=subject_id)
+                        for subject_id in subject_ids
+                        for student_id in student_ids
+                        if (student_id, subject_id) not in existing_quizzes
+                    ],
+                    batch_size=500
+                )
+            return new_quizzes, existing_quizzes
+        except IntegrityError:
+            if attempt == 2:
+                raise
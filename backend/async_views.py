@@ -0,0 +1,97 @@
+# Async versions of the busiest API actions, for running the backend under an ASGI server (such as uvicorn).
+# They are served under /api/async/ alongside the normal views, and return the same data. While an async view
+# waits for the database, the server can carry on with other requests instead of holding a worker thread, which
+# helps when a whole year group starts a quiz at the same time.
+#
+# Each action runs the same helper as the normal view through sync_to_async, so that the two cannot drift apart,
+# and only the response is built here. The helpers read and write through the ORM, so they are left on the
+# default thread_sensitive=True: Django's database connections belong to a thread and are only closed at the end
+# of a request on that thread, so running them on other threads would leave connections open (and, in tests,
+# outside the test's transaction). Doing all of an action's queries in one call keeps it to a single switch.
+
+import json
+
+from asgiref.sync import sync_to_async
+from django.http import HttpResponseNotModified, JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+
+from backend import auth
+from backend.views import answer_question, login_user_data, quizzes_data, start_quiz
+
+
+def request_data(request):
+    try:
+        data = json.loads(request.body or b'{}')
+    except ValueError:
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+def error(message, status):
+    return JsonResponse({'error': message}, status=status)
+
+
+def json_response(data, status, headers=None):
+    if status == 304:
+        response = HttpResponseNotModified()
+        for header, value in (headers or {}).items():
+            response[header] = value
+        return response
+    return JsonResponse(data, status=status, headers=headers)
+
+
+# Login is checked in the same way as the normal checkLogin action, with the password hashing awaited
+# on the login thread pool.
+
+@csrf_exempt
+@require_POST
+async def check_login(request):
+    data = request_data(request)
+    email = data.get('email')
+    password = data.get('password')
+    if not isinstance(email, str) or not isinstance(password, str):
+        return error('Email and password are required', 400)
+
+    try:
+        login = await auth.aauthenticate(email, password)
+    except auth.LoginThrottled as throttled:
+        return JsonResponse(
+            {'error': str(throttled)},
+            status=429,
+            headers={'Retry-After': str(throttled.retry_after)}
+        )
+    except auth.LoginBusy as busy:
+        return error(str(busy), 503)
+
+    if login is None:
+        return error('Invalid login', 401)
+    return JsonResponse({'user': login_user_data(login)})
+
+
+# A quiz is generated in the same way as the normal generateQuiz action.
+
+@require_GET
+async def generate_quiz(request):
+    data, status = await sync_to_async(start_quiz)(request.GET.get('quiz_id'), request.GET.get('student_id'))
+    return json_response(data, status)
+
+
+# An answer is applied in the same way as the normal updateBKT action.
+
+@csrf_exempt
+@require_POST
+async def update_bkt(request):
+    data = request_data(request)
+    data, status = await sync_to_async(answer_question)(
+        data.get('student_id'), data.get('question_id'), data.get('selected_answer')
+    )
+    return json_response(data, status)
+
+
+# A student's open quizzes are returned in the same way as the normal getQuizzes action, including the ETag
+# and the short-lived response cache.
+
+@require_GET
+async def get_quizzes(request):
+    return json_response(*await sync_to_async(quizzes_data)(request))
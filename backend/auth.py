@@ -0,0 +1,235 @@
+# Passwords are stored as salted hashes using Django's password hashers, and checked here when users log in.
+# Hashing is deliberately slow, so logins are protected in three ways:
+#  - The hashing runs on a small pool of threads, so that a burst of logins cannot use every CPU at once.
+#    If too many logins are already waiting, the login is turned away as busy.
+#  - Recent successful logins are remembered for a short time, so logging in again does not hash again.
+#  - Each email can only fail a set number of times in a window, and further attempts are turned away
+#    before any hashing is done.
+#
+# Passwords are hashed whenever a user is saved (see User.save). Passwords saved as plaintext before hashing was
+# added are not accepted, and should be hashed once with the hashpasswords command.
+
+import asyncio
+import hashlib
+import hmac
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.hashers import PBKDF2PasswordHasher, identify_hasher, make_password
+
+from backend import cache
+from backend.models import User
+
+
+# The work factor (PBKDF2 iterations) can be changed with the LOGIN_PASSWORD_ITERATIONS setting. Passwords hashed
+# with a different number of iterations are hashed again with the new number when the user next logs in.
+
+class ConfigurablePBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    @property
+    def iterations(self):
+        return getattr(settings, 'LOGIN_PASSWORD_ITERATIONS', PBKDF2PasswordHasher.iterations)
+
+
+hasher = ConfigurablePBKDF2PasswordHasher()
+
+
+def hash_password(password):
+    return make_password(password, hasher=hasher)
+
+
+# Returns whether a stored password is a hash made by one of Django's hashers, rather than plaintext.
+
+def is_hashed(encoded):
+    try:
+        identify_hasher(encoded)
+    except ValueError:
+        return False
+    return True
+
+
+# The number of threads hashing passwords is set with LOGIN_WORKERS, and the number of logins that can wait for
+# them with LOGIN_QUEUE_SIZE. The defaults are read when the first login is checked.
+
+DEFAULT_WORKERS = 4
+DEFAULT_QUEUE_SIZE = 64
+
+# Successful logins are remembered for LOGIN_CACHE_SECONDS, for up to LOGIN_CACHE_SIZE logins at once.
+
+DEFAULT_CACHE_SECONDS = 300
+DEFAULT_CACHE_SIZE = 1000
+
+# Each email can fail LOGIN_ATTEMPT_LIMIT times in LOGIN_ATTEMPT_WINDOW seconds.
+
+DEFAULT_ATTEMPT_LIMIT = 5
+DEFAULT_ATTEMPT_WINDOW = 300
+
+
+# Raised when an email has failed too many times, with the number of seconds until it can be tried again.
+
+class LoginThrottled(Exception):
+    def __init__(self, retry_after):
+        super().__init__(f"Too many failed logins, try again in {retry_after} seconds")
+        self.retry_after = retry_after
+
+
+# Raised when too many logins are already waiting to be checked.
+
+class LoginBusy(Exception):
+    pass
+
+
+# The pool of threads that hash passwords. The semaphore counts logins being hashed or waiting to be,
+# so that no more than the workers plus the queue size are ever held at once.
+
+class HashingPool:
+    def __init__(self):
+        self._pool = None
+        self._slots = None
+        self._lock = threading.Lock()
+
+    def _start(self):
+        with self._lock:
+            if self._pool is None:
+                workers = getattr(settings, 'LOGIN_WORKERS', DEFAULT_WORKERS)
+                queue_size = getattr(settings, 'LOGIN_QUEUE_SIZE', DEFAULT_QUEUE_SIZE)
+                self._slots = threading.BoundedSemaphore(workers + queue_size)
+                self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='login')
+
+    def submit(self, function, *args):
+        self._start()
+        if not self._slots.acquire(blocking=False):
+            raise LoginBusy('Too many logins are being checked, please try again')
+        future = self._pool.submit(function, *args)
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+
+pool = HashingPool()
+
+
+# Recent successful logins are kept in memory, keyed by a token made from the email, the password and the
+# stored hash. The token is an HMAC with a key made when the process starts, so the tokens cannot be worked
+# out from outside the process, and a changed password changes the stored hash and so no longer matches.
+
+class SuccessCache:
+    def __init__(self):
+        self._key = secrets.token_bytes(32)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def token(self, email, password, encoded):
+        message = '\0'.join((email, password, encoded)).encode('utf-8')
+        return hmac.new(self._key, message, hashlib.sha256).hexdigest()
+
+    def contains(self, token):
+        with self._lock:
+            expires_at = self._entries.get(token)
+            if expires_at is None:
+                return False
+            if expires_at < time.monotonic():
+                del self._entries[token]
+                return False
+            self._entries.move_to_end(token)
+            return True
+
+    def add(self, token):
+        ttl = getattr(settings, 'LOGIN_CACHE_SECONDS', DEFAULT_CACHE_SECONDS)
+        size = getattr(settings, 'LOGIN_CACHE_SIZE', DEFAULT_CACHE_SIZE)
+        with self._lock:
+            self._entries[token] = time.monotonic() + ttl
+            self._entries.move_to_end(token)
+            while len(self._entries) > size:
+                self._entries.popitem(last=False)
+
+
+successes = SuccessCache()
+
+
+# Failed attempts are counted in the backend cache, so that the limit is shared between server processes.
+# The email is hashed so that it is not stored in the cache key.
+
+def attempts_key(email):
+    return f"backend:login-attempts:{hashlib.sha256((email or '').lower().encode('utf-8')).hexdigest()}"
+
+
+def check_attempts(email):
+    limit = getattr(settings, 'LOGIN_ATTEMPT_LIMIT', DEFAULT_ATTEMPT_LIMIT)
+    if cache.get_cache().get(attempts_key(email), 0) >= limit:
+        raise LoginThrottled(getattr(settings, 'LOGIN_ATTEMPT_WINDOW', DEFAULT_ATTEMPT_WINDOW))
+
+
+def record_failure(email):
+    window = getattr(settings, 'LOGIN_ATTEMPT_WINDOW', DEFAULT_ATTEMPT_WINDOW)
+    login_cache = cache.get_cache()
+    key = attempts_key(email)
+    login_cache.add(key, 0, window)
+    try:
+        login_cache.incr(key)
+    except ValueError:
+        login_cache.set(key, 1, window)
+
+
+def clear_failures(email):
+    cache.get_cache().delete(attempts_key(email))
+
+
+# The password is checked against the stored value. This is the slow part, and runs on the hashing pool.
+# Returns whether the password is correct, and whether the stored value should be replaced with a new hash.
+# If there is no user, or the stored value is not a hash, a hash is still made so that these take as long as
+# a real check.
+
+def verify(password, encoded):
+    if encoded is None or not is_hashed(encoded):
+        hash_password(password)
+        return False, False
+
+    stored_hasher = identify_hasher(encoded)
+    valid = stored_hasher.verify(password, encoded)
+    needs_update = stored_hasher.algorithm != hasher.algorithm or hasher.must_update(encoded)
+    return valid, valid and needs_update
+
+
+# The login is checked, returning the cached login data (without the password) if it is correct and None
+# otherwise. Raises LoginThrottled or LoginBusy if the login was turned away before being checked.
+
+def authenticate(email, password):
+    check_attempts(email)
+    encoded = User.objects.filter(email=email).values_list('password', flat=True).first()
+    token = successes.token(email or '', password or '', encoded or '')
+
+    if encoded is None or not successes.contains(token):
+        valid, needs_update = pool.submit(verify, password or '', encoded).result()
+        return finish_login(email, password, encoded, token, valid, needs_update)
+    return cache.user_login(email)
+
+
+def finish_login(email, password, encoded, token, valid, needs_update):
+    if not valid:
+        record_failure(email)
+        return None
+
+    if needs_update:
+        User.objects.filter(email=email, password=encoded).update(password=hash_password(password))
+    else:
+        successes.add(token)
+    clear_failures(email)
+    return cache.user_login(email)
+
+
+# The same login check for the async views. The hashing is awaited rather than blocking, and the database
+# and cache are reached through the async ORM and sync_to_async.
+
+async def aauthenticate(email, password):
+    await sync_to_async(check_attempts)(email)
+    encoded = await User.objects.filter(email=email).values_list('password', flat=True).afirst()
+    token = successes.token(email or '', password or '', encoded or '')
+
+    if encoded is None or not successes.contains(token):
+        valid, needs_update = await asyncio.wrap_future(pool.submit(verify, password or '', encoded))
+        return await sync_to_async(finish_login)(email, password, encoded, token, valid, needs_update)
+    return await sync_to_async(cache.user_login)(email)
@@ -0,0 +1,200 @@
+# The Bayesian Knowledge Tracing formula (taken from the dissertation) is kept here, so that
+# every view that updates a BKT value uses exactly the same calculation.
+
+import random
+import time
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, FloatField, Q, Value, When
+
+from backend import provisioning, rollups
+from backend.models import BKT, Question, Student
+
+
+# The number of times an update is tried before giving up can be changed with the BKT_UPDATE_ATTEMPTS setting.
+
+DEFAULT_UPDATE_ATTEMPTS = 10
+
+
+# Raised when a BKT value kept being changed by other answers and could not be updated.
+
+class BKTUpdateConflict(Exception):
+    pass
+
+
+# The new p_known value is calculated from the BKT parameters and whether the answer was correct.
+# The BKT row is not changed or saved, so the caller decides when to store the new value.
+
+def calculate_p_known(bkt, correct):
+
+    # If the value is correct, the BKT formula is used for a correct answer.
+
+    if correct:
+        top_value = bkt.p_known * (1 - bkt.p_slip)
+        bottom_value = top_value + (1 - bkt.p_known) * bkt.p_guess
+
+
+    # If the answer is incorrect, the formula for incorrect answers is used.
+
+    else:
+        top_value = bkt.p_known * bkt.p_slip
+        bottom_value = top_value + (1 - bkt.p_known) * (1 - bkt.p_guess)
+
+
+    # The "answer" value is taken by dividing value 1 by value 2.
+    # The new p_known value is then calculated using the final part of the formula with the calculated 
+    # p_answer value. 
+
+    p_answer = top_value / bottom_value
+    return round(min(1.0, max(0.0, p_answer + (1 - p_answer) * bkt.p_will_learn)), 2)
+
+
+# An answer is applied to a student's BKT value for the question's subtopic.
+# Each BKT row has a version number that goes up with every update. The new value is only saved if the version
+# is still the one that was read, so that two answers submitted at the same time cannot overwrite each other.
+# If another answer got there first, the row is read again and the update is tried again.
+# Only p_known and the version are written, and the rollups are updated in the same transaction.
+# If the student has no BKT row for the subtopic yet, it is created from the subtopic's default parameters.
+# Returns whether the answer was correct, the updated BKT row and the p_known value before the answer.
+
+def apply_answer(student, question, selected_answer, attempts=None):
+    correct = (selected_answer == question.correct_answer)
+    if attempts is None:
+        attempts = getattr(settings, 'BKT_UPDATE_ATTEMPTS', DEFAULT_UPDATE_ATTEMPTS)
+
+    for attempt in range(attempts):
+        bkt = BKT.objects.filter(student=student, subtopic_id=question.subtopic_id).first()
+        if bkt is None:
+            provisioning.provision([student.student_id], [question.subtopic_id])
+            bkt = BKT.objects.get(student=student, subtopic_id=question.subtopic_id)
+        previous_p_known = bkt.p_known
+        p_known = calculate_p_known(bkt, correct)
+
+        with transaction.atomic():
+            updated = BKT.objects.filter(bkt_id=bkt.bkt_id, version=bkt.version).update(
+                p_known=p_known,
+                version=F('version') + 1
+            )
+            if updated:
+                bkt.p_known = p_known
+                bkt.version += 1
+                rollups.apply_change(student, bkt, previous_p_known)
+                return correct, bkt, previous_p_known
+
+
+        # A short random wait stops answers that clashed from clashing again straight away.
+
+        time.sleep(random.uniform(0, 0.002 * (attempt + 1)))
+
+    raise BKTUpdateConflict(f"BKT value for {student.student_id} in {question.subtopic_id} could not be updated")
+
+
+# Several answers from one student are applied at once, such as when a whole quiz is submitted.
+# answers is a list of (question id, selected answer) pairs in the order they were given, and question ids that
+# do not exist are skipped. This must be called inside a transaction. The student's BKT rows are locked while they
+# are read, and any they do not have yet are created first. Answers in the same subtopic each build on the value
+# from the answer before, then each changed row is written once and the rollups are updated together.
+# Databases that cannot lock rows (such as SQLite) ignore the lock, so the rows are also only written while their
+# versions are still the ones that were read. If any has changed, BKTUpdateConflict is raised and the caller's
+# transaction should be rolled back.
+# Returns (question, selected answer, correct, p_known before, p_known after) for each answer.
+
+def apply_answers(student, answers):
+    questions = Question.objects.in_bulk([question_id for question_id, _ in answers])
+    subtopic_ids = {question.subtopic_id for question in questions.values()}
+
+    bkt_values = {
+        bkt.subtopic_id: bkt
+        for bkt in BKT.objects.select_for_update().filter(student=student, subtopic_id__in=subtopic_ids)
+    }
+    missing = subtopic_ids - set(bkt_values)
+    if missing:
+        provisioning.provision([student.student_id], missing)
+        bkt_values.update(
+            (bkt.subtopic_id, bkt)
+            for bkt in BKT.objects.select_for_update().filter(student=student, subtopic_id__in=missing)
+        )
+    previous_p_known = {subtopic_id: bkt.p_known for subtopic_id, bkt in bkt_values.items()}
+
+    answered = []
+    for question_id, selected_answer in answers:
+        question = questions.get(question_id)
+        if question is None:
+            continue
+        bkt = bkt_values[question.subtopic_id]
+        correct = (selected_answer == question.correct_answer)
+        prior_p_known = bkt.p_known
+        bkt.p_known = calculate_p_known(bkt, correct)
+        answered.append((question, selected_answer, correct, prior_p_known, bkt.p_known))
+
+
+    # The versions are increased so that any single answer that read these rows before this batch
+    # is tried again rather than overwriting it. All the rows are written in one update, which only matches rows
+    # whose version has not changed.
+
+    if bkt_values:
+        read_versions = Q()
+        for bkt in bkt_values.values():
+            read_versions |= Q(bkt_id=bkt.bkt_id, version=bkt.version)
+        updated = BKT.objects.filter(read_versions).update(
+            p_known=Case(
+                *[When(bkt_id=bkt.bkt_id, then=Value(bkt.p_known)) for bkt in bkt_values.values()],
+                output_field=FloatField()
+            ),
+            version=F('version') + 1
+        )
+        if updated != len(bkt_values):
+            raise BKTUpdateConflict(f"BKT values for {student.student_id} were changed by another answer")
+    for bkt in bkt_values.values():
+        bkt.version += 1
+    rollups.apply_changes([
+        (
+            student.student_id,
+            student.form,
+            bkt.subject_id,
+            bkt.subtopic_id,
+            bkt.p_known - previous_p_known[subtopic_id],
+            0
+        )
+        for subtopic_id, bkt in bkt_values.items()
+    ])
+    return answered
+
+
+# BKT rows edited directly, through the API or the admin site, are saved here so that the rollups stay in step.
+# A row's change to the rollups is the row being added (sign 1) or taken away (sign -1).
+
+def row_changes(bkt_values, sign):
+    forms = dict(
+        Student.objects.filter(student_id__in={bkt.student_id for bkt in bkt_values}).values_list('student_id', 'form')
+    )
+    return [
+        (bkt.student_id, forms[bkt.student_id], bkt.subject_id, bkt.subtopic_id, sign * bkt.p_known, sign)
+        for bkt in bkt_values
+    ]
+
+
+# The row with the given id is locked and replaced by calling save with the new version, which returns the saved
+# row. Increasing the version means an answer that read the old row is tried again rather than overwriting the
+# edit. The old row is taken out of the rollups and the saved row added, so a row moved to another student or
+# subtopic is counted in the right place.
+
+def save_row(bkt_id, save):
+    with transaction.atomic():
+        previous = BKT.objects.select_for_update().filter(bkt_id=bkt_id).first()
+        changes = row_changes([previous], -1) if previous is not None else []
+        bkt = save(previous.version + 1 if previous is not None else 0)
+        rollups.apply_changes(changes + row_changes([bkt], 1))
+    return bkt
+
+
+# The given BKT rows are deleted and taken out of the rollups. The rollups are updated after the rows are deleted,
+# so that a class whose rollups are built from the BKT table during the update does not include them.
+
+def delete_rows(bkt_values):
+    with transaction.atomic():
+        deleted = list(bkt_values.select_for_update())
+        BKT.objects.filter(bkt_id__in=[bkt.bkt_id for bkt in deleted]).delete()
+        rollups.apply_changes(row_changes(deleted, -1))
+    return len(deleted)
@@ -0,0 +1,88 @@
+# The BKT engine applies the same Bayesian Knowledge Tracing formula as bkt.py, but to whole arrays of
+# BKT values at once using NumPy. This is used where many students or subtopics need recalculating together,
+# such as replaying every recorded answer after a question's correct answer has been fixed.
+
+import numpy as np
+
+
+# New p_known values are calculated for arrays of BKT parameters, where correct is an array of booleans
+# with one entry for each value. The formula and rounding match calculate_p_known in bkt.py.
+
+def update_p_known(p_known, p_slip, p_guess, p_will_learn, correct):
+    p_known = np.asarray(p_known, dtype=np.float64)
+    p_slip = np.asarray(p_slip, dtype=np.float64)
+    p_guess = np.asarray(p_guess, dtype=np.float64)
+    p_will_learn = np.asarray(p_will_learn, dtype=np.float64)
+    correct = np.asarray(correct, dtype=bool)
+
+
+    # Both the correct and incorrect formulas are calculated, and the applicable one is chosen for each value.
+
+    top_value = np.where(correct, p_known * (1 - p_slip), p_known * p_slip)
+    bottom_value = top_value + np.where(correct, (1 - p_known) * p_guess, (1 - p_known) * (1 - p_guess))
+
+    p_answer = top_value / bottom_value
+    return np.round(np.clip(p_answer + (1 - p_answer) * p_will_learn, 0.0, 1.0), 2)
+
+
+# A log of answers is replayed for many student-subtopic pairs at once.
+# The parameter arrays have one entry for each pair, with p_known holding the value to start from.
+# pair_index says which pair each answer belongs to and correct says whether it was answered correctly,
+# with answers given in the order they were made.
+#
+# Answers are grouped by how many answers came before them in the same pair, so that every pair's first
+# answer is applied in one step, then every pair's second answer, and so on. This means the number of steps
+# is the longest history for a single pair rather than the total number of answers.
+#
+# Returns the final p_known for every pair, along with the p_known before and after each answer
+# (in the same order as the answers were given).
+
+def replay(p_known, p_slip, p_guess, p_will_learn, pair_index, correct):
+    p_known = np.array(p_known, dtype=np.float64)
+    p_slip = np.asarray(p_slip, dtype=np.float64)
+    p_guess = np.asarray(p_guess, dtype=np.float64)
+    p_will_learn = np.asarray(p_will_learn, dtype=np.float64)
+    pair_index = np.asarray(pair_index, dtype=np.int64)
+    correct = np.asarray(correct, dtype=bool)
+
+    answer_count = len(pair_index)
+    prior = np.empty(answer_count, dtype=np.float64)
+    posterior = np.empty(answer_count, dtype=np.float64)
+
+    if answer_count == 0:
+        return p_known, prior, posterior
+
+
+    # A stable sort keeps answers for each pair in their original order. The position of each answer within
+    # its pair is then found by subtracting the position where that pair's answers start.
+
+    by_pair = np.argsort(pair_index, kind='stable')
+    sorted_pairs = pair_index[by_pair]
+    pair_starts = np.flatnonzero(np.r_[True, sorted_pairs[1:] != sorted_pairs[:-1]])
+    pair_lengths = np.diff(np.r_[pair_starts, answer_count])
+    position = np.arange(answer_count) - np.repeat(pair_starts, pair_lengths)
+
+
+    # Answers are then ordered by their position, so each step is one slice of the array.
+
+    by_position = by_pair[np.argsort(position, kind='stable')]
+    step_sizes = np.bincount(position)
+    step_ends = np.cumsum(step_sizes)
+
+    step_start = 0
+    for step_end in step_ends:
+        answers = by_position[step_start:step_end]
+        pairs = pair_index[answers]
+
+        prior[answers] = p_known[pairs]
+        p_known[pairs] = update_p_known(
+            p_known[pairs],
+            p_slip[pairs],
+            p_guess[pairs],
+            p_will_learn[pairs],
+            correct[answers]
+        )
+        posterior[answers] = p_known[pairs]
+        step_start = step_end
+
+    return p_known, prior, posterior
@@ -0,0 +1,210 @@
+# BKT parameters are estimated from the recorded answer history using expectation-maximisation.
+# Each student's answers in a subtopic are treated as one sequence, where the student is either in the
+# "known" or "unknown" state at each answer. The parameters are the same ones stored on the BKT model:
+# p_initial_knowledge, p_will_learn, p_slip and p_guess.
+#
+# This module only uses NumPy, so that it can be run in separate processes without Django being set up.
+
+import numpy as np
+
+
+# Parameters are kept away from 0 and 1 so that the calculations never divide by zero.
+# Slip and guess are kept below 0.5, otherwise "known" and "unknown" could swap meaning.
+
+MIN_PROBABILITY = 1e-4
+MAX_SLIP_GUESS = 0.5 - MIN_PROBABILITY
+
+
+# Sequences of answers are padded into a matrix with one row per sequence, so that every sequence can be
+# worked on at once. student_index and correct have one entry per answer, and must already be in the order
+# the answers were given. Returns the matrix of answers, a mask of which entries are real answers, and the
+# student for each row.
+
+def build_sequences(student_index, correct):
+    student_index = np.asarray(student_index, dtype=np.int64)
+    correct = np.asarray(correct, dtype=bool)
+
+    by_student = np.argsort(student_index, kind='stable')
+    sorted_students = student_index[by_student]
+    students, starts, lengths = np.unique(sorted_students, return_index=True, return_counts=True)
+    position = np.arange(len(sorted_students)) - np.repeat(starts, lengths)
+    row = np.repeat(np.arange(len(students)), lengths)
+
+    answers = np.zeros((len(students), lengths.max() if len(lengths) else 0), dtype=bool)
+    mask = np.zeros(answers.shape, dtype=bool)
+    answers[row, position] = correct[by_student]
+    mask[row, position] = True
+    return answers, mask, students
+
+
+# The chance of each answer being given in the "unknown" and "known" states is calculated for every entry.
+# Padding entries are given a chance of 1 in both states, so that they do not change the result.
+
+def answer_likelihoods(answers, mask, p_slip, p_guess):
+    unknown = np.where(answers, p_guess[:, None], 1 - p_guess[:, None])
+    known = np.where(answers, 1 - p_slip[:, None], p_slip[:, None])
+    unknown = np.where(mask, unknown, 1.0)
+    known = np.where(mask, known, 1.0)
+    return np.stack([unknown, known], axis=-1)
+
+
+# The forward-backward pass (the E-step) is run for every sequence at once.
+# Each parameter is an array with one value per sequence, which allows sequences to share parameters
+# (one subtopic) or to have their own (one student). Returns the chance of being in each state at each answer,
+# the expected number of times students moved from unknown to known, and the log likelihood of each sequence.
+
+def expectation(answers, mask, p_initial_knowledge, p_will_learn, p_slip, p_guess):
+    sequence_count, step_count = answers.shape
+    likelihoods = answer_likelihoods(answers, mask, p_slip, p_guess)
+
+
+    # The forward pass is scaled at each step so that the values do not become too small to store.
+
+    alpha = np.empty((sequence_count, step_count, 2))
+    scale = np.empty((sequence_count, step_count))
+
+    start = np.stack([1 - p_initial_knowledge, p_initial_knowledge], axis=-1) * likelihoods[:, 0]
+    scale[:, 0] = start.sum(axis=1)
+    alpha[:, 0] = start / scale[:, 0, None]
+
+    for step in range(1, step_count):
+        previous = alpha[:, step - 1]
+        unknown = previous[:, 0] * (1 - p_will_learn)
+        known = previous[:, 1] + previous[:, 0] * p_will_learn
+        current = np.stack([unknown, known], axis=-1) * likelihoods[:, step]
+        scale[:, step] = current.sum(axis=1)
+        alpha[:, step] = current / scale[:, step, None]
+
+
+    # The backward pass uses the same scaling, so that alpha multiplied by beta gives the state chances.
+    # Students can learn but never forget, so a known student always stays known.
+
+    beta = np.ones((sequence_count, step_count, 2))
+    learned = np.zeros(sequence_count)
+
+    for step in range(step_count - 2, -1, -1):
+        following = likelihoods[:, step + 1] * beta[:, step + 1] / scale[:, step + 1, None]
+        beta[:, step, 0] = (1 - p_will_learn) * following[:, 0] + p_will_learn * following[:, 1]
+        beta[:, step, 1] = following[:, 1]
+
+        learn_step = alpha[:, step, 0] * p_will_learn * following[:, 1]
+        learned += np.where(mask[:, step + 1], learn_step, 0.0)
+
+    state = alpha * beta
+    log_likelihood = np.where(mask, np.log(scale), 0.0).sum(axis=1)
+    return state, learned, log_likelihood
+
+
+# The parameters are re-estimated from the expected states (the M-step). Totals are added up for each
+# parameter group, so that sequences sharing parameters are estimated together. Optional prior values with
+# a strength (counted as that many extra answers) pull groups with few answers towards the prior values.
+
+def maximisation(answers, mask, state, learned, groups, group_count, prior=None, prior_strength=0.0):
+    unknown = np.where(mask, state[..., 0], 0.0)
+    known = np.where(mask, state[..., 1], 0.0)
+    had_next_answer = np.zeros_like(mask)
+    had_next_answer[:, :-1] = mask[:, 1:]
+
+    def group_total(values):
+        return np.bincount(groups, weights=values, minlength=group_count)
+
+    totals = {
+        'p_initial_knowledge': (group_total(state[:, 0, 1]), group_total(np.ones(len(groups)))),
+        'p_will_learn': (
+            group_total(learned),
+            group_total(np.where(had_next_answer, unknown, 0.0).sum(axis=1))
+        ),
+        'p_slip': (group_total((known * ~answers).sum(axis=1)), group_total(known.sum(axis=1))),
+        'p_guess': (group_total((unknown * answers).sum(axis=1)), group_total(unknown.sum(axis=1))),
+    }
+
+    parameters = {}
+    for name, (top_value, bottom_value) in totals.items():
+        if prior is not None:
+            top_value = top_value + prior_strength * prior[name]
+            bottom_value = bottom_value + prior_strength
+        parameters[name] = np.divide(
+            top_value,
+            bottom_value,
+            out=np.full(group_count, 0.5) if prior is None else np.array(prior[name], dtype=np.float64),
+            where=bottom_value > 0
+        )
+
+    return clip_parameters(parameters)
+
+
+def clip_parameters(parameters):
+    return {
+        'p_initial_knowledge': np.clip(parameters['p_initial_knowledge'], MIN_PROBABILITY, 1 - MIN_PROBABILITY),
+        'p_will_learn': np.clip(parameters['p_will_learn'], MIN_PROBABILITY, 1 - MIN_PROBABILITY),
+        'p_slip': np.clip(parameters['p_slip'], MIN_PROBABILITY, MAX_SLIP_GUESS),
+        'p_guess': np.clip(parameters['p_guess'], MIN_PROBABILITY, MAX_SLIP_GUESS),
+    }
+
+
+# Parameters are fitted by repeating the E-step and M-step until the log likelihood stops improving.
+# groups gives the parameter group for each sequence and initial gives the starting values for each group
+# (as a dictionary of arrays). Returns the fitted parameters and the final log likelihood.
+
+def fit(answers, mask, groups, initial, prior=None, prior_strength=0.0, max_iterations=100, tolerance=1e-4):
+    groups = np.asarray(groups, dtype=np.int64)
+    group_count = len(initial['p_will_learn'])
+    parameters = clip_parameters({name: np.asarray(values, dtype=np.float64) for name, values in initial.items()})
+    previous_log_likelihood = -np.inf
+    log_likelihood = -np.inf
+
+    for _ in range(max_iterations):
+        state, learned, sequence_log_likelihood = expectation(
+            answers,
+            mask,
+            *(parameters[name][groups] for name in ('p_initial_knowledge', 'p_will_learn', 'p_slip', 'p_guess'))
+        )
+        log_likelihood = sequence_log_likelihood.sum()
+        parameters = maximisation(answers, mask, state, learned, groups, group_count, prior, prior_strength)
+
+        if log_likelihood - previous_log_likelihood < tolerance:
+            break
+        previous_log_likelihood = log_likelihood
+
+    return parameters, log_likelihood
+
+
+# A whole subtopic is fitted, which is the work given to each process in the pool.
+# The subtopic's parameters are fitted first. If per-student fitting is chosen, each student then gets their
+# own parameters, pulled towards the subtopic's values by prior_strength so that students with only a few
+# answers stay close to the subtopic as a whole.
+
+def fit_subtopic(task):
+    subtopic_id, student_index, correct, initial, per_student, prior_strength = task
+    answers, mask, students = build_sequences(student_index, correct)
+
+    subtopic_parameters, log_likelihood = fit(
+        answers,
+        mask,
+        np.zeros(len(students), dtype=np.int64),
+        {name: np.array([value]) for name, value in initial.items()}
+    )
+    result = {
+        'subtopic_id': subtopic_id,
+        'answers': int(mask.sum()),
+        'log_likelihood': float(log_likelihood),
+        'subtopic': {name: float(values[0]) for name, values in subtopic_parameters.items()},
+        'students': None,
+    }
+
+    if per_student:
+        prior = {name: np.full(len(students), values[0]) for name, values in subtopic_parameters.items()}
+        student_parameters, _ = fit(
+            answers,
+            mask,
+            np.arange(len(students)),
+            prior,
+            prior=prior,
+            prior_strength=prior_strength
+        )
+        result['students'] = {
+            int(student): {name: float(values[row]) for name, values in student_parameters.items()}
+            for row, student in enumerate(students)
+        }
+
+    return result
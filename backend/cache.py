@@ -0,0 +1,161 @@
+# Read-through cache for the lookups made on every login and roster request. Values are stored in Django's cache
+# framework, so the backend can be chosen in the CACHES setting (the local memory or file based cache is enough
+# for this application). Entries expire after BACKEND_CACHE_TIMEOUT seconds, and the least recently used entries
+# are removed when the cache is full (using the cache's MAX_ENTRIES option).
+#
+# Each kind of lookup has a version number that is included in its keys. When a model that a lookup depends on
+# is saved or deleted, the version is increased, so every old entry for that lookup is ignored from then on.
+# Versions start from the current time in microseconds, so that a version that was removed from the cache starts
+# again above every version used before, rather than from 0 (which would bring old entries back).
+#
+# Saves in other server processes only change these versions if the cache is shared between them (such as Redis
+# or Memcached). With the local memory cache, each process sees other processes' changes once entries expire.
+
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from backend.models import Student, Subject, Subtopic, Teacher, User
+
+
+DEFAULT_TIMEOUT = 300
+MISSING = object()
+
+
+# The models each kind of lookup is built from.
+
+DEPENDENCIES = {
+    'login': (User, Teacher, Student),
+    'teacher': (Teacher, User),
+    'roster': (Student, User),
+    'subject': (Subject, Subtopic),
+}
+
+
+def get_cache():
+    return caches[getattr(settings, 'BACKEND_CACHE_ALIAS', 'default')]
+
+
+# Hits and misses are counted for each kind of lookup, and are shown with the API metrics.
+
+class CacheStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = {}
+
+    def record(self, kind, hit):
+        with self._lock:
+            counts = self._counts.setdefault(kind, {'hits': 0, 'misses': 0})
+            counts['hits' if hit else 'misses'] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                kind: dict(counts, hit_rate=round(counts['hits'] / (counts['hits'] + counts['misses']), 3))
+                for kind, counts in sorted(self._counts.items())
+            }
+
+
+stats = CacheStats()
+
+
+def version(kind):
+    cache = get_cache()
+    key = f"backend:version:{kind}"
+    value = cache.get(key)
+    if value is None:
+        cache.add(key, time.time_ns() // 1000, None)
+        value = cache.get(key, 0)
+    return value
+
+
+def invalidate(kind):
+    cache = get_cache()
+    key = f"backend:version:{kind}"
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, time.time_ns() // 1000, None)
+
+
+# A value is read from the cache, or loaded and stored if it is not there.
+
+def get_or_load(kind, key, loader):
+    cache = get_cache()
+    cache_key = f"backend:{kind}:{version(kind)}:{key}"
+    value = cache.get(cache_key, MISSING)
+    stats.record(kind, value is not MISSING)
+
+    if value is MISSING:
+        value = loader()
+        cache.set(cache_key, value, getattr(settings, 'BACKEND_CACHE_TIMEOUT', DEFAULT_TIMEOUT))
+    return value
+
+
+# The user with the given email, along with their teacher or student id, is returned as a dictionary.
+# The password is never included. Returns None if there is no user with the email.
+
+def user_login(email):
+    def load():
+        return User.objects.filter(email=email).values(
+            'user_id', 'email', 'user_type', 'first_name', 'surname', 'teacher__teacher_id', 'student__student_id'
+        ).first()
+
+    return get_or_load('login', email, load)
+
+
+# The form, subject and name for a teacher are returned. Returns None if there is no teacher with the id.
+
+def teacher(teacher_id):
+    def load():
+        return Teacher.objects.filter(teacher_id=teacher_id).values(
+            'teacher_id', 'form', 'subject_id', 'user_id__first_name', 'user_id__surname'
+        ).first()
+
+    return get_or_load('teacher', teacher_id, load)
+
+
+# The students in a form are returned as a list of (student id, student name), ordered by student id.
+
+def form_roster(form):
+    def load():
+        return [
+            (student_id, f"{first_name} {surname}")
+            for student_id, first_name, surname in Student.objects.filter(form=form).order_by('student_id')
+            .values_list('student_id', 'user_id__first_name', 'user_id__surname')
+        ]
+
+    return get_or_load('roster', form, load)
+
+
+# The name of a subject and its subtopics (as a list of (subtopic id, subtopic name)) are returned.
+
+def subject(subject_id):
+    def load():
+        subject_name = Subject.objects.filter(subject_id=subject_id).values_list('subject_name', flat=True).first()
+        if subject_name is None:
+            return None
+        return {
+            'subject_id': subject_id,
+            'subject_name': subject_name,
+            'subtopics': list(
+                Subtopic.objects.filter(subject_id=subject_id).order_by('subtopic_id')
+                .values_list('subtopic_id', 'subtopic_name')
+            )
+        }
+
+    return get_or_load('subject', subject_id, load)
+
+
+# When any model is saved or deleted, every kind of lookup that depends on it is cleared.
+
+@receiver(post_save)
+@receiver(post_delete)
+def invalidate_dependents(sender, **kwargs):
+    for kind, models in DEPENDENCIES.items():
+        if sender in models:
+            invalidate(kind)
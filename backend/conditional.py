@@ -0,0 +1,159 @@
+# Read-heavy GET actions are served with an ETag built from a cheap version stamp of the data behind them.
+# If the frontend already has the current version (sent back in If-None-Match), a 304 Not Modified response
+# is returned without building the response at all. Otherwise the response data is kept in the cache for a
+# short time under the same ETag, so that repeated requests for unchanged data skip the full queries.
+#
+# Stamps are read from the database, so that changes made by any server process (or by bulk updates that do not
+# send save signals) change them. Names that are read from the backend cache cannot be stamped this way, so every
+# ETag is also only used for one window of RESPONSE_CACHE_TIMEOUT seconds. With more than one server process,
+# the backend cache should be shared (such as Redis or Memcached) so that changed names are seen straight away.
+
+import hashlib
+import time
+
+from django.conf import settings
+from django.db.models import Count, Max, Sum
+from django.utils.http import parse_etags
+from rest_framework import status
+from rest_framework.response import Response
+
+from backend import cache, rollups
+from backend.models import ClassMastery, Quiz, Student, Subtopic
+
+
+# Responses are cached for RESPONSE_CACHE_TIMEOUT seconds (30 by default), which is also how long an ETag is used
+# for. It cannot be set above MAX_TIMEOUT, so that a response is never served for long after its data changed.
+
+DEFAULT_TIMEOUT = 30
+MAX_TIMEOUT = 300
+
+
+# The ETag is a hash of the full request path, the stamp and the current window, so that different pages and
+# filters of the same action each have their own ETag, and no ETag outlives its window.
+
+def make_etag(request, stamp):
+    window = int(time.time() // response_timeout())
+    value = f"{request.get_full_path()}|{stamp}|{window}"
+    return '"' + hashlib.sha1(value.encode('utf-8')).hexdigest() + '"'
+
+
+# Whether the frontend already has the response with this ETag.
+
+def not_modified(request, etag):
+    if_none_match = parse_etags(request.headers.get('If-None-Match', ''))
+    return etag in if_none_match or '*' in if_none_match
+
+
+def response_cache_key(etag):
+    return f"backend:response:{etag}"
+
+
+def response_timeout():
+    timeout = getattr(settings, 'RESPONSE_CACHE_TIMEOUT', DEFAULT_TIMEOUT)
+    return MAX_TIMEOUT if timeout is None else max(1, min(timeout, MAX_TIMEOUT))
+
+
+def etag_headers(etag):
+    return {'ETag': etag, 'Cache-Control': 'private, no-cache'}
+
+
+# The data for a response is returned for the given stamp, as (data, status code, headers), only calling build
+# (which returns the data and a status code) when needed. The data is None when the frontend already has it.
+# If the stamp is None the data cannot be stamped cheaply, so it is always built. Only successful data is cached.
+# This is shared by the DRF views below and the async views, which build their own responses from it.
+
+def conditional_data(request, stamp, build):
+    if stamp is None:
+        data, status_code = build()
+        return data, status_code, {}
+
+    etag = make_etag(request, stamp)
+    headers = etag_headers(etag)
+    if not_modified(request, etag):
+        return None, status.HTTP_304_NOT_MODIFIED, headers
+
+    response_cache = cache.get_cache()
+    data = response_cache.get(response_cache_key(etag), cache.MISSING)
+    cache.stats.record('response', data is not cache.MISSING)
+    if data is not cache.MISSING:
+        return data, status.HTTP_200_OK, headers
+
+    data, status_code = build()
+    if status_code != status.HTTP_200_OK:
+        return data, status_code, {}
+    response_cache.set(response_cache_key(etag), data, response_timeout())
+    return data, status_code, headers
+
+
+# The same for DRF views, where build returns a Response.
+
+def conditional_response(request, stamp, build):
+    def build_data():
+        response = build()
+        return response.data, response.status_code
+
+    data, status_code, headers = conditional_data(request, stamp, build_data)
+    return Response(data, status=status_code, headers=headers)
+
+
+# Only a student's open quizzes are listed, so the stamp is how many there are, the total of their ids and the
+# latest time any of them was saved. Assigning or completing a quiz changes the count and total even when it was
+# done with a bulk update that does not set updated_at.
+
+def quizzes_stamp(student_id):
+    quizzes = Quiz.objects.filter(student_id=student_id, completed=False).aggregate(
+        count=Count('quiz_id'),
+        id_total=Sum('quiz_id'),
+        updated_at=Max('updated_at')
+    )
+    return (
+        quizzes['count'],
+        quizzes['id_total'],
+        quizzes['updated_at'],
+        cache.version('subject'),
+        cache.version('teacher')
+    )
+
+
+# The students shown to a teacher are stamped by how many students are in the form and the highest student id.
+
+def students_stamp(teacher_id):
+    teacher = cache.teacher(teacher_id)
+    if teacher is None:
+        return None
+    students = Student.objects.filter(form=teacher['form']).aggregate(
+        count=Count('student_id'),
+        last_id=Max('student_id')
+    )
+    return (
+        teacher['form'],
+        teacher['subject_id'],
+        students['count'],
+        students['last_id'],
+        cache.version('teacher'),
+        cache.version('roster'),
+        cache.version('subject')
+    )
+
+
+# Progress data changes whenever a BKT value in the class changes, which always updates the class rollup
+# and increases its revision. The number of students and subtopics are included, so that a new student or
+# subtopic is shown (and given BKT rows) before any of their values change.
+# If the class has no rollup yet there is nothing cheap to stamp.
+
+def progress_stamp(teacher_id):
+    teacher = cache.teacher(teacher_id)
+    if teacher is None or teacher['subject_id'] is None:
+        return None
+    class_rollup = ClassMastery.objects.filter(
+        rollup_id=rollups.class_rollup_id(teacher['form'], teacher['subject_id'])
+    ).values_list('revision', 'bkt_count', 'p_known_total').first()
+    if class_rollup is None:
+        return None
+    return class_rollup + (
+        Student.objects.filter(form=teacher['form']).count(),
+        Subtopic.objects.filter(subject_id=teacher['subject_id']).count(),
+        cache.version('teacher'),
+        cache.version('roster'),
+        cache.version('subject')
+    )
@@ -0,0 +1,166 @@
+# Answer events are written through a buffer, so that a busy quiz period results in a small number of
+# bulk inserts rather than one insert for every answer. Events are read back in chunks, so that the
+# whole history never needs to be loaded into memory at once.
+
+import atexit
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+from backend.models import AnswerEvent
+
+
+logger = logging.getLogger(__name__)
+
+
+# The buffer is flushed when it reaches the batch size, or when the oldest event in it has waited for
+# the flush interval. Both can be changed in the Django settings.
+
+DEFAULT_BATCH_SIZE = 200
+DEFAULT_FLUSH_SECONDS = 5
+
+
+class AnswerEventWriter:
+    def __init__(self):
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._flush_thread = None
+        self._oldest_event_time = None
+        self._captured = None
+
+    @property
+    def batch_size(self):
+        return getattr(settings, 'ANSWER_EVENT_BATCH_SIZE', DEFAULT_BATCH_SIZE)
+
+    @property
+    def flush_seconds(self):
+        return getattr(settings, 'ANSWER_EVENT_FLUSH_SECONDS', DEFAULT_FLUSH_SECONDS)
+
+
+    # An answer is added to the buffer. The time is taken now rather than when the buffer is flushed,
+    # so that events keep the time the answer was actually given.
+
+    def record(self, student_id, question, selected_answer, correct, prior_p_known, posterior_p_known):
+        event = AnswerEvent(
+            student_id=student_id,
+            question_id=question.question_id,
+            subtopic_id=question.subtopic_id,
+            selected_answer=selected_answer or '',
+            correct=correct,
+            answered_at=timezone.now(),
+            prior_p_known=prior_p_known,
+            posterior_p_known=posterior_p_known
+        )
+
+        with self._lock:
+            if self._captured is not None:
+                self._captured.append(event)
+                return
+            self._buffer.append(event)
+            if self._oldest_event_time is None:
+                self._oldest_event_time = time.monotonic()
+            buffer_full = len(self._buffer) >= self.batch_size
+
+        if buffer_full:
+            self.flush()
+        else:
+            self._start_flush_thread()
+
+
+    # While capturing, answers are collected in the returned list instead of being written. This is used when
+    # answers are submitted in a transaction that is rolled back, so that no answer history is left behind.
+
+    @contextmanager
+    def capture(self):
+        captured = []
+        with self._lock:
+            previous = self._captured
+            self._captured = captured
+        try:
+            yield captured
+        finally:
+            with self._lock:
+                self._captured = previous
+
+
+    # All buffered events are inserted in bulk. If the insert fails, the events are put back into the buffer
+    # so they can be tried again on the next flush, rather than failing the answer that triggered the flush.
+
+    def flush(self):
+        with self._lock:
+            events = self._buffer
+            self._buffer = []
+            self._oldest_event_time = None
+
+        if not events:
+            return 0
+
+        try:
+            AnswerEvent.objects.bulk_create(events, batch_size=self.batch_size)
+        except Exception:
+            logger.exception('Failed to write %d answer events, they will be retried', len(events))
+            with self._lock:
+                self._buffer = events + self._buffer
+                self._oldest_event_time = time.monotonic()
+            return 0
+
+        return len(events)
+
+
+    # A background thread flushes events that have waited for the flush interval, so that events are
+    # still written when answers stop arriving. It closes its own database connection after each flush.
+
+    def _start_flush_thread(self):
+        with self._lock:
+            if self._flush_thread is not None:
+                return
+            self._flush_thread = threading.Thread(target=self._flush_when_due, daemon=True)
+        self._flush_thread.start()
+
+    def _flush_when_due(self):
+        while True:
+            time.sleep(self.flush_seconds)
+            with self._lock:
+                due = (
+                    self._oldest_event_time is not None
+                    and time.monotonic() - self._oldest_event_time >= self.flush_seconds
+                )
+            if due:
+                self.flush()
+                connection.close()
+
+
+# One writer is shared by the whole process, and anything left in the buffer is written when the process exits.
+
+writer = AnswerEventWriter()
+atexit.register(writer.flush)
+
+
+# Events are read in chunks ordered by event id. Each chunk starts after the last id of the previous chunk,
+# so every query uses the primary key rather than an offset, and only one chunk is held in memory at a time.
+# If fields are given, each event is returned as a tuple of those fields rather than a model object.
+
+def stream_events(events=None, chunk_size=5000, fields=None):
+    if events is None:
+        events = AnswerEvent.objects.all()
+
+    last_event_id = 0
+    while True:
+        chunk = events.filter(event_id__gt=last_event_id).order_by('event_id')
+        if fields:
+            chunk = list(chunk.values_list('event_id', *fields)[:chunk_size])
+            if not chunk:
+                return
+            last_event_id = chunk[-1][0]
+            yield [row[1:] for row in chunk]
+        else:
+            chunk = list(chunk[:chunk_size])
+            if not chunk:
+                return
+            last_event_id = chunk[-1].event_id
+            yield chunk
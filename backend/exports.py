@@ -0,0 +1,145 @@
+# Exports stream BKT values, quiz results and answer history out of the database as CSV or NDJSON.
+# Rows are read with a database iterator in chunks and written one line at a time, so that memory use
+# stays the same however many rows are exported.
+
+import csv
+import json
+
+from django.utils.dateparse import parse_date
+
+from backend.models import AnswerEvent, BKT, Quiz
+
+
+DEFAULT_CHUNK_SIZE = 2000
+FORMATS = ('csv', 'ndjson')
+
+
+# Each export is described by its columns (the header and the field it is read from), how to filter it by form
+# and subject, and which date it is filtered by. BKT values have no date, so they can only be filtered by
+# form and subject.
+
+EXPORTS = {
+    'progress': {
+        'queryset': lambda: BKT.objects.order_by('bkt_id'),
+        'columns': [
+            ('student_id', 'student_id'),
+            ('first_name', 'student__user_id__first_name'),
+            ('surname', 'student__user_id__surname'),
+            ('form', 'student__form'),
+            ('subject_id', 'subject_id'),
+            ('subtopic_id', 'subtopic_id'),
+            ('subtopic_name', 'subtopic__subtopic_name'),
+            ('p_known', 'p_known'),
+            ('p_initial_knowledge', 'p_initial_knowledge'),
+            ('p_will_learn', 'p_will_learn'),
+            ('p_slip', 'p_slip'),
+            ('p_guess', 'p_guess'),
+        ],
+        'form': 'student__form',
+        'subject': 'subject_id',
+        'date': None,
+    },
+    'quizzes': {
+        'queryset': lambda: Quiz.objects.order_by('quiz_id'),
+        'columns': [
+            ('quiz_id', 'quiz_id'),
+            ('student_id', 'student_id'),
+            ('form', 'student__form'),
+            ('subject_id', 'subject_id'),
+            ('teacher_id', 'teacher_id'),
+            ('completed', 'completed'),
+            ('score', 'score'),
+            ('total_questions', 'total_questions'),
+            ('assigned_at', 'assigned_at'),
+            ('completed_at', 'completed_at'),
+        ],
+        'form': 'student__form',
+        'subject': 'subject_id',
+        'date': 'assigned_at',
+    },
+    'answers': {
+        'queryset': lambda: AnswerEvent.objects.order_by('event_id'),
+        'columns': [
+            ('event_id', 'event_id'),
+            ('student_id', 'student_id'),
+            ('form', 'student__form'),
+            ('subject_id', 'subtopic__subject_id'),
+            ('subtopic_id', 'subtopic_id'),
+            ('question_id', 'question_id'),
+            ('selected_answer', 'selected_answer'),
+            ('correct', 'correct'),
+            ('answered_at', 'answered_at'),
+            ('prior_p_known', 'prior_p_known'),
+            ('posterior_p_known', 'posterior_p_known'),
+        ],
+        'form': 'student__form',
+        'subject': 'subtopic__subject_id',
+        'date': 'answered_at',
+    },
+}
+
+
+# Raised when an export is asked for with an unknown name, format or date.
+
+class ExportError(Exception):
+    pass
+
+
+# The rows for an export are returned as tuples, in the order of its columns. Dates are given as YYYY-MM-DD and
+# both the start and end dates are included.
+
+def export_rows(name, form=None, subject_id=None, start=None, end=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    if name not in EXPORTS:
+        raise ExportError(f"Unknown export {name}, choose from {', '.join(EXPORTS)}")
+    export = EXPORTS[name]
+    rows = export['queryset']()
+
+    if form:
+        rows = rows.filter(**{export['form']: form})
+    if subject_id:
+        rows = rows.filter(**{export['subject']: subject_id})
+
+    for lookup, value in (('gte', start), ('lte', end)):
+        if not value:
+            continue
+        if export['date'] is None:
+            raise ExportError(f"The {name} export cannot be filtered by date")
+        try:
+            date = parse_date(value)
+        except ValueError:
+            date = None
+        if date is None:
+            raise ExportError(f"Invalid date {value}, use YYYY-MM-DD")
+        rows = rows.filter(**{f"{export['date']}__date__{lookup}": date})
+
+    fields = [field for _, field in export['columns']]
+    return rows.values_list(*fields).iterator(chunk_size=chunk_size)
+
+
+def headers(name):
+    return [header for header, _ in EXPORTS[name]['columns']]
+
+
+# The csv module writes to a file, so each line is written to this object, which just hands the line back.
+
+class Echo:
+    def write(self, value):
+        return value
+
+
+# The rows are turned into lines of text one at a time, starting with the header line for CSV.
+
+def export_lines(name, rows, output_format):
+    if output_format == 'csv':
+        writer = csv.writer(Echo())
+        yield writer.writerow(headers(name))
+        for row in rows:
+            yield writer.writerow(row)
+
+    elif output_format == 'ndjson':
+        names = headers(name)
+        for row in rows:
+            yield json.dumps(dict(zip(names, row)), default=str) + '\n'
+
+    else:
+        raise ExportError(f"Unknown format {output_format}, choose from {', '.join(FORMATS)}")
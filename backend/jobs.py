@@ -0,0 +1,285 @@
+# Background jobs let slow work (such as assigning quizzes to a whole year group or rebuilding the progress
+# rollups) be queued by a view and run later by the runjobs command, so that the web server is not held up.
+# Jobs are stored in the Job table in the same database, so no separate message broker is needed.
+#
+# Each kind of job has a handler, registered with the handler decorator. Handlers are called with a progress
+# function followed by the job's arguments, and return a JSON result that is saved on the job.
+#  - A job that raises an error is tried again later, waiting twice as long after each attempt, until it has used
+#    all of its attempts. Handlers raise JobFailed for errors that trying again would not fix.
+#  - Only one queued or running job can have each deduplication key. By default the key is made from the kind and
+#    the arguments, so queueing the same work twice returns the job that is already waiting.
+#  - Workers claim a job by changing its status from queued to running, which only one worker can do.
+#    Running jobs are marked with a heartbeat, and jobs whose worker has stopped are queued again.
+
+import functools
+import hashlib
+import inspect
+import io
+import json
+import logging
+import os
+import signal
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from backend import assignment, pregeneration, rollups
+from backend.models import Job, Teacher
+
+
+logger = logging.getLogger(__name__)
+
+
+# The number of attempts, the wait before the first retry (in seconds) and how long a running job can go without
+# a heartbeat before it is queued again can be changed with JOB_MAX_ATTEMPTS, JOB_RETRY_DELAY and JOB_STALE_AFTER.
+# JOB_WORKER_PROCESSES and JOB_POLL_INTERVAL are the defaults for the runjobs command.
+
+DEFAULT_MAX_ATTEMPTS = 3
+DEFAULT_RETRY_DELAY = 30
+DEFAULT_STALE_AFTER = 300
+DEFAULT_POLL_INTERVAL = 1.0
+
+ACTIVE_STATUSES = ('queued', 'running')
+
+HANDLERS = {}
+
+
+# Raised by a handler when a job cannot succeed, so that it is failed without being tried again.
+
+class JobFailed(Exception):
+    pass
+
+
+# Raised when a job is queued with an unknown kind or arguments its handler does not accept.
+
+class InvalidJob(Exception):
+    pass
+
+
+def handler(kind):
+    def register(function):
+        HANDLERS[kind] = function
+        return function
+    return register
+
+
+def worker_processes():
+    return getattr(settings, 'JOB_WORKER_PROCESSES', os.cpu_count() or 1)
+
+
+def poll_interval():
+    return getattr(settings, 'JOB_POLL_INTERVAL', DEFAULT_POLL_INTERVAL)
+
+
+def stale_after():
+    return getattr(settings, 'JOB_STALE_AFTER', DEFAULT_STALE_AFTER)
+
+
+def make_dedup_key(kind, arguments):
+    encoded = json.dumps([kind, arguments], sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+
+# The arguments are checked against the handler before the job is queued, so that a job that could never run
+# is turned away straight away.
+
+def check_arguments(kind, arguments):
+    if kind not in HANDLERS:
+        raise InvalidJob(f"Unknown job {kind}, choose from {', '.join(sorted(HANDLERS))}")
+    if not isinstance(arguments, dict):
+        raise InvalidJob('Job arguments must be an object')
+    try:
+        inspect.signature(HANDLERS[kind]).bind(None, **arguments)
+    except TypeError as error:
+        raise InvalidJob(f"Invalid arguments for {kind}: {error}")
+
+
+# A job is queued. If a job with the same deduplication key is already queued or running, that job is returned
+# instead. Returns the job and whether it was created.
+
+def enqueue(kind, arguments=None, dedup_key=None, max_attempts=None):
+    arguments = arguments or {}
+    check_arguments(kind, arguments)
+    if dedup_key is not None and len(dedup_key) > Job._meta.get_field('dedup_key').max_length:
+        raise InvalidJob('The deduplication key is too long')
+    dedup_key = dedup_key or make_dedup_key(kind, arguments)
+    if max_attempts is None:
+        max_attempts = getattr(settings, 'JOB_MAX_ATTEMPTS', DEFAULT_MAX_ATTEMPTS)
+
+    for attempt in range(3):
+        existing = Job.objects.filter(dedup_key=dedup_key, status__in=ACTIVE_STATUSES).first()
+        if existing is not None:
+            return existing, False
+        try:
+            with transaction.atomic():
+                job = Job.objects.create(
+                    kind=kind,
+                    arguments=arguments,
+                    dedup_key=dedup_key,
+                    max_attempts=max_attempts
+                )
+            return job, True
+        except IntegrityError:
+            if attempt == 2:
+                raise
+
+
+# The ids of queued jobs that are ready to run are returned, oldest first.
+
+def ready_jobs(limit, kinds=None):
+    jobs = Job.objects.filter(status='queued', run_after__lte=timezone.now())
+    if kinds:
+        jobs = jobs.filter(kind__in=kinds)
+    return list(jobs.order_by('run_after', 'job_id').values_list('job_id', flat=True)[:limit])
+
+
+# A job is claimed by moving it from queued to running. The update only matches while the job is still queued,
+# so if two workers try to claim the same job only one of them succeeds. Returns whether this worker claimed it.
+
+def claim(job_id):
+    now = timezone.now()
+    return Job.objects.filter(job_id=job_id, status='queued').update(
+        status='running',
+        attempts=F('attempts') + 1,
+        progress=0,
+        progress_message='',
+        started_at=now,
+        heartbeat_at=now,
+        finished_at=None
+    ) == 1
+
+
+def heartbeat(job_ids):
+    if job_ids:
+        Job.objects.filter(job_id__in=job_ids, status='running').update(heartbeat_at=timezone.now())
+
+
+# Progress is saved as a fraction between 0 and 1 with a short message. Saving progress also counts as a heartbeat.
+
+def report_progress(job_id, progress, message=''):
+    Job.objects.filter(job_id=job_id, status='running').update(
+        progress=min(1.0, max(0.0, progress)),
+        progress_message=message[:200],
+        heartbeat_at=timezone.now()
+    )
+
+
+# Running jobs that have had no heartbeat for stale_after seconds were left behind by a worker that stopped.
+# They are queued again if they have attempts left, and failed otherwise. Returns how many were queued and failed.
+
+def requeue_stale(seconds=None):
+    now = timezone.now()
+    stale = Job.objects.filter(
+        status='running',
+        heartbeat_at__lt=now - timedelta(seconds=stale_after() if seconds is None else seconds)
+    )
+    message = 'The worker running this job stopped'
+    requeued = stale.filter(attempts__lt=F('max_attempts')).update(status='queued', run_after=now, error=message)
+    failed = stale.filter(attempts__gte=F('max_attempts')).update(status='failed', finished_at=now, error=message)
+    return requeued, failed
+
+
+# Worker processes ignore interrupts, so that stopping runjobs lets the running jobs finish rather than
+# cutting them off part way through.
+
+def worker_started():
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+
+
+# A claimed job is run in a worker process. The job is only updated while it still has the attempt number it was
+# claimed with, so a job that was queued again after a missed heartbeat is not overwritten by this run.
+# Returns the job's new status.
+
+def run_job(job_id):
+    try:
+        job = Job.objects.get(job_id=job_id)
+        current = Job.objects.filter(job_id=job_id, status='running', attempts=job.attempts)
+
+        try:
+            job_handler = HANDLERS.get(job.kind)
+            if job_handler is None:
+                raise JobFailed(f"Unknown job {job.kind}")
+            result = job_handler(functools.partial(report_progress, job_id), **job.arguments)
+        except Exception as error:
+            logger.exception('Job %d (%s) failed', job_id, job.kind)
+            details = ''.join(traceback.format_exception(error))[-5000:]
+
+            if job.attempts < job.max_attempts and not isinstance(error, JobFailed):
+                delay = getattr(settings, 'JOB_RETRY_DELAY', DEFAULT_RETRY_DELAY) * 2 ** (job.attempts - 1)
+                current.update(status='queued', run_after=timezone.now() + timedelta(seconds=delay), error=details)
+                return 'queued'
+            current.update(status='failed', finished_at=timezone.now(), error=details)
+            return 'failed'
+
+        current.update(
+            status='succeeded',
+            progress=1,
+            result=result,
+            error='',
+            finished_at=timezone.now()
+        )
+        return 'succeeded'
+    finally:
+        connection.close()
+
+
+# Quizzes are assigned in the same way as the createQuiz action. If chosen, the questions for the new quizzes
+# are chosen straight away in batches, as the job is already running in the background.
+
+@handler('create_quizzes')
+def create_quizzes(progress, teacher_id, subject_ids=None, forms=None, student_ids=None, pregenerate=None):
+    teacher = Teacher.objects.filter(teacher_id=teacher_id).first()
+    if teacher is None:
+        raise JobFailed(f"Teacher {teacher_id} not found")
+
+    new_quizzes, existing_quizzes = assignment.assign_quizzes(teacher, subject_ids, forms, student_ids)
+    quiz_ids = [quiz.quiz_id for quiz in new_quizzes]
+    progress(0.5, f"Assigned {len(quiz_ids)} quizzes")
+
+    if pregeneration.pregenerate_enabled(pregenerate):
+        batch_size = getattr(settings, 'QUIZ_PREGENERATE_BATCH_SIZE', pregeneration.DEFAULT_BATCH_SIZE)
+        for start in range(0, len(quiz_ids), batch_size):
+            pregeneration.pregenerate(quiz_ids[start:start + batch_size])
+            done = min(start + batch_size, len(quiz_ids))
+            progress(0.5 + 0.5 * done / len(quiz_ids), f"Chose questions for {done} of {len(quiz_ids)} quizzes")
+
+    return {
+        'quiz_ids': quiz_ids,
+        'existing_quiz_ids': sorted(existing_quizzes.values()),
+        'teacher_id': teacher.teacher_id
+    }
+
+
+# The progress rollups are rebuilt from the BKT table, either for one form in one subject or for everything.
+
+@handler('rebuild_rollups')
+def rebuild_rollups(progress, form=None, subject_id=None):
+    if bool(form) != bool(subject_id):
+        raise JobFailed('Give both form and subject_id, or neither')
+    if form:
+        return {'rebuilt': rollups.rebuild_class_rollups(form, subject_id)}
+    return {'rebuilt': rollups.rebuild_rollups()}
+
+
+# BKT values are recalculated with the replaybkt and fitbkt commands, keeping the end of their output as the result.
+
+def command_output(name, **options):
+    output = io.StringIO()
+    call_command(name, stdout=output, **options)
+    return {'output': output.getvalue().splitlines()[-50:]}
+
+
+@handler('replay_bkt')
+def replay_bkt(progress, question_ids):
+    return command_output('replaybkt', question=list(question_ids))
+
+
+@handler('fit_bkt')
+def fit_bkt(progress, subtopic_ids=None, per_student=False, processes=1):
+    return command_output('fitbkt', subtopic=subtopic_ids or None, per_student=per_student, processes=processes)
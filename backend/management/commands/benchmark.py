@@ -0,0 +1,236 @@
+# Management command to benchmark the main API actions against the data created by seedschool.
+# Each action is called through the DRF test client, reporting p50 and p95 latency, the number of queries and
+# peak memory. Results can be saved as a baseline, and later runs compared against it.
+#
+# Every request is run inside a transaction that is rolled back afterwards, so the benchmark does not change
+# the data and every run starts from the same state. Answer events are captured rather than written, as they
+# would otherwise be saved outside the transaction and added to the answer history.
+
+import json
+import random
+import statistics
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from backend import events
+from backend.models import Question, Quiz, Student, Teacher, User
+
+
+ACTIONS = (
+    'checkLogin', 'generateQuiz', 'updateBKT', 'submitQuiz', 'createQuiz', 'getQuizzes', 'getProgressData'
+)
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks the main API actions against data created by the seedschool command.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--prefix', default='Z', help='Prefix used when the data was created with seedschool.')
+        parser.add_argument('--password', default='password', help='Password used when the data was created.')
+        parser.add_argument('--iterations', type=int, default=50)
+        parser.add_argument('--warmup', type=int, default=5)
+        parser.add_argument('--action', action='append', choices=ACTIONS, help='Only benchmark the given actions.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--save-baseline', help='File to save the results to as a baseline.')
+        parser.add_argument('--compare', help='Baseline file to compare the results with.')
+        parser.add_argument(
+            '--tolerance',
+            type=float,
+            default=0.2,
+            help='Fraction a result can be worse than the baseline before it is reported as a regression.'
+        )
+
+    def handle(self, *args, **options):
+        self.client = APIClient()
+        self.random = random.Random(options['seed'])
+        self.prefix = options['prefix']
+        self.password = options['password']
+        self.load_targets()
+
+        results = {}
+        events.writer.flush()
+        with events.writer.capture():
+            for action in options['action'] or ACTIONS:
+                results[action] = self.run_action(action, options['iterations'], options['warmup'])
+                self.report(action, results[action])
+
+        if options['save_baseline']:
+            with open(options['save_baseline'], 'w') as baseline_file:
+                json.dump(results, baseline_file, indent=2)
+            self.stdout.write(f"Baseline saved to {options['save_baseline']}")
+
+        if options['compare']:
+            self.compare(results, options['compare'], options['tolerance'])
+
+
+    # A sample of the seeded users, quizzes and questions is loaded, for requests to be chosen from.
+
+    def load_targets(self):
+        self.student_emails = list(
+            User.objects.filter(user_id__startswith=self.prefix, user_type='student')
+            .values_list('email', flat=True)[:1000]
+        )
+        self.student_ids = list(
+            Student.objects.filter(student_id__startswith=self.prefix).values_list('student_id', flat=True)[:1000]
+        )
+        self.teachers = list(
+            Teacher.objects.filter(teacher_id__startswith=self.prefix)
+            .values_list('teacher_id', 'subject_id', 'form')[:1000]
+        )
+        self.question_ids = list(
+            Question.objects.filter(question_id__startswith=self.prefix).values_list('question_id', flat=True)[:5000]
+        )
+        self.open_quizzes = list(
+            Quiz.objects.filter(student__student_id__startswith=self.prefix, completed=False)
+            .values_list('quiz_id', 'student_id')[:1000]
+        )
+        if not self.student_ids or not self.teachers:
+            raise CommandError(f"No data found for prefix {self.prefix}, run seedschool first")
+
+
+    # Each action returns a function that sends one request. Any setup runs before the timer starts.
+
+    def make_request(self, action):
+        if action == 'checkLogin':
+            email = self.random.choice(self.student_emails)
+            return lambda: self.client.post(
+                '/api/login/checkLogin/', {'email': email, 'password': self.password}, format='json'
+            )
+
+        if action == 'generateQuiz':
+            if not self.open_quizzes:
+                raise CommandError('generateQuiz needs open quizzes, run seedschool with --quizzes')
+            quiz_id, student_id = self.random.choice(self.open_quizzes)
+            return lambda: self.client.get(f"/api/quiz/generateQuiz/?quiz_id={quiz_id}&student_id={student_id}")
+
+        if action == 'updateBKT':
+            data = {
+                'student_id': self.random.choice(self.student_ids),
+                'question_id': self.random.choice(self.question_ids),
+                'selected_answer': self.random.choice(['Answer A', 'Answer B', 'Answer C', 'Answer D'])
+            }
+            return lambda: self.client.post('/api/bktvalues/updateBKT/', data, format='json')
+
+
+        # The quiz is generated before the timer starts, so that only submitting the whole attempt is timed.
+
+        if action == 'submitQuiz':
+            if not self.open_quizzes:
+                raise CommandError('submitQuiz needs open quizzes, run seedschool with --quizzes')
+            quiz_id, student_id = self.random.choice(self.open_quizzes)
+            quiz = self.client.get(f"/api/quiz/generateQuiz/?quiz_id={quiz_id}&student_id={student_id}").json()
+            data = {
+                'session_id': quiz['session_id'],
+                'answers': [
+                    {
+                        'question_id': question['question_id'],
+                        'selected_answer': self.random.choice([
+                            question['answer_1'], question['answer_2'], question['answer_3'], question['answer_4']
+                        ])
+                    }
+                    for question in quiz['questions']
+                ]
+            }
+            return lambda: self.client.post('/api/quiz/submitQuiz/', data, format='json')
+
+
+        # Open quizzes for the form are closed first, so that a whole form's quizzes are created each time.
+
+        if action == 'createQuiz':
+            teacher_id, subject_id, form = self.random.choice(self.teachers)
+            Quiz.objects.filter(student__form=form, subject_id=subject_id, completed=False).update(completed=True)
+            data = {'teacher_id': teacher_id, 'subject_id': subject_id}
+            return lambda: self.client.post('/api/quiz/createQuiz/', data, format='json')
+
+        if action == 'getQuizzes':
+            student_id = self.random.choice(self.student_ids)
+            return lambda: self.client.get(f"/api/quiz/getQuizzes/?student_id={student_id}")
+
+        if action == 'getProgressData':
+            teacher_id = self.random.choice(self.teachers)[0]
+            return lambda: self.client.get(f"/api/teacher/getProgressData/?teacher_id={teacher_id}")
+
+
+    # A request is timed and its queries are counted, and the transaction is then rolled back.
+
+    def measure(self, action, trace_memory=False):
+        try:
+            with transaction.atomic():
+                request = self.make_request(action)
+                if trace_memory:
+                    tracemalloc.start()
+                with CaptureQueriesContext(connection) as queries:
+                    start = time.perf_counter()
+                    response = request()
+                    latency_ms = (time.perf_counter() - start) * 1000
+                peak_memory = tracemalloc.get_traced_memory()[1] if trace_memory else 0
+                if trace_memory:
+                    tracemalloc.stop()
+                if response.status_code >= 400:
+                    raise CommandError(f"{action} returned status {response.status_code}")
+                raise Rollback(latency_ms, len(queries), peak_memory)
+        except Rollback as result:
+            return result.args
+
+
+    # Memory is traced in a separate request, as tracing slows down the requests being timed.
+
+    def run_action(self, action, iterations, warmup):
+        for _ in range(warmup):
+            self.measure(action)
+
+        latencies = []
+        query_counts = []
+        for _ in range(iterations):
+            latency_ms, query_count, _ = self.measure(action)
+            latencies.append(latency_ms)
+            query_counts.append(query_count)
+
+        peak_memory = self.measure(action, trace_memory=True)[2]
+        latencies.sort()
+        return {
+            'p50_ms': round(statistics.median(latencies), 3),
+            'p95_ms': round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 3),
+            'mean_queries': round(statistics.mean(query_counts), 2),
+            'max_queries': max(query_counts),
+            'peak_memory_kb': round(peak_memory / 1024, 1)
+        }
+
+    def report(self, action, result):
+        self.stdout.write(
+            f"{action:16} p50 {result['p50_ms']:9.2f}ms  p95 {result['p95_ms']:9.2f}ms  "
+            f"queries {result['mean_queries']:7.1f} (max {result['max_queries']})  "
+            f"peak memory {result['peak_memory_kb']:9.1f}KB"
+        )
+
+
+    # Each result is compared with the baseline, with anything worse than the tolerance reported as a regression.
+
+    def compare(self, results, baseline_path, tolerance):
+        with open(baseline_path) as baseline_file:
+            baseline = json.load(baseline_file)
+
+        regressions = []
+        for action, result in results.items():
+            if action not in baseline:
+                continue
+            for measure in ('p50_ms', 'p95_ms', 'mean_queries', 'peak_memory_kb'):
+                before = baseline[action][measure]
+                after = result[measure]
+                change = (after - before) / before if before else 0
+                self.stdout.write(f"{action:16} {measure:15} {before:10.2f} -> {after:10.2f} ({change:+.0%})")
+                if change > tolerance:
+                    regressions.append(f"{action} {measure}")
+
+        if regressions:
+            raise CommandError(f"Regressions against the baseline: {', '.join(regressions)}")
+        self.stdout.write(self.style.SUCCESS('No regressions against the baseline'))
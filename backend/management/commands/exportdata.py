@@ -0,0 +1,41 @@
+# Management command to export progress, quiz results or answer history to a CSV or NDJSON file.
+
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from backend import exports
+
+
+class Command(BaseCommand):
+    help = 'Exports BKT values, quiz results or answer history as CSV or NDJSON.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('export', choices=list(exports.EXPORTS))
+        parser.add_argument('--format', dest='output_format', choices=exports.FORMATS, default='csv')
+        parser.add_argument('--form', help='Only export students in this form.')
+        parser.add_argument('--subject', help='Only export this subject id.')
+        parser.add_argument('--start', help='Only export rows from this date (YYYY-MM-DD).')
+        parser.add_argument('--end', help='Only export rows up to and including this date (YYYY-MM-DD).')
+        parser.add_argument('--output', help='File to write to. Defaults to standard output.')
+        parser.add_argument('--chunk-size', type=int, default=exports.DEFAULT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        try:
+            rows = exports.export_rows(
+                options['export'],
+                form=options['form'],
+                subject_id=options['subject'],
+                start=options['start'],
+                end=options['end'],
+                chunk_size=options['chunk_size']
+            )
+            output = open(options['output'], 'w', newline='') if options['output'] else sys.stdout
+            try:
+                for line in exports.export_lines(options['export'], rows, options['output_format']):
+                    output.write(line)
+            finally:
+                if options['output']:
+                    output.close()
+        except exports.ExportError as error:
+            raise CommandError(str(error))
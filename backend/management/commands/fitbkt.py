@@ -0,0 +1,157 @@
+# Management command to fit the BKT parameters from the answer history.
+# The parameters for each subtopic (and optionally each student) are estimated with expectation-maximisation,
+# with subtopics fitted in parallel across a pool of processes. The fitted values are then written to the BKT rows.
+
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Avg
+
+from backend import events
+from backend.bkt_fit import fit_subtopic
+from backend.models import AnswerEvent, BKT, Question
+
+
+PARAMETER_NAMES = ('p_initial_knowledge', 'p_will_learn', 'p_slip', 'p_guess')
+
+
+class Command(BaseCommand):
+    help = 'Fits the BKT parameters for each subtopic from the recorded answers and saves them to the BKT rows.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--subtopic',
+            action='append',
+            help='Only fit the given subtopic id. Can be given more than once.'
+        )
+        parser.add_argument(
+            '--per-student',
+            action='store_true',
+            help='Also fit parameters for each student, pulled towards the subtopic values.'
+        )
+        parser.add_argument(
+            '--prior-strength',
+            type=float,
+            default=10.0,
+            help='How many answers the subtopic values count as when fitting each student.'
+        )
+        parser.add_argument(
+            '--min-answers',
+            type=int,
+            default=50,
+            help='Subtopics with fewer recorded answers than this are not fitted.'
+        )
+        parser.add_argument(
+            '--processes',
+            type=int,
+            default=None,
+            help='Number of processes to fit subtopics with. Defaults to the number of CPUs.'
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=5000,
+            help='Number of answer events read from the database at a time.'
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Report the fitted parameters without saving them.'
+        )
+
+    def handle(self, *args, **options):
+        events.writer.flush()
+
+        history = AnswerEvent.objects.all()
+        questions = Question.objects.all()
+        if options['subtopic']:
+            history = history.filter(subtopic_id__in=options['subtopic'])
+            questions = questions.filter(subtopic_id__in=options['subtopic'])
+
+
+        # Correctness is worked out from the current correct answers, so that any fixed questions are included.
+        # Answers are grouped by subtopic, with students numbered within each subtopic.
+
+        correct_answers = dict(questions.values_list('question_id', 'correct_answer'))
+        students = defaultdict(dict)
+        answers = defaultdict(lambda: ([], [], []))
+
+        for chunk in events.stream_events(
+            history,
+            chunk_size=options['chunk_size'],
+            fields=('student_id', 'subtopic_id', 'question_id', 'selected_answer', 'answered_at')
+        ):
+            for student_id, subtopic_id, question_id, selected_answer, answered_at in chunk:
+                subtopic_students = students[subtopic_id]
+                student_index = subtopic_students.setdefault(student_id, len(subtopic_students))
+                student_indexes, correct, answer_times = answers[subtopic_id]
+                student_indexes.append(student_index)
+                correct.append(selected_answer == correct_answers.get(question_id))
+                answer_times.append(answered_at.timestamp())
+
+
+        # The current average parameters for each subtopic are used as the starting point for the fit.
+
+        current = {
+            row['subtopic_id']: row
+            for row in BKT.objects.filter(subtopic_id__in=list(answers)).values('subtopic_id').annotate(
+                **{name: Avg(name) for name in PARAMETER_NAMES}
+            )
+        }
+
+        tasks = []
+        for subtopic_id, (student_indexes, correct, answer_times) in answers.items():
+            if len(correct) < options['min_answers'] or subtopic_id not in current:
+                self.stdout.write(f"Skipping {subtopic_id}, {len(correct)} answers recorded")
+                continue
+
+            order = np.argsort(np.array(answer_times), kind='stable')
+            tasks.append((
+                subtopic_id,
+                np.array(student_indexes)[order],
+                np.array(correct)[order],
+                {name: current[subtopic_id][name] for name in PARAMETER_NAMES},
+                options['per_student'],
+                options['prior_strength']
+            ))
+        answers.clear()
+
+
+        # Subtopics are fitted in parallel, and each one is saved as soon as it has finished.
+
+        with ProcessPoolExecutor(max_workers=options['processes']) as pool:
+            for result in pool.map(fit_subtopic, tasks):
+                self.report(result)
+                if not options['dry_run']:
+                    self.save(result, students[result['subtopic_id']])
+
+    def report(self, result):
+        values = ', '.join(f"{name}={result['subtopic'][name]:.3f}" for name in PARAMETER_NAMES)
+        self.stdout.write(
+            f"{result['subtopic_id']}: {values} from {result['answers']} answers "
+            f"(log likelihood {result['log_likelihood']:.1f})"
+        )
+
+
+    # Every BKT row in the subtopic is given the subtopic's parameters, unless it has its own fitted parameters.
+    # Only the parameter columns are written, so p_known is not changed.
+
+    def save(self, result, subtopic_students):
+        student_parameters = {}
+        if result['students'] is not None:
+            student_ids = {index: student_id for student_id, index in subtopic_students.items()}
+            student_parameters = {
+                student_ids[index]: parameters for index, parameters in result['students'].items()
+            }
+
+        bkt_values = list(BKT.objects.filter(subtopic_id=result['subtopic_id']).only('bkt_id', 'student_id'))
+        for bkt in bkt_values:
+            parameters = student_parameters.get(bkt.student_id, result['subtopic'])
+            for name in PARAMETER_NAMES:
+                setattr(bkt, name, round(parameters[name], 4))
+
+        with transaction.atomic():
+            BKT.objects.bulk_update(bkt_values, list(PARAMETER_NAMES), batch_size=1000)
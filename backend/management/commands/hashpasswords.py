@@ -0,0 +1,32 @@
+# Management command to hash any passwords that are still stored as plaintext from before hashing was added.
+# Logins only accept hashed passwords, so this should be run once after upgrading. Running it again does nothing,
+# as passwords that are already hashes are skipped.
+
+from django.core.management.base import BaseCommand
+
+from backend.auth import hash_password, is_hashed
+from backend.models import User
+
+
+class Command(BaseCommand):
+    help = 'Hashes every password that is stored as plaintext.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Count the plaintext passwords without hashing them.')
+
+    def handle(self, *args, **options):
+        users = User.objects.order_by('user_id').values_list('user_id', 'password')
+        plaintext = [(user_id, password) for user_id, password in users.iterator() if not is_hashed(password)]
+
+        if options['dry_run']:
+            self.stdout.write(f"{len(plaintext)} passwords are stored as plaintext")
+            return
+
+
+        # Each password is only replaced if it has not changed since it was read, so a password changed while
+        # this runs is not overwritten.
+
+        hashed = 0
+        for user_id, password in plaintext:
+            hashed += User.objects.filter(user_id=user_id, password=password).update(password=hash_password(password))
+        self.stdout.write(self.style.SUCCESS(f"Hashed {hashed} of {len(plaintext)} plaintext passwords"))
@@ -0,0 +1,257 @@
+# Management command to import questions from a CSV or JSON lines file.
+# The file is read a chunk of rows at a time, and each chunk is checked and then saved in one transaction,
+# so that memory use stays the same however large the file is. Questions that already exist are updated.
+#
+# Each row needs question_id, subject_id, subtopic_id, question_text, answer_1 to answer_4 and correct_answer.
+# If a row also has subject_name or subtopic_name, the subject or subtopic is created (or renamed) as well,
+# so that a new term's questions can be loaded without adding subtopics through the admin first.
+
+import csv
+import json
+import sys
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError, transaction
+
+from backend import cache
+from backend.models import Question, Subject, Subtopic
+from backend.question_bank import bank
+
+
+QUESTION_FIELDS = [
+    'question_id',
+    'subject_id',
+    'subtopic_id',
+    'question_text',
+    'answer_1',
+    'answer_2',
+    'answer_3',
+    'answer_4',
+    'correct_answer',
+]
+ANSWER_FIELDS = ['answer_1', 'answer_2', 'answer_3', 'answer_4']
+
+
+# Rows are read one at a time, so that the whole file is never held in memory. Errors are reported by
+# row number (the first row after the CSV header is row 1). A JSON line that cannot be parsed is passed on
+# as its error, so that it is reported like any other invalid row and the rest of the file is still read.
+
+def read_csv(file):
+    for row in csv.DictReader(file):
+        yield row
+
+
+def read_jsonl(file):
+    for line in file:
+        if line.strip():
+            try:
+                yield json.loads(line)
+            except ValueError as error:
+                yield error
+
+
+def chunks(rows, size):
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+# Field values are trimmed, and a list of problems is returned for each row (empty if the row is valid).
+
+def clean_row(row):
+    return {
+        key: str(value).strip() if value is not None else ''
+        for key, value in row.items()
+        if key is not None
+    }
+
+
+def field_errors(row):
+    errors = []
+    for field in QUESTION_FIELDS:
+        if not row.get(field):
+            errors.append(f"{field} is missing")
+        elif field != 'question_text':
+            max_length = Question._meta.get_field(field).max_length
+            if max_length is not None and len(row[field]) > max_length:
+                errors.append(f"{field} is longer than {max_length} characters")
+
+    for field, model in (('subject_name', Subject), ('subtopic_name', Subtopic)):
+        max_length = model._meta.get_field(field).max_length
+        if len(row.get(field, '')) > max_length:
+            errors.append(f"{field} is longer than {max_length} characters")
+
+    if row.get('correct_answer') and row['correct_answer'] not in [row.get(field) for field in ANSWER_FIELDS]:
+        errors.append("correct_answer does not match any of answer_1 to answer_4")
+    return errors
+
+
+class Command(BaseCommand):
+    help = 'Imports questions from a CSV or JSON lines file, updating any questions that already exist.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV or JSON lines file to import.')
+        parser.add_argument(
+            '--format',
+            dest='input_format',
+            choices=['csv', 'jsonl'],
+            help='Format of the file. Defaults to the file extension.'
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=1000,
+            help='Number of rows checked and saved together in one transaction.'
+        )
+        parser.add_argument(
+            '--errors',
+            help='CSV file to write rows that could not be imported to. Defaults to standard error.'
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Check every row without saving anything.'
+        )
+
+    def handle(self, *args, **options):
+        input_format = options['input_format'] or options['path'].rsplit('.', 1)[-1].lower()
+        if input_format not in ('csv', 'jsonl'):
+            raise CommandError('Unknown file format, use --format csv or --format jsonl')
+        read_rows = read_csv if input_format == 'csv' else read_jsonl
+
+        error_file = open(options['errors'], 'w', newline='') if options['errors'] else sys.stderr
+        self.error_writer = csv.writer(error_file)
+        self.error_writer.writerow(['row', 'question_id', 'error'])
+        self.dry_run = options['dry_run']
+        self.imported = 0
+        self.failed = 0
+
+        try:
+            with open(options['path'], newline='', encoding='utf-8-sig') as file:
+                numbered = enumerate(read_rows(file), start=1)
+                for chunk in chunks(numbered, options['chunk_size']):
+                    self.import_chunk(chunk)
+        except (ValueError, csv.Error) as error:
+            raise CommandError(f"Could not read {options['path']}: {error}")
+        finally:
+            if options['errors']:
+                error_file.close()
+
+
+        # Saving in bulk does not send the model signals, so the question bank and cached subjects
+        # are cleared here instead.
+
+        if self.imported and not self.dry_run:
+            bank.invalidate()
+            cache.invalidate('subject')
+
+        action = 'Checked' if self.dry_run else 'Imported'
+        self.stdout.write(f"{action} {self.imported} questions, {self.failed} rows could not be imported")
+
+    def report(self, line, row, error):
+        self.error_writer.writerow([line, row.get('question_id', ''), error])
+        self.failed += 1
+
+
+    # Each chunk is checked against the subjects and subtopics it refers to, which are read in one query.
+    # A subtopic must belong to the subject given on the row, either already or as created by the row itself.
+
+    def import_chunk(self, chunk):
+        rows = []
+        seen = set()
+        for line, row in chunk:
+            if isinstance(row, ValueError):
+                self.report(line, {}, f"row is not valid JSON: {row}")
+                continue
+            if not isinstance(row, dict):
+                self.report(line, {}, 'row is not an object')
+                continue
+            row = clean_row(row)
+            errors = field_errors(row)
+            if row.get('question_id') in seen:
+                errors.append('question_id appears more than once in the same chunk')
+            if errors:
+                self.report(line, row, '; '.join(errors))
+                continue
+            seen.add(row['question_id'])
+            rows.append((line, row))
+
+        subtopic_subjects = dict(
+            Subtopic.objects
+            .filter(subtopic_id__in={row['subtopic_id'] for _, row in rows})
+            .values_list('subtopic_id', 'subject_id')
+        )
+        subject_ids = set(
+            Subject.objects
+            .filter(subject_id__in={row['subject_id'] for _, row in rows})
+            .values_list('subject_id', flat=True)
+        )
+
+        subjects = {}
+        subtopics = {}
+        questions = []
+        for line, row in rows:
+            if row['subject_id'] not in subject_ids and not row.get('subject_name'):
+                self.report(line, row, f"subject {row['subject_id']} does not exist and no subject_name was given")
+                continue
+            if row['subtopic_id'] not in subtopic_subjects and not row.get('subtopic_name'):
+                self.report(line, row, f"subtopic {row['subtopic_id']} does not exist and no subtopic_name was given")
+                continue
+            subject_id = subtopic_subjects.get(row['subtopic_id'], row['subject_id'])
+            if subject_id != row['subject_id']:
+                self.report(line, row, f"subtopic {row['subtopic_id']} belongs to subject {subject_id}")
+                continue
+
+            if row.get('subject_name'):
+                subjects[row['subject_id']] = Subject(
+                    subject_id=row['subject_id'],
+                    subject_name=row['subject_name']
+                )
+                subject_ids.add(row['subject_id'])
+            if row.get('subtopic_name'):
+                subtopics[row['subtopic_id']] = Subtopic(
+                    subtopic_id=row['subtopic_id'],
+                    subtopic_name=row['subtopic_name'],
+                    subject_id=row['subject_id']
+                )
+                subtopic_subjects[row['subtopic_id']] = row['subject_id']
+            questions.append((line, Question(**{field: row[field] for field in QUESTION_FIELDS})))
+
+        if self.dry_run:
+            self.imported += len(questions)
+            return
+
+
+        # The whole chunk is saved or none of it is. If the database rejects it (for example a subject name
+        # already used by another subject), every row in the chunk is reported with the reason.
+
+        try:
+            with transaction.atomic():
+                Subject.objects.bulk_create(
+                    subjects.values(),
+                    update_conflicts=True,
+                    unique_fields=['subject_id'],
+                    update_fields=['subject_name']
+                )
+                Subtopic.objects.bulk_create(
+                    subtopics.values(),
+                    update_conflicts=True,
+                    unique_fields=['subtopic_id'],
+                    update_fields=['subtopic_name']
+                )
+                Question.objects.bulk_create(
+                    [question for _, question in questions],
+                    update_conflicts=True,
+                    unique_fields=['question_id'],
+                    update_fields=[field for field in QUESTION_FIELDS if field != 'question_id']
+                )
+        except IntegrityError as error:
+            for line, question in questions:
+                self.report(line, {'question_id': question.question_id}, f"chunk was not saved: {error}")
+            return
+
+        self.imported += len(questions)
@@ -0,0 +1,158 @@
+# Management command to load test a running server, comparing the normal API actions with their async versions.
+# Many requests are sent at the same time (like a year group starting a quiz together), and the throughput and
+# latency of each are reported. The server should be running under an ASGI server (such as uvicorn) so that the
+# async views are actually run asynchronously, against data created by the seedschool command.
+#
+# generateQuiz creates quiz sessions and updateBKT changes BKT values, so this should only be run against a
+# separate copy of the database.
+
+import json
+import random
+import statistics
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+
+from backend.models import Question, Quiz, Student, User
+
+
+ACTIONS = ('checkLogin', 'generateQuiz', 'updateBKT', 'getQuizzes')
+
+PATHS = {
+    'checkLogin': ('login', 'checkLogin'),
+    'generateQuiz': ('quiz', 'generateQuiz'),
+    'updateBKT': ('bktvalues', 'updateBKT'),
+    'getQuizzes': ('quiz', 'getQuizzes'),
+}
+
+
+class Command(BaseCommand):
+    help = 'Load tests a running server, comparing the normal API actions with the async ones under /api/async/.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000', help='Address of the running server.')
+        parser.add_argument('--prefix', default='Z', help='Prefix used when the data was created with seedschool.')
+        parser.add_argument('--password', default='password', help='Password used when the data was created.')
+        parser.add_argument('--action', action='append', choices=ACTIONS, help='Only load test the given actions.')
+        parser.add_argument('--concurrency', type=int, default=50, help='Number of requests sent at the same time.')
+        parser.add_argument('--requests', type=int, default=500, help='Number of requests sent for each action.')
+        parser.add_argument(
+            '--mode',
+            choices=['sync', 'async', 'both'],
+            default='both',
+            help='Whether to test the normal actions, the async actions or both.'
+        )
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        self.url = options['url'].rstrip('/')
+        self.random = random.Random(options['seed'])
+        self.password = options['password']
+        self.load_targets(options['prefix'])
+
+        modes = ['sync', 'async'] if options['mode'] == 'both' else [options['mode']]
+        for action in options['action'] or ACTIONS:
+            results = {}
+            for mode in modes:
+                requests = [self.make_request(action, mode) for _ in range(options['requests'])]
+                results[mode] = self.run(requests, options['concurrency'])
+                self.report(action, mode, results[mode])
+
+            if len(results) == 2 and results['sync']['throughput']:
+                gain = results['async']['throughput'] / results['sync']['throughput']
+                self.stdout.write(f"{action:14} async throughput is {gain:.2f}x sync")
+
+
+    # A sample of the seeded users, quizzes and questions is loaded, for requests to be chosen from.
+
+    def load_targets(self, prefix):
+        self.student_emails = list(
+            User.objects.filter(user_id__startswith=prefix, user_type='student')
+            .values_list('email', flat=True)[:1000]
+        )
+        self.student_ids = list(
+            Student.objects.filter(student_id__startswith=prefix).values_list('student_id', flat=True)[:1000]
+        )
+        self.question_ids = list(
+            Question.objects.filter(question_id__startswith=prefix).values_list('question_id', flat=True)[:5000]
+        )
+        self.open_quizzes = list(
+            Quiz.objects.filter(student__student_id__startswith=prefix, completed=False)
+            .values_list('quiz_id', 'student_id')[:1000]
+        )
+        if not self.student_ids or not self.question_ids:
+            raise CommandError(f"No data found for prefix {prefix}, run seedschool first")
+
+
+    # Each request is built before the test starts, as a url and an optional JSON body.
+
+    def make_request(self, action, mode):
+        viewset, name = PATHS[action]
+        path = f"{self.url}/api/{'async/' if mode == 'async' else ''}{viewset}/{name}/"
+
+        if action == 'checkLogin':
+            return path, {'email': self.random.choice(self.student_emails), 'password': self.password}
+
+        if action == 'generateQuiz':
+            if not self.open_quizzes:
+                raise CommandError('generateQuiz needs open quizzes, run seedschool with --quizzes')
+            quiz_id, student_id = self.random.choice(self.open_quizzes)
+            return f"{path}?quiz_id={quiz_id}&student_id={student_id}", None
+
+        if action == 'updateBKT':
+            return path, {
+                'student_id': self.random.choice(self.student_ids),
+                'question_id': self.random.choice(self.question_ids),
+                'selected_answer': self.random.choice(['Answer A', 'Answer B', 'Answer C', 'Answer D'])
+            }
+
+        return f"{path}?student_id={self.random.choice(self.student_ids)}", None
+
+
+    # A request is sent and timed. Returns the latency and whether it succeeded.
+
+    def send(self, request):
+        url, body = request
+        if body is None:
+            http_request = urllib.request.Request(url)
+        else:
+            http_request = urllib.request.Request(
+                url,
+                data=json.dumps(body).encode('utf-8'),
+                headers={'Content-Type': 'application/json'}
+            )
+
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(http_request, timeout=60) as response:
+                response.read()
+                succeeded = response.status < 400
+        except (urllib.error.URLError, OSError):
+            succeeded = False
+        return (time.perf_counter() - start) * 1000, succeeded
+
+
+    # The requests are sent from a pool of threads, so that the given number are waiting on the server at once.
+
+    def run(self, requests, concurrency):
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            results = list(pool.map(self.send, requests))
+        elapsed = time.perf_counter() - start
+
+        latencies = sorted(latency for latency, _ in results)
+        return {
+            'throughput': round(len(results) / elapsed, 1) if elapsed else 0,
+            'p50_ms': round(statistics.median(latencies), 3),
+            'p95_ms': round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 3),
+            'errors': sum(1 for _, succeeded in results if not succeeded)
+        }
+
+    def report(self, action, mode, result):
+        self.stdout.write(
+            f"{action:14} {mode:5}  {result['throughput']:8.1f} req/s  p50 {result['p50_ms']:9.2f}ms  "
+            f"p95 {result['p95_ms']:9.2f}ms  errors {result['errors']}"
+        )
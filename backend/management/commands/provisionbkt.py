@@ -0,0 +1,50 @@
+# Management command to create the BKT rows for a whole cohort before they start using the system.
+# Students are worked through in batches, and every missing row for each batch is created in one bulk insert.
+
+from django.core.management.base import BaseCommand
+
+from backend.models import Student, Subtopic
+from backend.provisioning import provision
+
+
+class Command(BaseCommand):
+    help = 'Creates any missing BKT rows for students, using each subtopic\'s default parameters.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--form',
+            action='append',
+            help='Only provision students in this form. Can be given more than once.'
+        )
+        parser.add_argument(
+            '--subject',
+            action='append',
+            help='Only provision subtopics in this subject. Can be given more than once.'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Number of students provisioned in each transaction.'
+        )
+
+    def handle(self, *args, **options):
+        students = Student.objects.order_by('student_id')
+        if options['form']:
+            students = students.filter(form__in=options['form'])
+        subtopics = Subtopic.objects.order_by('subtopic_id')
+        if options['subject']:
+            subtopics = subtopics.filter(subject_id__in=options['subject'])
+        subtopic_ids = list(subtopics.values_list('subtopic_id', flat=True))
+
+        created = 0
+        batch = []
+        for student_id in students.values_list('student_id', flat=True).iterator(chunk_size=options['batch_size']):
+            batch.append(student_id)
+            if len(batch) == options['batch_size']:
+                created += provision(batch, subtopic_ids)
+                batch = []
+        if batch:
+            created += provision(batch, subtopic_ids)
+
+        self.stdout.write(f"Created {created} BKT rows")
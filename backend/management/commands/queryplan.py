@@ -0,0 +1,94 @@
+# Management command to report the query plan for each of the hot lookups in the API.
+# The report can be saved before indexes are added and compared afterwards, to check that each lookup is
+# using an index rather than scanning the whole table.
+
+import json
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from backend.models import AnswerEvent, BKT, Question, Quiz, Student
+
+
+# Each lookup is built the same way as in the views. The values do not change the plan, so placeholders are used.
+
+def hot_queries():
+    return {
+        'BKT by student and subtopic (updateBKT)':
+            BKT.objects.filter(student_id='S0001', subtopic_id='T1'),
+        'BKT by student and subject (generateQuiz)':
+            BKT.objects.filter(student_id='S0001', subject_id='SUB1').values_list('subtopic_id', 'p_known'),
+        'Questions by subject and subtopic (question bank)':
+            Question.objects.filter(subject_id='SUB1', subtopic_id='T1'),
+        'Open quizzes for a student (getQuizzes)':
+            Quiz.objects.filter(student_id='S0001', completed=False),
+        'Open quizzes for students and subjects (createQuiz)':
+            Quiz.objects.filter(student_id__in=['S0001', 'S0002'], subject_id__in=['SUB1'], completed=False),
+        'Students in a form (getStudents, getProgressData)':
+            Student.objects.filter(form='7A'),
+        'Answer history for a subtopic (replaybkt)':
+            AnswerEvent.objects.filter(subtopic_id='T1', student_id='S0001').order_by('event_id'),
+    }
+
+
+class Command(BaseCommand):
+    help = 'Reports the query plans for the hot lookups, and compares them with a saved report.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--save', help='File to save the query plans to.')
+        parser.add_argument('--compare', help='Saved query plans to compare with.')
+
+    def handle(self, *args, **options):
+        plans = {}
+        for name, queryset in hot_queries().items():
+            plans[name] = queryset.explain()
+
+
+        # A lookup that scans a table without an index is marked, as it slows down as the table grows.
+
+        scans = []
+        for name, plan in plans.items():
+            full_scan = self.is_full_scan(plan)
+            if full_scan:
+                scans.append(name)
+            self.stdout.write(f"{'SCAN ' if full_scan else 'INDEX'} {name}")
+            for line in plan.splitlines():
+                self.stdout.write(f"        {line}")
+
+        if options['compare']:
+            with open(options['compare']) as saved_file:
+                saved = json.load(saved_file)
+            self.stdout.write('')
+            for name, plan in plans.items():
+                before = saved.get(name)
+                if before is None:
+                    continue
+                if before == plan:
+                    self.stdout.write(f"{name}: unchanged")
+                    continue
+                self.stdout.write(f"{name}:")
+                self.stdout.write(f"    before: {' / '.join(before.splitlines())}")
+                self.stdout.write(f"    after:  {' / '.join(plan.splitlines())}")
+
+        if options['save']:
+            with open(options['save'], 'w') as saved_file:
+                json.dump(plans, saved_file, indent=2)
+            self.stdout.write(f"Query plans saved to {options['save']}")
+
+        if scans:
+            self.stdout.write(self.style.WARNING(f"{len(scans)} lookups scan a whole table"))
+        else:
+            self.stdout.write(self.style.SUCCESS('Every lookup uses an index'))
+
+
+    # SQLite reports "SCAN table" for a full scan and "SEARCH table USING INDEX" for an index lookup.
+    # PostgreSQL reports "Seq Scan" for a full scan.
+
+    def is_full_scan(self, plan):
+        for line in plan.splitlines():
+            words = line.split()
+            if 'Seq Scan' in line:
+                return True
+            if 'SCAN' in words and 'USING' not in words and connection.vendor == 'sqlite':
+                return True
+        return False
@@ -0,0 +1,40 @@
+# Management command to rebuild the progress rollups from the BKT table.
+# This should be run once when the rollups are first added, and again after the form of their ids changes, so
+# that rollups saved with the old ids are replaced. It can be run at any time to check that the rollups still
+# match the BKT values.
+
+from django.core.management.base import BaseCommand, CommandError
+
+from backend import rollups
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the progress rollups from the BKT table and checks them against it.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check-only',
+            action='store_true',
+            help='Only compare the stored rollups with the BKT table, without rebuilding them.'
+        )
+
+    def handle(self, *args, **options):
+        if not options['check_only']:
+            counts = rollups.rebuild_rollups()
+            for model_name, count in counts.items():
+                self.stdout.write(f"Rebuilt {count} {model_name} rows")
+
+
+        # Rollups are compared with the live BKT table and any differences are listed.
+
+        mismatches = rollups.compare_rollups()
+        for model_name, rollup_id, stored, live in mismatches:
+            self.stdout.write(
+                f"{model_name} {rollup_id}: stored total {stored[0]:.4f} over {stored[1]} rows, "
+                f"BKT table total {live[0]:.4f} over {live[1]} rows"
+            )
+
+        if mismatches:
+            raise CommandError(f"{len(mismatches)} rollups do not match the BKT table")
+
+        self.stdout.write(self.style.SUCCESS('Rollups match the BKT table'))
@@ -0,0 +1,230 @@
+# Management command to recalculate BKT values from the answer history.
+# This is used when a question's correct answer was wrong, so that every student who answered it has their
+# p_known recalculated as if the answers had been marked correctly in the first place.
+#
+# This can be run while students are answering questions. Only answers old enough to have been written by every
+# server process's event buffer are replayed, and the BKT rows are locked while they are saved. A row that has
+# been changed by a newer answer since is left alone and reported, and the command fails so that it can be run
+# again later (the replay_bkt job does this automatically). The replayed answer events are saved with their
+# corrected values, so running it again gives the same result.
+
+from datetime import timedelta
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from backend import events, rollups
+from backend.bkt_engine import replay
+from backend.models import AnswerEvent, BKT, Question, Student
+
+
+class Command(BaseCommand):
+    help = 'Replays the answer history to recalculate BKT values after correct answers have been fixed.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--question',
+            action='append',
+            required=True,
+            help='Question id whose correct answer has been fixed. Can be given more than once.'
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=5000,
+            help='Number of answer events read from the database at a time.'
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Report how many BKT values would change without saving them.'
+        )
+        parser.add_argument(
+            '--settle-seconds',
+            type=int,
+            default=None,
+            help='Only answers given at least this long ago are replayed. Defaults to twice the answer event '
+                 'flush interval, so that every process has written them.'
+        )
+
+    def handle(self, *args, **options):
+        question_ids = options['question']
+        subtopic_ids = set(
+            Question.objects.filter(question_id__in=question_ids).values_list('subtopic_id', flat=True)
+        )
+        if not subtopic_ids:
+            raise CommandError('None of the given questions exist')
+
+
+        # Any answers still waiting in this process's buffer are written first. Other processes write theirs within
+        # two flush intervals, so only answers given before then are replayed.
+
+        events.writer.flush()
+        settle_seconds = options['settle_seconds']
+        if settle_seconds is None:
+            settle_seconds = 2 * events.writer.flush_seconds + 1
+        cutoff = timezone.now() - timedelta(seconds=settle_seconds)
+
+
+        # Only the students who answered one of the questions are affected, but their whole history
+        # in each subtopic is replayed, as every later answer depends on the value before it.
+        # Correctness is worked out again from the selected answer and the current correct answers.
+
+        affected_students = AnswerEvent.objects.filter(question_id__in=question_ids).values('student_id')
+        history = AnswerEvent.objects.filter(
+            subtopic_id__in=subtopic_ids,
+            student_id__in=affected_students,
+            answered_at__lte=cutoff
+        )
+        correct_answers = dict(
+            Question.objects.filter(subtopic_id__in=subtopic_ids).values_list('question_id', 'correct_answer')
+        )
+
+        pairs = {}
+        event_ids = []
+        pair_index = []
+        correct = []
+        answered_at = []
+        recorded = []
+
+        for chunk in events.stream_events(
+            history,
+            chunk_size=options['chunk_size'],
+            fields=(
+                'pk', 'student_id', 'subtopic_id', 'question_id', 'selected_answer', 'answered_at',
+                'correct', 'prior_p_known', 'posterior_p_known'
+            )
+        ):
+            for event_id, student_id, subtopic_id, question_id, selected_answer, answer_time, *values in chunk:
+                pair = (student_id, subtopic_id)
+                if pair not in pairs:
+                    pairs[pair] = len(pairs)
+                event_ids.append(event_id)
+                pair_index.append(pairs[pair])
+                correct.append(selected_answer == correct_answers.get(question_id))
+                answered_at.append(answer_time.timestamp())
+                recorded.append(values)
+
+        if not pairs:
+            self.stdout.write('No recorded answers for the given questions')
+            return
+
+
+        # Events are written in batches, so answers are put back into the order they were given.
+        # The replay then starts from the value each student had before their first recorded answer.
+        # The value after their last recorded answer is what their BKT row should still hold, unless a newer
+        # answer has changed it.
+
+        order = np.argsort(np.array(answered_at), kind='stable')
+        event_ids = np.array(event_ids)[order]
+        pair_index = np.array(pair_index)[order]
+        correct = np.array(correct)[order]
+        recorded_correct, recorded_prior, recorded_posterior = (
+            np.array(column)[order] for column in zip(*recorded)
+        )
+
+        first_answers = np.unique(pair_index, return_index=True)[1]
+        starting_p_known = np.empty(len(pairs))
+        starting_p_known[pair_index[first_answers]] = recorded_prior[first_answers]
+
+        last_answers = len(pair_index) - 1 - np.unique(pair_index[::-1], return_index=True)[1]
+        expected_p_known = np.empty(len(pairs))
+        expected_p_known[pair_index[last_answers]] = recorded_posterior[last_answers]
+
+        forms = dict(
+            Student.objects.filter(student_id__in=affected_students).values_list('student_id', 'form')
+        )
+
+
+        # The BKT rows are locked until the new values are saved, so that no answer can change them in between.
+        # The rollup changes are worked out from the locked values.
+
+        with transaction.atomic():
+            bkt_rows = BKT.objects.filter(subtopic_id__in=subtopic_ids, student_id__in=affected_students)
+            if not options['dry_run']:
+                bkt_rows = bkt_rows.select_for_update()
+            bkt_values = {(bkt.student_id, bkt.subtopic_id): bkt for bkt in bkt_rows}
+
+            parameters = np.array([
+                (bkt_values[pair].p_slip, bkt_values[pair].p_guess, bkt_values[pair].p_will_learn)
+                if pair in bkt_values else (0.0, 0.0, 0.0)
+                for pair in pairs
+            ])
+
+            final_p_known, prior_p_known, posterior_p_known = replay(
+                starting_p_known,
+                parameters[:, 0],
+                parameters[:, 1],
+                parameters[:, 2],
+                pair_index,
+                correct
+            )
+
+
+            # Rows that no longer hold the value from the last recorded answer have been answered since, and are
+            # skipped. Only BKT values that have changed are saved.
+
+            replayed = np.zeros(len(pairs), dtype=bool)
+            changed = []
+            changes = []
+            busy = 0
+            for pair, index in pairs.items():
+                bkt = bkt_values.get(pair)
+                if bkt is None:
+                    continue
+                if abs(bkt.p_known - expected_p_known[index]) > 1e-9:
+                    busy += 1
+                    continue
+                replayed[index] = True
+                if bkt.p_known == final_p_known[index]:
+                    continue
+                changes.append((
+                    bkt.student_id,
+                    forms[bkt.student_id],
+                    bkt.subject_id,
+                    bkt.subtopic_id,
+                    float(final_p_known[index]) - bkt.p_known,
+                    0
+                ))
+                bkt.p_known = float(final_p_known[index])
+                bkt.version += 1
+                changed.append(bkt)
+
+
+            # The replayed answer events are saved with their corrected values.
+
+            event_changed = replayed[pair_index] & (
+                (correct != recorded_correct)
+                | (prior_p_known != recorded_prior)
+                | (posterior_p_known != recorded_posterior)
+            )
+            corrected_events = [
+                AnswerEvent(
+                    event_id=int(event_ids[answer]),
+                    correct=bool(correct[answer]),
+                    prior_p_known=float(prior_p_known[answer]),
+                    posterior_p_known=float(posterior_p_known[answer])
+                )
+                for answer in np.flatnonzero(event_changed)
+            ]
+
+            self.stdout.write(
+                f"Replayed {len(pair_index)} answers for {len(pairs)} student subtopics, "
+                f"{len(changed)} BKT values changed"
+            )
+
+            if not options['dry_run']:
+                BKT.objects.bulk_update(changed, ['p_known', 'version'], batch_size=1000)
+                AnswerEvent.objects.bulk_update(
+                    corrected_events, ['correct', 'prior_p_known', 'posterior_p_known'], batch_size=1000
+                )
+                rollups.apply_changes(changes)
+
+        if busy:
+            raise CommandError(
+                f"{busy} BKT values were changed by newer answers and were not replayed, run this again later"
+            )
+        if not options['dry_run'] and changed:
+            self.stdout.write(self.style.SUCCESS('BKT values saved'))
@@ -0,0 +1,145 @@
+# Management command to run queued background jobs (see jobs.py). Jobs are run on a pool of processes, so that
+# slow jobs can use several CPUs and a job that crashes cannot take the command down with it. This should be kept
+# running alongside the web server (for example as a systemd service). Several copies can be run at once, as
+# each job can only be claimed by one of them.
+#
+# Stopping the command (with Ctrl+C or SIGTERM) stops new jobs from being claimed, and waits for the running
+# jobs to finish.
+
+import multiprocessing
+import signal
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from backend import jobs
+
+
+class Command(BaseCommand):
+    help = 'Runs queued background jobs on a pool of processes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--processes',
+            type=int,
+            default=None,
+            help='Number of jobs run at the same time. Defaults to JOB_WORKER_PROCESSES or the number of CPUs.'
+        )
+        parser.add_argument(
+            '--poll-interval',
+            type=float,
+            default=None,
+            help='Seconds to wait between checks for new jobs. Defaults to JOB_POLL_INTERVAL or 1.'
+        )
+        parser.add_argument(
+            '--stale-after',
+            type=int,
+            default=None,
+            help='Seconds a running job can go without a heartbeat before it is queued again.'
+        )
+        parser.add_argument(
+            '--kind',
+            action='append',
+            choices=sorted(jobs.HANDLERS),
+            help='Only run the given kind of job. Can be given more than once.'
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Run the jobs that are ready now, wait for them to finish and then stop.'
+        )
+
+    def handle(self, *args, **options):
+        processes = options['processes'] or jobs.worker_processes()
+        poll_interval = options['poll_interval'] or jobs.poll_interval()
+        if processes < 1:
+            raise CommandError('--processes must be at least 1')
+
+        self.stopping = False
+        signal.signal(signal.SIGINT, self.stop)
+        signal.signal(signal.SIGTERM, self.stop)
+
+        self.pool = self.make_pool(processes)
+        running = {}
+        self.stdout.write(f"Running jobs on {processes} processes")
+
+        try:
+            while not self.stopping:
+                requeued, failed = jobs.requeue_stale(options['stale_after'])
+                if requeued or failed:
+                    self.stdout.write(f"Queued {requeued} jobs again and failed {failed} after their worker stopped")
+
+                if self.finish(running):
+                    self.stderr.write('A worker process stopped unexpectedly, starting a new pool')
+                    self.pool.shutdown(wait=False)
+                    self.pool = self.make_pool(processes)
+                jobs.heartbeat(list(running.values()))
+
+
+                # Ready jobs are claimed until every process is busy. Database connections are closed before each
+                # job is handed to the pool, as a newly forked process must not share this process's connection.
+
+                claimed = 0
+                for job_id in jobs.ready_jobs(processes - len(running), options['kind']):
+                    if jobs.claim(job_id):
+                        connections.close_all()
+                        running[self.pool.submit(jobs.run_job, job_id)] = job_id
+                        claimed += 1
+                        self.stdout.write(f"Started job {job_id}")
+
+                if options['once'] and not running:
+                    break
+                if not claimed:
+                    self.wait(running, poll_interval)
+
+
+            # Running jobs are waited for, with their heartbeats kept up so that they are not queued again.
+
+            if running:
+                self.stdout.write(f"Waiting for {len(running)} running jobs to finish")
+            while running:
+                self.wait(running, poll_interval)
+                jobs.heartbeat(list(running.values()))
+                self.finish(running)
+        finally:
+            self.pool.shutdown(wait=True)
+
+
+    # Worker processes are forked from this one, so that they start with Django already set up.
+
+    def make_pool(self, processes):
+        return ProcessPoolExecutor(
+            max_workers=processes,
+            mp_context=multiprocessing.get_context('fork'),
+            initializer=jobs.worker_started
+        )
+
+    def stop(self, signum, frame):
+        self.stopping = True
+
+    def wait(self, running, timeout):
+        if running:
+            wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+        else:
+            time.sleep(timeout)
+
+
+    # Finished jobs are reported and removed from the running jobs. If a worker process was killed, the pool can no
+    # longer be used and its jobs are left running, to be queued again once their heartbeat is stale.
+    # Returns whether the pool was broken.
+
+    def finish(self, running):
+        broken = False
+        for future in [future for future in running if future.done()]:
+            job_id = running.pop(future)
+            try:
+                self.stdout.write(f"Job {job_id} {future.result()}")
+            except BrokenProcessPool:
+                broken = True
+                self.stderr.write(f"Job {job_id} stopped when its worker process stopped")
+            except Exception as error:
+                self.stderr.write(f"Job {job_id} could not be run: {error}")
+        return broken
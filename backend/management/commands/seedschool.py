@@ -0,0 +1,194 @@
+# Management command to fill the database with a synthetic school, so that the backend can be measured at a
+# realistic size. Every id starts with the given prefix, and generated users have @bench.example emails, so that
+# the data can be removed again with --clear without touching any real data.
+
+import random
+import re
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from backend import question_bank, rollups
+from backend.auth import hash_password
+from backend.models import BKT, Question, Quiz, Student, Subject, Subtopic, Teacher, User
+
+
+BATCH_SIZE = 2000
+DIGITS = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+
+
+# Numbers are written in base 36, so that thousands of users fit in the five character ids used by the models.
+
+def base36(number, width):
+    text = ''
+    for _ in range(width):
+        number, digit = divmod(number, 36)
+        text = DIGITS[digit] + text
+    if number:
+        raise CommandError('Too many rows for the id width, use a smaller cohort')
+    return text
+
+
+class Command(BaseCommand):
+    help = 'Fills the database with a synthetic school for benchmarking.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--prefix', default='Z', help='Single character that every generated id starts with.')
+        parser.add_argument('--students', type=int, default=5000)
+        parser.add_argument('--form-size', type=int, default=30, help='Number of students in each form.')
+        parser.add_argument('--subjects', type=int, default=6)
+        parser.add_argument('--subtopics', type=int, default=6, help='Number of subtopics in each subject.')
+        parser.add_argument('--questions', type=int, default=200, help='Number of questions in each subtopic.')
+        parser.add_argument('--quizzes', action='store_true', help='Assign an open quiz in every subject to every student.')
+        parser.add_argument('--password', default='password', help='Password given to every generated user.')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed, so that the same school is generated each time.')
+        parser.add_argument('--clear', action='store_true', help='Remove the data for the prefix instead of generating it.')
+
+    def handle(self, *args, **options):
+        prefix = options['prefix']
+        if len(prefix) != 1:
+            raise CommandError('The prefix must be a single character')
+
+        with transaction.atomic():
+            self.clear(prefix)
+            if not options['clear']:
+                self.generate(prefix, options)
+
+        question_bank.bank.invalidate()
+
+
+    # Deleting the users and subjects removes everything else through the foreign keys. Only rows that match the
+    # generated ids and names exactly are deleted, so real users or subjects that start with the prefix are kept.
+    # Subjects are deleted first, taking their BKT rows and rollups with them, so that deleting each student
+    # does not rebuild its class's rollups.
+
+    def clear(self, prefix):
+        marker = re.escape(prefix)
+        Subject.objects.filter(
+            subject_id__regex=rf'^{marker}SUB[0-9]+$',
+            subject_name__regex=rf'^{marker} Subject [0-9]+$'
+        ).delete()
+        User.objects.filter(
+            user_id__regex=rf'^{marker}[0-9A-Z]{{4}}$',
+            email__regex=rf'^{re.escape(prefix.lower())}[0-9]+@bench\.example$'
+        ).delete()
+
+    def generate(self, prefix, options):
+        generator = random.Random(options['seed'])
+        student_count = options['students']
+        form_count = -(-student_count // options['form_size'])
+        forms = [prefix + base36(number, 2) for number in range(form_count)]
+
+
+        # Subjects, subtopics and questions are created first.
+
+        subjects = [
+            Subject(subject_id=f"{prefix}SUB{number}", subject_name=f"{prefix} Subject {number}")
+            for number in range(options['subjects'])
+        ]
+        subtopics = [
+            Subtopic(subtopic_id=f"{subject.subject_id}T{number}", subtopic_name=f"Subtopic {number}", subject=subject)
+            for subject in subjects
+            for number in range(options['subtopics'])
+        ]
+        Subject.objects.bulk_create(subjects)
+        Subtopic.objects.bulk_create(subtopics)
+        Question.objects.bulk_create(
+            (
+                Question(
+                    question_id=f"{subtopic.subtopic_id}Q{number}",
+                    subject_id=subtopic.subject_id,
+                    subtopic=subtopic,
+                    question_text=f"Question {number} for {subtopic.subtopic_id}",
+                    answer_1='Answer A',
+                    answer_2='Answer B',
+                    answer_3='Answer C',
+                    answer_4='Answer D',
+                    correct_answer=generator.choice(['Answer A', 'Answer B', 'Answer C', 'Answer D'])
+                )
+                for subtopic in subtopics
+                for number in range(options['questions'])
+            ),
+            batch_size=BATCH_SIZE
+        )
+        self.stdout.write(f"Created {len(subjects)} subjects, {len(subtopics)} subtopics and questions")
+
+
+        # Students are split into forms, and each form has one teacher for each subject.
+
+        # The password is hashed once and the same hash given to every user, as hashing is deliberately slow.
+
+        password = hash_password(options['password'])
+        student_ids = [prefix + base36(number, 4) for number in range(student_count)]
+        teacher_numbers = range(student_count, student_count + form_count * len(subjects))
+        users = [
+            User(
+                user_id=prefix + base36(number, 4),
+                email=f"{prefix.lower()}{number}@bench.example",
+                password=password,
+                user_type='student' if number < student_count else 'teacher',
+                first_name=f"First{number}",
+                surname=f"Surname{number}"
+            )
+            for number in range(student_count + form_count * len(subjects))
+        ]
+        User.objects.bulk_create(users, batch_size=BATCH_SIZE)
+
+        students = [
+            Student(student_id=student_id, user_id_id=student_id, form=forms[number // options['form_size']])
+            for number, student_id in enumerate(student_ids)
+        ]
+        Student.objects.bulk_create(students, batch_size=BATCH_SIZE)
+
+        teachers = []
+        for index, number in enumerate(teacher_numbers):
+            teacher_id = prefix + base36(number, 4)
+            teachers.append(Teacher(
+                teacher_id=teacher_id,
+                user_id_id=teacher_id,
+                form=forms[index // len(subjects)],
+                subject=subjects[index % len(subjects)]
+            ))
+        Teacher.objects.bulk_create(teachers, batch_size=BATCH_SIZE)
+        self.stdout.write(f"Created {len(students)} students in {len(forms)} forms and {len(teachers)} teachers")
+
+
+        # Every student is given a BKT row for every subtopic, starting from a random level of knowledge.
+
+        BKT.objects.bulk_create(
+            (
+                BKT(
+                    bkt_id=f"{student.student_id}-{subtopic.subtopic_id}",
+                    student=student,
+                    subject_id=subtopic.subject_id,
+                    subtopic=subtopic,
+                    p_initial_knowledge=0.3,
+                    p_will_learn=0.1,
+                    p_slip=0.1,
+                    p_guess=0.2,
+                    p_known=round(generator.uniform(0.05, 0.95), 2)
+                )
+                for student in students
+                for subtopic in subtopics
+            ),
+            batch_size=BATCH_SIZE
+        )
+
+        if options['quizzes']:
+            form_students = {}
+            for student in students:
+                form_students.setdefault(student.form, []).append(student)
+            Quiz.objects.bulk_create(
+                (
+                    Quiz(teacher=teacher, student=student, subject_id=teacher.subject_id)
+                    for teacher in teachers
+                    for student in form_students[teacher.form]
+                ),
+                batch_size=BATCH_SIZE
+            )
+
+        for form in forms:
+            for subject in subjects:
+                rollups.build_class_rollups(form, subject.subject_id)
+
+        self.stdout.write(self.style.SUCCESS(f"Created {len(students) * len(subtopics)} BKT rows"))
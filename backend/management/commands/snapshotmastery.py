@@ -0,0 +1,99 @@
+# Management command to record a snapshot of every student's p_known values, for the progress trends.
+# This is run periodically (for example nightly, from cron). Students are worked through in batches, and each
+# batch's series are read, added to and saved in one transaction.
+
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from backend import mastery_series
+from backend.models import BKT, MasterySeries, Student
+
+
+class Command(BaseCommand):
+    help = 'Records a snapshot of every student\'s p_known values in their mastery series.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--form',
+            action='append',
+            help='Only snapshot students in this form. Can be given more than once.'
+        )
+        parser.add_argument(
+            '--subject',
+            action='append',
+            help='Only snapshot this subject. Can be given more than once.'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Number of students snapshotted in each transaction.'
+        )
+
+    def handle(self, *args, **options):
+        self.taken_at = timezone.now()
+        self.subjects = options['subject']
+        students = Student.objects.order_by('student_id')
+        if options['form']:
+            students = students.filter(form__in=options['form'])
+
+        saved = 0
+        batch = []
+        for student in students.values_list('student_id', 'form').iterator(chunk_size=options['batch_size']):
+            batch.append(student)
+            if len(batch) == options['batch_size']:
+                saved += self.snapshot(batch)
+                batch = []
+        if batch:
+            saved += self.snapshot(batch)
+
+        self.stdout.write(f"Recorded a snapshot in {saved} mastery series")
+
+
+    # The p_known values for the batch are read in one query and grouped by student and subject.
+
+    def snapshot(self, students):
+        forms = dict(students)
+        bkt_values = BKT.objects.filter(student_id__in=forms)
+        if self.subjects:
+            bkt_values = bkt_values.filter(subject_id__in=self.subjects)
+
+        values = defaultdict(dict)
+        for student_id, subject_id, subtopic_id, p_known in bkt_values.values_list(
+            'student_id', 'subject_id', 'subtopic_id', 'p_known'
+        ):
+            values[(student_id, subject_id)][subtopic_id] = p_known
+
+        # Existing series are found by student and subject rather than by id, so that series saved with an older
+        # form of id are still added to.
+
+        with transaction.atomic():
+            existing = {
+                (series.student_id, series.subject_id): series
+                for series in MasterySeries.objects.select_for_update().filter(student_id__in=forms)
+            }
+            created = []
+            updated = []
+            for (student_id, subject_id), subtopic_values in values.items():
+                series = existing.get((student_id, subject_id))
+                if series is None:
+                    series = MasterySeries(
+                        series_id=mastery_series.series_id(student_id, subject_id),
+                        student_id=student_id,
+                        subject_id=subject_id
+                    )
+                    created.append(series)
+                else:
+                    updated.append(series)
+                series.form = forms[student_id]
+                mastery_series.append_snapshot(series, subtopic_values, self.taken_at)
+
+            MasterySeries.objects.bulk_create(created)
+            MasterySeries.objects.bulk_update(
+                updated,
+                ['form', 'subtopic_ids', 'started_at', 'snapshot_count', 'times', 'values']
+            )
+        return len(values)
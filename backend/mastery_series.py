@@ -0,0 +1,179 @@
+# Mastery series store each student's p_known values over time, so that teachers can see how a class's progress
+# has changed rather than only the current values. One row is kept for each student in each subject, holding
+# every snapshot for every subtopic packed into two small binary blobs:
+#  - values: p_known values rounded to whole percentages. Values saved by answering questions are already rounded
+#    to 2 decimal places, but values set through the API or the admin can have more, and are stored to the nearest
+#    percent. Each snapshot is stored as the change from the one before, which is always between -101 and 101,
+#    so every value takes a single byte. A subtopic the student had no BKT value for is stored as -1.
+#  - times: the number of seconds since the first snapshot, also stored as the change from the one before.
+
+import warnings
+from datetime import datetime, time
+
+import numpy as np
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from backend.models import MasterySeries
+from backend.rollups import composite_id
+
+
+MISSING = -1
+VALUE_TYPE = np.dtype('<i1')
+TIME_TYPE = np.dtype('<u4')
+
+
+def series_id(student_id, subject_id):
+    return composite_id(student_id, subject_id)
+
+
+# Values are given as a matrix with one row per snapshot and one column per subtopic.
+
+def encode_values(matrix):
+    matrix = np.asarray(matrix, dtype=np.int16)
+    if matrix.size == 0:
+        return b''
+    return np.diff(matrix, axis=0, prepend=0).astype(VALUE_TYPE).tobytes()
+
+
+def decode_values(blob, column_count):
+    if not blob or not column_count:
+        return np.zeros((0, column_count), dtype=np.int16)
+    deltas = np.frombuffer(bytes(blob), dtype=VALUE_TYPE).reshape(-1, column_count)
+    return deltas.astype(np.int16).cumsum(axis=0, dtype=np.int16)
+
+
+def encode_times(offsets):
+    offsets = np.asarray(offsets, dtype=np.int64)
+    return np.diff(offsets, prepend=0).astype(TIME_TYPE).tobytes()
+
+
+def decode_times(blob):
+    return np.frombuffer(bytes(blob), dtype=TIME_TYPE).astype(np.int64).cumsum()
+
+
+# A p_known value is stored as a whole percentage, kept between 0 and 100 so that every change fits in a byte.
+
+def percentage(p_known):
+    return int(round(min(max(p_known, 0.0), 1.0) * 100))
+
+
+# A snapshot is added to the end of a series. values is a dictionary of p_known values keyed by subtopic id.
+# Subtopics seen for the first time are added as new columns, with earlier snapshots marked as missing.
+# The series is changed in memory and not saved.
+
+def append_snapshot(series, values, taken_at):
+    subtopic_ids = list(series.subtopic_ids or [])
+    matrix = decode_values(series.values, len(subtopic_ids))
+    new_subtopics = [subtopic_id for subtopic_id in sorted(values) if subtopic_id not in subtopic_ids]
+    if new_subtopics:
+        subtopic_ids.extend(new_subtopics)
+        matrix = np.hstack([matrix, np.full((len(matrix), len(new_subtopics)), MISSING, dtype=np.int16)])
+
+    row = np.array([
+        percentage(values[subtopic_id]) if subtopic_id in values else MISSING
+        for subtopic_id in subtopic_ids
+    ], dtype=np.int16)
+
+    if series.started_at is None:
+        series.started_at = taken_at
+    offsets = np.append(decode_times(series.times), int((taken_at - series.started_at).total_seconds()))
+
+    series.subtopic_ids = subtopic_ids
+    series.values = encode_values(np.vstack([matrix, row]))
+    series.times = encode_times(offsets)
+    series.snapshot_count = len(offsets)
+    return series
+
+
+# A series is decoded into the time of each snapshot (as a Unix timestamp) and a matrix of percentages,
+# with missing values as NaN.
+
+def decode_series(series):
+    matrix = decode_values(series.values, len(series.subtopic_ids)).astype(np.float64)
+    matrix[matrix == MISSING] = np.nan
+    times = decode_times(series.times) + int(series.started_at.timestamp())
+    return times, matrix
+
+
+# The value of a series at each point in time is its most recent snapshot at or before that time, and NaN
+# before its first snapshot. Returns a matrix with one row per point and one column per subtopic.
+
+def sample_series(times, matrix, points):
+    index = np.searchsorted(times, points, side='right') - 1
+    sampled = np.full((len(points), matrix.shape[1]), np.nan)
+    found = index >= 0
+    sampled[found] = matrix[index[found]]
+    return sampled
+
+
+# Trend times can be given as a date or a date-time, and are turned into a Unix timestamp.
+# An end date includes the whole of that day.
+
+def parse_time(value, end_of_day=False):
+    if not value:
+        return None
+    moment = parse_datetime(value)
+    if moment is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(f"Invalid date {value}, use YYYY-MM-DD")
+        moment = datetime.combine(day, time.max if end_of_day else time.min)
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return int(moment.timestamp())
+
+
+# Averages ignore missing values, so that students who joined part way through do not pull them down.
+# A point with no values at all is returned as None.
+
+def averages(values, axis):
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', category=RuntimeWarning)
+        means = np.nanmean(values, axis=axis)
+    return [None if np.isnan(mean) else round(float(mean), 2) for mean in means]
+
+
+# The trend for a class in one subject is read with a single query, and down-sampled onto at most point_count
+# evenly spaced times between start and end (Unix timestamps). If start or end are not given, the first and
+# last snapshots are used. Returns the times, along with the class average, the average for each subtopic and
+# the average for each student at each time.
+
+DEFAULT_POINTS = 50
+MAX_POINTS = 500
+
+
+def class_trend(form, subject_id, start=None, end=None, point_count=DEFAULT_POINTS):
+    trend = {'times': [], 'class_average': [], 'subtopics': {}, 'students': {}}
+    decoded = {
+        series.student_id: (series.subtopic_ids, *decode_series(series))
+        for series in MasterySeries.objects.filter(form=form, subject_id=subject_id).order_by('student_id')
+    }
+    all_times = [times for _, times, _ in decoded.values() if len(times)]
+    if not all_times:
+        return trend
+
+    start = start if start is not None else min(times[0] for times in all_times)
+    end = end if end is not None else max(times[-1] for times in all_times)
+    point_count = max(1, min(point_count, MAX_POINTS))
+    points = np.unique(np.linspace(start, end, point_count).round().astype(np.int64))
+
+
+    # Every student's series is sampled onto the same times and the same subtopic columns, giving one array
+    # of (student, time, subtopic) that the averages are taken across.
+
+    subtopic_ids = sorted({subtopic_id for subtopics, _, _ in decoded.values() for subtopic_id in subtopics})
+    columns = {subtopic_id: column for column, subtopic_id in enumerate(subtopic_ids)}
+    sampled = np.full((len(decoded), len(points), len(subtopic_ids)), np.nan)
+    for row, (subtopics, times, matrix) in enumerate(decoded.values()):
+        sampled[row][:, [columns[subtopic_id] for subtopic_id in subtopics]] = sample_series(times, matrix, points)
+
+    trend['times'] = points.tolist()
+    trend['class_average'] = averages(sampled.transpose(1, 0, 2).reshape(len(points), -1), 1)
+    trend['subtopics'] = {
+        subtopic_id: averages(sampled[:, :, column], 0) for subtopic_id, column in columns.items()
+    }
+    trend['students'] = {
+        student_id: averages(sampled[row], 1) for row, student_id in enumerate(decoded)
+    }
+    return trend
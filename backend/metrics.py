@@ -0,0 +1,151 @@
+# Metrics are kept in memory for each API action, recording how long each request took, how many database
+# queries it ran and how large the response was. The most recent requests are kept in a ring buffer,
+# so that memory use stays the same however long the server has been running.
+
+import threading
+from collections import deque
+
+from django.conf import settings
+
+
+# Latencies are counted into histogram buckets (in milliseconds), with the last bucket holding anything slower.
+
+LATENCY_BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, float('inf'))
+
+DEFAULT_BUFFER_SIZE = 1000
+DEFAULT_SAMPLES_PER_ACTION = 200
+
+
+# An action is flagged when its query count rises with the size of the request or response. This needs enough
+# requests of different sizes, a strong correlation, and the query count to grow by at least a few queries.
+
+MIN_SCALING_SAMPLES = 10
+SCALING_CORRELATION = 0.8
+SCALING_MIN_QUERY_GROWTH = 3
+
+
+class ActionMetrics:
+    def __init__(self, sample_size):
+        self.count = 0
+        self.latency_histogram = [0] * len(LATENCY_BUCKETS)
+        self.total_latency_ms = 0.0
+        self.total_queries = 0
+        self.total_query_ms = 0.0
+        self.total_response_bytes = 0
+        self.max_queries = 0
+        self.samples = deque(maxlen=sample_size)
+
+    def record(self, sample):
+        self.count += 1
+        self.total_latency_ms += sample['latency_ms']
+        self.total_queries += sample['queries']
+        self.total_query_ms += sample['query_ms']
+        self.total_response_bytes += sample['response_bytes']
+        self.max_queries = max(self.max_queries, sample['queries'])
+        for index, bucket in enumerate(LATENCY_BUCKETS):
+            if sample['latency_ms'] <= bucket:
+                self.latency_histogram[index] += 1
+                break
+        self.samples.append((sample['input_size'], sample['queries']))
+
+
+    # A least squares line is fitted through (size, query count) for the recent requests. The action is
+    # flagged if the queries rise with size, and the fitted line grows by a few queries across the sizes seen.
+
+    def query_scaling(self):
+        if len(self.samples) < MIN_SCALING_SAMPLES:
+            return None
+
+        sizes = [size for size, _ in self.samples]
+        queries = [query_count for _, query_count in self.samples]
+        mean_size = sum(sizes) / len(sizes)
+        mean_queries = sum(queries) / len(queries)
+        size_variance = sum((size - mean_size) ** 2 for size in sizes)
+        query_variance = sum((query_count - mean_queries) ** 2 for query_count in queries)
+        if not size_variance or not query_variance:
+            return None
+
+        covariance = sum((size - mean_size) * (query_count - mean_queries) for size, query_count in self.samples)
+        correlation = covariance / (size_variance * query_variance) ** 0.5
+        queries_per_item = covariance / size_variance
+        growth = queries_per_item * (max(sizes) - min(sizes))
+
+        return {
+            'queries_per_item': round(queries_per_item, 3),
+            'correlation': round(correlation, 3),
+            'flagged': correlation >= SCALING_CORRELATION and growth >= SCALING_MIN_QUERY_GROWTH
+        }
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'mean_latency_ms': round(self.total_latency_ms / self.count, 2),
+            'latency_histogram': {
+                ('+inf' if bucket == float('inf') else f"<={bucket}ms"): count
+                for bucket, count in zip(LATENCY_BUCKETS, self.latency_histogram)
+            },
+            'mean_queries': round(self.total_queries / self.count, 2),
+            'max_queries': self.max_queries,
+            'mean_query_ms': round(self.total_query_ms / self.count, 2),
+            'mean_response_bytes': round(self.total_response_bytes / self.count),
+            'query_scaling': self.query_scaling()
+        }
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._actions = {}
+        self._recent = None
+
+    def _sample_size(self):
+        return getattr(settings, 'METRICS_SAMPLES_PER_ACTION', DEFAULT_SAMPLES_PER_ACTION)
+
+    def record(self, action, sample):
+        with self._lock:
+            if self._recent is None:
+                self._recent = deque(maxlen=getattr(settings, 'METRICS_BUFFER_SIZE', DEFAULT_BUFFER_SIZE))
+            self._recent.append(dict(sample, action=action))
+            if action not in self._actions:
+                self._actions[action] = ActionMetrics(self._sample_size())
+            self._actions[action].record(sample)
+
+    def snapshot(self):
+        with self._lock:
+            actions = {action: metrics.summary() for action, metrics in sorted(self._actions.items())}
+            recent = list(self._recent or [])
+        return {
+            'actions': actions,
+            'flagged_actions': [
+                action for action, summary in actions.items()
+                if summary['query_scaling'] and summary['query_scaling']['flagged']
+            ],
+            'recent_requests': recent
+        }
+
+    def reset(self):
+        with self._lock:
+            self._actions = {}
+            self._recent = None
+
+
+# One registry is shared by the whole process.
+
+registry = MetricsRegistry()
+
+
+# The size of a request or response is the number of items in its largest list, checked at the top level
+# and one level down. This is what an N+1 query problem grows with (answers submitted, quizzes returned, and so on).
+
+def item_count(data):
+    if isinstance(data, list):
+        return len(data)
+    if isinstance(data, dict):
+        counts = [0]
+        for value in data.values():
+            if isinstance(value, list):
+                counts.append(len(value))
+            elif isinstance(value, dict):
+                counts.extend(len(inner) for inner in value.values() if isinstance(inner, list))
+        return max(counts)
+    return 0
@@ -0,0 +1,83 @@
+# Middleware that records metrics for every API request, to show why particular endpoints get slow.
+# This is added to the MIDDLEWARE setting as 'backend.middleware.QueryMetricsMiddleware'.
+
+import json
+import time
+from contextlib import ExitStack
+
+from django.db import connections
+
+from backend import metrics
+
+
+# Request bodies larger than this are not read to find their size.
+
+MAX_BODY_SIZE = 1024 * 1024
+
+
+class QueryTimer:
+    def __init__(self):
+        self.queries = 0
+        self.query_ms = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.query_ms += (time.perf_counter() - start) * 1000
+
+
+class QueryMetricsMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not request.path.startswith('/api/') or request.path.startswith('/api/metrics/'):
+            return self.get_response(request)
+
+        request_size = self.request_size(request)
+        timer = QueryTimer()
+        start = time.perf_counter()
+
+
+        # Every query on every database connection is counted and timed while the view runs.
+
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(timer))
+            response = self.get_response(request)
+
+        latency_ms = (time.perf_counter() - start) * 1000
+
+
+        # Actions are named after the router's url name (such as quiz-generateQuiz), so that all requests to
+        # the same action are grouped together whatever their parameters.
+
+        resolver_match = getattr(request, 'resolver_match', None)
+        action = resolver_match.url_name if resolver_match and resolver_match.url_name else request.path
+
+        metrics.registry.record(action, {
+            'method': request.method,
+            'status': response.status_code,
+            'latency_ms': round(latency_ms, 3),
+            'queries': timer.queries,
+            'query_ms': round(timer.query_ms, 3),
+            'response_bytes': len(response.content) if not response.streaming else 0,
+            'input_size': max(request_size, metrics.item_count(getattr(response, 'data', None)))
+        })
+        return response
+
+
+    # The body is read before the view, which keeps a copy so that the view can still read it.
+
+    def request_size(self, request):
+        if request.method == 'GET' or request.content_type != 'application/json':
+            return 0
+        if int(request.META.get('CONTENT_LENGTH') or 0) > MAX_BODY_SIZE:
+            return 0
+        try:
+            return metrics.item_count(json.loads(request.body or b'null'))
+        except ValueError:
+            return 0
@@ -1,12 +1,18 @@
+import uuid
+
+from django.utils import timezone
 from django.db import models # The Models module is imported, so that data models can be defined.
 
 
 # Model for Users is created, which stores login data and type of account.
+# The password is stored as a salted hash (see auth.py), which is why it is longer than any password.
+# Passwords are hashed when the user is saved, so a password set in the admin site or a serializer is never
+# stored as plaintext. Values that are already hashes are left as they are.
 
 class User(models.Model):
     user_id = models.CharField(max_length=5, primary_key=True)
     email = models.EmailField(unique=True)
-    password = models.CharField(max_length=16)
+    password = models.CharField(max_length=128)
 
     # Two choices for users, which impact what is rendered after login in the frontend.
 
@@ -16,6 +22,12 @@ class User(models.Model):
     first_name = models.CharField(max_length=30)
     surname = models.CharField(max_length=30)
 
+    def save(self, *args, **kwargs):
+        from backend.auth import hash_password, is_hashed
+        if not is_hashed(self.password):
+            self.password = hash_password(self.password)
+        super().save(*args, **kwargs)
+
     def __str__(self):
         return f"{self.first_name} {self.surname}" 
     
@@ -42,6 +54,12 @@ class Student(models.Model):
     form = models.CharField(max_length=3)
 
 
+    # Students are indexed by form, as whole forms are looked up when quizzes are assigned and progress is viewed.
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['form'], name='student_form_idx')
+        ]
 
     def __str__(self):
         return f"Student user {self.user_id.first_name} {self.user_id.surname}"
@@ -61,6 +79,14 @@ class Question(models.Model):
     answer_4 = models.CharField(max_length=100)
     correct_answer = models.CharField(max_length=100)
 
+
+    # Questions are indexed by subject and subtopic together, as this is how they are looked up for quizzes.
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['subject', 'subtopic'], name='question_subj_subtopic_idx')
+        ]
+
     def __str__(self):
         return f"Question {self.question_id} - {self.question_text}"
 
@@ -76,20 +102,26 @@ class Subject(models.Model):
     
     
     # Subtopics are used to be assigned to each question, and sit under each subject as a whole.
+    # The default BKT parameters are used when a student's BKT row for the subtopic is first created.
     
 class Subtopic(models.Model):
     subtopic_id = models.CharField(max_length=20, primary_key=True)
     subtopic_name = models.CharField(max_length=20)
     subject = models.ForeignKey(Subject, on_delete=models.CASCADE)
+    default_p_initial_knowledge = models.FloatField(default=0.3)
+    default_p_will_learn = models.FloatField(default=0.1)
+    default_p_slip = models.FloatField(default=0.1)
+    default_p_guess = models.FloatField(default=0.2)
 
     def __str__(self):
         return f" Subtopic {self.subtopic_name} in subject {self.subject.subject_name}"
     
     # The model for the BKT model stores the subject and subtopic (as these are done for each student by subtopic
     # and not by subject as a whole). The five parameters for the calculations for this are stored also.
+    # The version goes up with every change to p_known, so that updates made at the same time can be detected.
 
 class BKT(models.Model):
-    bkt_id = models.CharField(primary_key=True)
+    bkt_id = models.CharField(max_length=40, primary_key=True)
     student = models.ForeignKey(Student, on_delete=models.CASCADE)
     subject = models.ForeignKey(Subject, on_delete=models.CASCADE)
     subtopic = models.ForeignKey(Subtopic, on_delete=models.CASCADE)
@@ -98,12 +130,29 @@ class BKT(models.Model):
     p_slip = models.FloatField()
     p_guess = models.FloatField()
     p_known = models.FloatField()
+    version = models.IntegerField(default=0)
+
+
+    # Each student can only have one BKT row for each subtopic, which also indexes the (student, subtopic) lookup.
+    # The (student, subject) index is used when all of a student's subtopics in a subject are needed for a quiz.
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['student', 'subtopic'], name='bkt_unique_student_subtopic')
+        ]
+        indexes = [
+            models.Index(fields=['student', 'subject'], name='bkt_student_subject_idx')
+        ]
 
     def __str__(self):
         return f"BKT model for {self.student} for subtopic {self.subtopic.subtopic_name} in {self.subject.subject_name}"
     
 
 # Assigned quizzes are stored so that students can retreive these once teachers have assigned them.
+# The times each quiz was assigned and completed are kept so that quiz results can be exported by date.
+# The time it was last changed is used to tell whether a student's list of quizzes has changed.
+# If the questions are chosen when the quiz is assigned, their ids are stored along with the p_known values
+# they were chosen from, so that the quiz can be served without choosing them again.
 
 class Quiz(models.Model):
     quiz_id = models.AutoField(primary_key=True)
@@ -113,7 +162,188 @@ class Quiz(models.Model):
     completed = models.BooleanField(default=False)
     score = models.IntegerField(null=True, blank=True)
     total_questions = models.IntegerField(null=True, blank=True)
+    assigned_at = models.DateTimeField(auto_now_add=True, null=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True, null=True)
+    question_ids = models.JSONField(null=True, blank=True)
+    generated_p_known = models.JSONField(null=True, blank=True)
+
+
+    # A student can only have one open quiz for each subject, so assigning the same quiz twice cannot duplicate it.
+    # This is a partial index that only holds open quizzes, so it stays small as completed quizzes build up.
+    # Quizzes are also indexed by student and completed, for looking up a student's quizzes either way.
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['student', 'subject'],
+                condition=models.Q(completed=False),
+                name='quiz_one_open_per_subject'
+            )
+        ]
+        indexes = [
+            models.Index(fields=['student', 'completed'], name='quiz_student_completed_idx')
+        ]
 
     def __str__(self):
         return f"Quiz {self.quiz_id} assigned by Miss {self.teacher.user_id.surname} to {self.student.user_id.first_name} {self.student.user_id.surname} for {self.subject.subject_name}"
 
+
+# A quiz session is created each time a quiz is generated, holding the ids of the questions the student was given.
+# The whole attempt is then submitted at once and scored against these questions, so the score does not rely on
+# the frontend. The id is random so that one student cannot submit another student's session.
+
+class QuizSession(models.Model):
+    session_id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    quiz = models.ForeignKey(Quiz, on_delete=models.CASCADE)
+    student = models.ForeignKey(Student, on_delete=models.CASCADE)
+    question_ids = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    submitted = models.BooleanField(default=False)
+
+    def __str__(self):
+        return f"Session {self.session_id} for quiz {self.quiz_id}"
+
+
+# Every answer submitted is recorded as an answer event, so that the history of each student's answers can be
+# analysed or replayed later. Events are only ever added and are never changed by the views.
+# The selected answer is kept so that correctness can be worked out again if a question's correct answer is fixed.
+
+class AnswerEvent(models.Model):
+    event_id = models.BigAutoField(primary_key=True)
+    student = models.ForeignKey(Student, on_delete=models.CASCADE)
+    question = models.ForeignKey(Question, on_delete=models.CASCADE)
+    subtopic = models.ForeignKey(Subtopic, on_delete=models.CASCADE)
+    selected_answer = models.CharField(max_length=100)
+    correct = models.BooleanField()
+    answered_at = models.DateTimeField()
+    prior_p_known = models.FloatField()
+    posterior_p_known = models.FloatField()
+
+
+    # Answer history is read by subtopic and student when answers are replayed.
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['subtopic', 'student'], name='event_subtopic_student_idx')
+        ]
+
+    def __str__(self):
+        return f"Answer event {self.event_id} for {self.student_id} on question {self.question_id}"
+
+
+# Rollup models hold running totals of p_known values, so that progress data can be read directly
+# rather than being recalculated from every BKT row each time the teacher page is opened.
+# The ids are built from the values they are grouped by, so each rollup can be read by primary key.
+# Totals are kept up to date whenever a BKT value changes (see rollups.py).
+
+class StudentMastery(models.Model):
+    rollup_id = models.CharField(max_length=30, primary_key=True)
+    student = models.ForeignKey(Student, on_delete=models.CASCADE)
+    subject = models.ForeignKey(Subject, on_delete=models.CASCADE)
+    p_known_total = models.FloatField(default=0)
+    bkt_count = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"Mastery rollup for student {self.student_id} in {self.subject_id}"
+
+
+# Subtopic rollups are grouped by form, so that each class has its own subtopic averages.
+
+class SubtopicMastery(models.Model):
+    rollup_id = models.CharField(max_length=30, primary_key=True)
+    form = models.CharField(max_length=3)
+    subject = models.ForeignKey(Subject, on_delete=models.CASCADE)
+    subtopic = models.ForeignKey(Subtopic, on_delete=models.CASCADE)
+    p_known_total = models.FloatField(default=0)
+    bkt_count = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"Mastery rollup for form {self.form} in subtopic {self.subtopic_id}"
+
+
+# Class rollups hold the totals for a whole form in one subject.
+# The revision goes up with every change, so that cached progress data can tell when the class has changed.
+
+class ClassMastery(models.Model):
+    rollup_id = models.CharField(max_length=30, primary_key=True)
+    form = models.CharField(max_length=3)
+    subject = models.ForeignKey(Subject, on_delete=models.CASCADE)
+    p_known_total = models.FloatField(default=0)
+    bkt_count = models.IntegerField(default=0)
+    revision = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"Mastery rollup for form {self.form} in {self.subject_id}"
+
+
+# Mastery series hold a student's p_known values for every subtopic in a subject over time, packed into
+# binary blobs (see mastery_series.py). The form is stored so that a whole class can be read in one query.
+
+class MasterySeries(models.Model):
+    series_id = models.CharField(max_length=30, primary_key=True)
+    student = models.ForeignKey(Student, on_delete=models.CASCADE)
+    subject = models.ForeignKey(Subject, on_delete=models.CASCADE)
+    form = models.CharField(max_length=3)
+    subtopic_ids = models.JSONField(default=list)
+    started_at = models.DateTimeField(null=True, blank=True)
+    snapshot_count = models.IntegerField(default=0)
+    times = models.BinaryField(default=bytes)
+    values = models.BinaryField(default=bytes)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['form', 'subject'], name='series_form_subject_idx')
+        ]
+
+    def __str__(self):
+        return f"Mastery series for {self.student_id} in {self.subject_id}"
+
+
+# Background jobs are kept in the database, so that slow work can be queued by the views and run by the runjobs
+# command without a separate message broker (see jobs.py). The arguments are passed to the job's handler, and the
+# progress and result are saved as the job runs so that they can be read from the API.
+# Only one queued or running job can have each deduplication key, so the same work is not queued twice.
+
+class Job(models.Model):
+    STATUSES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('succeeded', 'Succeeded'),
+        ('failed', 'Failed'),
+    ]
+
+    job_id = models.AutoField(primary_key=True)
+    kind = models.CharField(max_length=50)
+    arguments = models.JSONField(default=dict)
+    dedup_key = models.CharField(max_length=64, null=True, blank=True)
+    status = models.CharField(max_length=10, choices=STATUSES, default='queued')
+    attempts = models.IntegerField(default=0)
+    max_attempts = models.IntegerField(default=3)
+    progress = models.FloatField(default=0)
+    progress_message = models.CharField(max_length=200, blank=True, default='')
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    run_after = models.DateTimeField(default=timezone.now)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+
+
+    # Workers look for queued jobs that are ready to run, in the order they become ready.
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['dedup_key'],
+                condition=models.Q(status__in=['queued', 'running']),
+                name='job_one_active_per_key'
+            )
+        ]
+        indexes = [
+            models.Index(fields=['status', 'run_after'], name='job_status_run_after_idx')
+        ]
+
+    def __str__(self):
+        return f"Job {self.job_id} ({self.kind}, {self.status})"
@@ -0,0 +1,128 @@
+# Quiz questions can be chosen when the teacher assigns a quiz rather than when each student opens it.
+# This spreads the work out, so that a whole class starting a quiz at once only needs to read the stored questions.
+# Questions are chosen on a pool of background threads, so that assigning the quiz is not slowed down.
+#
+# This is turned on with the QUIZ_PREGENERATE setting, or for one assignment with the pregenerate value in the request.
+
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from backend import question_bank
+from backend.models import BKT, Quiz
+
+
+logger = logging.getLogger(__name__)
+
+
+# The number of threads and the number of quizzes each thread chooses questions for at a time can be changed
+# in the settings. QUIZ_REGENERATE_THRESHOLD is how far a p_known value can move before stored questions
+# are no longer used.
+
+DEFAULT_WORKERS = 2
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_REGENERATE_THRESHOLD = 0.1
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+# Flags in a request can come from JSON or a form, so only true, "true" and "1" turn them on. Any other value
+# (such as false, "false" or "0") turns them off.
+
+def flag_set(value):
+    if isinstance(value, str):
+        return value.strip().lower() in ('true', '1')
+    return value is True or value == 1
+
+
+# Leaving the pregenerate value out uses the setting.
+
+def pregenerate_enabled(requested=None):
+    if requested is None or requested == '':
+        return getattr(settings, 'QUIZ_PREGENERATE', False)
+    return flag_set(requested)
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'QUIZ_PREGENERATE_WORKERS', DEFAULT_WORKERS),
+                thread_name_prefix='quiz-pregenerate'
+            )
+        return _executor
+
+
+# Questions are chosen for the given quizzes once the current transaction has been saved,
+# so that the background threads can see the new quizzes.
+
+def schedule(quiz_ids):
+    batch_size = getattr(settings, 'QUIZ_PREGENERATE_BATCH_SIZE', DEFAULT_BATCH_SIZE)
+    batches = [quiz_ids[start:start + batch_size] for start in range(0, len(quiz_ids), batch_size)]
+
+    def submit():
+        for batch in batches:
+            _get_executor().submit(_run, batch)
+
+    transaction.on_commit(submit)
+
+
+def _run(quiz_ids):
+    try:
+        pregenerate(quiz_ids)
+    except Exception:
+        logger.exception('Failed to choose questions for %d quizzes', len(quiz_ids))
+    finally:
+        connection.close()
+
+
+# Questions are chosen for a batch of quizzes. All BKT values for the students and subjects are read in one query,
+# and the chosen questions are saved to all of the quizzes in one update.
+
+def pregenerate(quiz_ids):
+    quizzes = list(Quiz.objects.filter(quiz_id__in=quiz_ids, completed=False).only('quiz_id', 'student_id', 'subject_id'))
+    student_p_known = current_p_known(
+        [quiz.student_id for quiz in quizzes],
+        {quiz.subject_id for quiz in quizzes}
+    )
+
+    for quiz in quizzes:
+        p_known_values = student_p_known.get((quiz.student_id, quiz.subject_id), {})
+        quiz.question_ids = question_bank.choose_questions(quiz.subject_id, sorted(p_known_values.items()))
+        quiz.generated_p_known = p_known_values
+
+    Quiz.objects.bulk_update(quizzes, ['question_ids', 'generated_p_known'])
+    return len(quizzes)
+
+
+# The p_known value for every subtopic is returned for each (student, subject) pair.
+
+def current_p_known(student_ids, subject_ids):
+    p_known_values = {}
+    rows = BKT.objects.filter(student_id__in=student_ids, subject_id__in=subject_ids).values_list(
+        'student_id', 'subject_id', 'subtopic_id', 'p_known'
+    )
+    for student_id, subject_id, subtopic_id, p_known in rows:
+        p_known_values.setdefault((student_id, subject_id), {})[subtopic_id] = p_known
+    return p_known_values
+
+
+# Stored questions are only used if the student has the same subtopics and no p_known value has moved
+# further than the threshold since the questions were chosen.
+
+def is_current(quiz, p_known_values):
+    if quiz.question_ids is None or quiz.generated_p_known is None:
+        return False
+    if set(quiz.generated_p_known) != set(p_known_values):
+        return False
+
+    threshold = getattr(settings, 'QUIZ_REGENERATE_THRESHOLD', DEFAULT_REGENERATE_THRESHOLD)
+    return all(
+        abs(p_known - quiz.generated_p_known[subtopic_id]) <= threshold
+        for subtopic_id, p_known in p_known_values.items()
+    )
@@ -0,0 +1,71 @@
+# BKT rows are created when a student is first seen in a subtopic, rather than needing to be added by hand.
+# New rows start from the subtopic's default parameters, with p_known starting at p_initial_knowledge.
+# Every missing row for a group of students and subtopics is created in one bulk insert, and added to the
+# progress rollups in the same transaction.
+
+from django.db import IntegrityError, transaction
+
+from backend import rollups
+from backend.models import BKT, Student, Subtopic
+
+
+# If another request creates some of the same rows at the same time, the insert fails on the unique
+# (student, subtopic) constraint. The missing rows are then worked out again and the insert is tried again.
+
+DEFAULT_ATTEMPTS = 3
+
+
+def bkt_id(student_id, subtopic_id):
+    return f"{student_id}-{subtopic_id}"
+
+
+# Missing BKT rows are created for every pair of the given students and subtopics.
+# Ids that do not exist are ignored. Returns the number of rows created.
+
+def provision(student_ids, subtopic_ids, batch_size=1000, attempts=DEFAULT_ATTEMPTS):
+    student_ids = list(student_ids)
+    subtopic_ids = list(subtopic_ids)
+    if not student_ids or not subtopic_ids:
+        return 0
+
+    for attempt in range(attempts):
+        existing = set(
+            BKT.objects
+            .filter(student_id__in=student_ids, subtopic_id__in=subtopic_ids)
+            .values_list('student_id', 'subtopic_id')
+        )
+        if len(existing) == len(student_ids) * len(subtopic_ids):
+            return 0
+
+        forms = dict(Student.objects.filter(student_id__in=student_ids).values_list('student_id', 'form'))
+        subtopics = Subtopic.objects.in_bulk(subtopic_ids)
+        missing = [
+            BKT(
+                bkt_id=bkt_id(student_id, subtopic.subtopic_id),
+                student_id=student_id,
+                subject_id=subtopic.subject_id,
+                subtopic_id=subtopic.subtopic_id,
+                p_initial_knowledge=subtopic.default_p_initial_knowledge,
+                p_will_learn=subtopic.default_p_will_learn,
+                p_slip=subtopic.default_p_slip,
+                p_guess=subtopic.default_p_guess,
+                p_known=subtopic.default_p_initial_knowledge
+            )
+            for student_id in forms
+            for subtopic in subtopics.values()
+            if (student_id, subtopic.subtopic_id) not in existing
+        ]
+        if not missing:
+            return 0
+
+        try:
+            with transaction.atomic():
+                BKT.objects.bulk_create(missing, batch_size=batch_size)
+                rollups.apply_changes([
+                    (bkt.student_id, forms[bkt.student_id], bkt.subject_id, bkt.subtopic_id, bkt.p_known, 1)
+                    for bkt in missing
+                ])
+            return len(missing)
+        except IntegrityError:
+            if attempt == attempts - 1:
+                raise
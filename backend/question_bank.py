@@ -0,0 +1,95 @@
+# The question bank keeps the ids of every question in memory, grouped by subject and subtopic.
+# This means quiz generation can pick its questions without querying every question in each subtopic,
+# and only the chosen questions need to be fetched from the database.
+
+import random
+import threading
+import time
+
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from backend.models import Question
+
+
+# Other processes cannot be told when questions change, so the bank is also reloaded after a set time.
+# This can be changed with the QUESTION_BANK_TTL setting (in seconds).
+
+DEFAULT_TTL = 300
+
+
+class QuestionBank:
+    def __init__(self):
+        self._index = None
+        self._loaded_at = 0
+        self._lock = threading.Lock()
+
+
+    # All question ids are loaded in one query the first time they are needed, and stored as tuples
+    # so that each subtopic takes as little memory as possible.
+
+    def _load(self):
+        index = {}
+        rows = Question.objects.values_list('subject_id', 'subtopic_id', 'question_id').order_by('question_id')
+        for subject_id, subtopic_id, question_id in rows.iterator(chunk_size=5000):
+            index.setdefault((subject_id, subtopic_id), []).append(question_id)
+        return {key: tuple(question_ids) for key, question_ids in index.items()}
+
+    def _get_index(self):
+        ttl = getattr(settings, 'QUESTION_BANK_TTL', DEFAULT_TTL)
+        with self._lock:
+            if self._index is None or time.monotonic() - self._loaded_at > ttl:
+                self._index = self._load()
+                self._loaded_at = time.monotonic()
+            return self._index
+
+    def question_ids(self, subject_id, subtopic_id):
+        return self._get_index().get((subject_id, subtopic_id), ())
+
+
+    # Questions are chosen without replacement. random.sample only picks the number of ids needed,
+    # rather than shuffling the whole subtopic.
+
+    def sample(self, subject_id, subtopic_id, amount):
+        question_ids = self.question_ids(subject_id, subtopic_id)
+        return random.sample(question_ids, min(amount, len(question_ids)))
+
+    def invalidate(self):
+        with self._lock:
+            self._index = None
+
+
+# One question bank is shared by the whole process.
+
+bank = QuestionBank()
+
+
+# Whenever a question is saved or deleted, the bank is cleared so that it is loaded again when next used.
+
+@receiver(post_save, sender=Question)
+@receiver(post_delete, sender=Question)
+def invalidate_question_bank(sender, **kwargs):
+    bank.invalidate()
+
+
+# The value of p_known is used to determine how many questions from each subtopic are needed.
+
+def question_amount(p_known):
+    if p_known <= 0.4:
+        return 3
+    elif p_known > 0.4 and p_known < 0.8:
+        return 2
+    else:
+        return 1
+
+
+# Questions for a quiz are chosen from the p_known value for each subtopic, given as (subtopic id, p_known) pairs.
+# The chosen question ids are shuffled to ensure the quiz is random (so that students cannot just memorise answers).
+
+def choose_questions(subject_id, p_known_values):
+    question_ids = []
+    for subtopic_id, p_known in p_known_values:
+        question_ids.extend(bank.sample(subject_id, subtopic_id, question_amount(p_known)))
+    random.shuffle(question_ids)
+    return question_ids
@@ -0,0 +1,295 @@
+# Rollups hold running totals of p_known values for each student, each subtopic in a form and each
+# form as a whole. These are updated alongside every BKT change, so that the teacher progress data
+# can be read by primary key instead of being averaged from the BKT table on every page load.
+
+# F allows totals to be incremented within the database, so that two updates at the same time
+# cannot overwrite each other. Sum and Count are used when totals need building from the BKT table.
+
+from collections import defaultdict
+from django.db import transaction
+from django.db.models import Count, F, Sum
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from backend.models import BKT, ClassMastery, Student, StudentMastery, Subtopic, SubtopicMastery
+
+
+# The ids for each rollup are built from the values they are grouped by. The first value is written with its
+# length in front, so that two different pairs of values can never give the same id, even if the values
+# themselves contain the separator (for example "7-A" and "B" against "7" and "A-B").
+
+def composite_id(first, second):
+    return f"{len(first)}:{first}:{second}"
+
+
+def student_rollup_id(student_id, subject_id):
+    return composite_id(student_id, subject_id)
+
+
+def subtopic_rollup_id(form, subtopic_id):
+    return composite_id(form, subtopic_id)
+
+
+def class_rollup_id(form, subject_id):
+    return composite_id(form, subject_id)
+
+
+# Averages are taken from the totals, with an empty rollup having an average of 0.
+
+def average(rollup):
+    if rollup is None or not rollup.bkt_count:
+        return 0
+    return rollup.p_known_total / rollup.bkt_count
+
+
+# Each rollup model is described by the BKT values it groups by, and the function that builds its id.
+# This allows the same code to update and rebuild all three models.
+
+ROLLUPS = [
+    (StudentMastery, ('student_id', 'subject_id'),
+        lambda row: student_rollup_id(row['student_id'], row['subject_id'])),
+    (SubtopicMastery, ('student__form', 'subject_id', 'subtopic_id'),
+        lambda row: subtopic_rollup_id(row['student__form'], row['subtopic_id'])),
+    (ClassMastery, ('student__form', 'subject_id'),
+        lambda row: class_rollup_id(row['student__form'], row['subject_id'])),
+]
+
+
+# Grouped field names are mapped to the model field names (student__form is stored as form).
+
+def rollup_fields(row):
+    return {('form' if key == 'student__form' else key): value for key, value in row.items()}
+
+
+# Totals for the given BKT rows are calculated in the database, returning unsaved rollups for each model.
+
+def build_rollups(model, group_fields, make_id, bkt_values):
+    grouped = (
+        bkt_values
+        .values(*group_fields)
+        .annotate(total=Sum('p_known'), count=Count('bkt_id'))
+        .order_by()
+    )
+    rollups = []
+    for row in grouped:
+        total = row.pop('total') or 0
+        count = row.pop('count')
+        rollups.append(model(
+            rollup_id=make_id(row),
+            p_known_total=total,
+            bkt_count=count,
+            **rollup_fields(row)
+        ))
+    return rollups
+
+
+# Changes to BKT values are applied to the rollups. Each change is a tuple of
+# (student_id, form, subject_id, subtopic_id, change in p_known, change in the number of BKT rows).
+# Changes for the same rollup are added together first, so a batch of answers only updates each rollup once.
+# Every update to a class rollup also increases its revision.
+# This should be called in the same transaction as the BKT update it belongs to.
+
+def apply_changes(changes):
+    totals = defaultdict(lambda: [0.0, 0])
+    for student_id, form, subject_id, subtopic_id, p_known_change, count_change in changes:
+        row = {
+            'student_id': student_id,
+            'student__form': form,
+            'subject_id': subject_id,
+            'subtopic_id': subtopic_id
+        }
+        for index, (model, group_fields, make_id) in enumerate(ROLLUPS):
+            key = (index, make_id(row), tuple(row[field] for field in group_fields), (form, subject_id))
+            totals[key][0] += p_known_change
+            totals[key][1] += count_change
+
+
+    # Class rollups are updated first. A missing class rollup means the class has never been built, so all of
+    # its rollups are built from the BKT table, which already includes these changes. The changes are then not
+    # applied to that class's other rollups, otherwise they would be counted twice.
+
+    built_classes = set()
+    class_index = len(ROLLUPS) - 1
+
+    with transaction.atomic():
+        for key in sorted(totals, key=lambda key: key[0] != class_index):
+            index, rollup_id, group_values, class_key = key
+            if class_key in built_classes:
+                continue
+            p_known_change, count_change = totals[key]
+            model, group_fields, make_id = ROLLUPS[index]
+
+            revision = {'revision': F('revision') + 1} if model is ClassMastery else {}
+            updated = model.objects.filter(rollup_id=rollup_id).update(
+                p_known_total=F('p_known_total') + p_known_change,
+                bkt_count=F('bkt_count') + count_change,
+                **revision
+            )
+
+
+            # If the rollup does not exist yet, it is built from the BKT table instead. The BKT rows have
+            # already been saved in this transaction, so the new value is included in the totals.
+
+            if not updated:
+                if model is ClassMastery:
+                    build_class_rollups(*group_values)
+                    built_classes.add(class_key)
+                else:
+                    bkt_values = BKT.objects.filter(**dict(zip(group_fields, group_values)))
+                    rollups = build_rollups(model, group_fields, make_id, bkt_values)
+                    model.objects.bulk_create(rollups, ignore_conflicts=True)
+
+
+# A class is missing BKT rows if its rollup counts fewer rows than the number of students times subtopics.
+
+def missing_bkt(class_rollup, expected_count):
+    return class_rollup is None or class_rollup.bkt_count < expected_count
+
+
+# A single BKT change is recorded, used when one answer has been submitted.
+
+def apply_change(student, bkt, previous_p_known):
+    apply_changes([(
+        student.student_id,
+        student.form,
+        bkt.subject_id,
+        bkt.subtopic_id,
+        bkt.p_known - previous_p_known,
+        0
+    )])
+
+
+# All rollups are deleted and built again from the BKT table. Class rollup revisions are carried on and increased,
+# so that cached progress data is not reused. Revisions are matched by form and subject rather than by id, so
+# they are also carried on from rollups saved with an older form of id.
+
+def rebuild_rollups():
+    counts = {}
+    with transaction.atomic():
+        revisions = {}
+        for form, subject_id, revision in ClassMastery.objects.values_list('form', 'subject_id', 'revision'):
+            revisions[(form, subject_id)] = max(revision, revisions.get((form, subject_id), 0))
+        for model, group_fields, make_id in ROLLUPS:
+            model.objects.all().delete()
+            rollups = build_rollups(model, group_fields, make_id, BKT.objects.all())
+            if model is ClassMastery:
+                for rollup in rollups:
+                    rollup.revision = revisions.get((rollup.form, rollup.subject_id), 0) + 1
+            model.objects.bulk_create(rollups, batch_size=1000)
+            counts[model.__name__] = len(rollups)
+    return counts
+
+
+# The rollups for one form in one subject are deleted and built again from the BKT table. The class rollup's
+# revision is carried on and increased, so that cached progress data for the class is not reused.
+
+def rebuild_class_rollups(form, subject_id):
+    counts = {}
+    with transaction.atomic():
+        revision = ClassMastery.objects.filter(
+            rollup_id=class_rollup_id(form, subject_id)
+        ).values_list('revision', flat=True).first() or 0
+
+        StudentMastery.objects.filter(student__form=form, subject_id=subject_id).delete()
+        SubtopicMastery.objects.filter(form=form, subject_id=subject_id).delete()
+        ClassMastery.objects.filter(form=form, subject_id=subject_id).delete()
+
+        bkt_values = BKT.objects.filter(student__form=form, subject_id=subject_id)
+        for model, group_fields, make_id in ROLLUPS:
+            rollups = build_rollups(model, group_fields, make_id, bkt_values)
+            model.objects.bulk_create(rollups, batch_size=1000)
+            counts[model.__name__] = len(rollups)
+
+        ClassMastery.objects.filter(rollup_id=class_rollup_id(form, subject_id)).update(revision=revision + 1)
+    return counts
+
+
+# Stored rollups are compared with totals calculated from the live BKT table.
+# A list of (model name, rollup id, stored total and count, live total and count) is returned for
+# every rollup that does not match, including any that are missing from either side.
+
+def compare_rollups(tolerance=1e-6):
+    mismatches = []
+    for model, group_fields, make_id in ROLLUPS:
+        live = {
+            rollup.rollup_id: (rollup.p_known_total, rollup.bkt_count)
+            for rollup in build_rollups(model, group_fields, make_id, BKT.objects.all())
+        }
+        stored = {
+            rollup_id: (total, count)
+            for rollup_id, total, count in model.objects.values_list('rollup_id', 'p_known_total', 'bkt_count')
+        }
+        for rollup_id in sorted(set(live) | set(stored)):
+            stored_value = stored.get(rollup_id, (0, 0))
+            live_value = live.get(rollup_id, (0, 0))
+            if (stored_value[1] != live_value[1]
+                    or abs(stored_value[0] - live_value[0]) > tolerance):
+                mismatches.append((model.__name__, rollup_id, stored_value, live_value))
+    return mismatches
+
+
+# All rollups for one form in one subject are built from the BKT table. Rollups that already exist are kept.
+
+def build_class_rollups(form, subject_id):
+    with transaction.atomic():
+        bkt_values = BKT.objects.filter(student__form=form, subject_id=subject_id)
+        for model, group_fields, make_id in ROLLUPS:
+            model.objects.bulk_create(
+                build_rollups(model, group_fields, make_id, bkt_values),
+                ignore_conflicts=True
+            )
+
+
+# Rollups for one form in one subject are read by primary key. If the class has no rollup yet,
+# the rollups for it are built from the BKT table first, so that they do not need building by hand.
+# Returns the class rollup and dictionaries of student and subtopic rollups keyed by their ids.
+
+def class_rollups(form, subject_id, student_ids, subtopic_ids):
+    class_rollup = ClassMastery.objects.filter(rollup_id=class_rollup_id(form, subject_id)).first()
+
+    if class_rollup is None:
+        build_class_rollups(form, subject_id)
+        class_rollup = ClassMastery.objects.filter(rollup_id=class_rollup_id(form, subject_id)).first()
+
+    student_rollups = StudentMastery.objects.in_bulk(
+        [student_rollup_id(student_id, subject_id) for student_id in student_ids]
+    )
+    subtopic_rollups = SubtopicMastery.objects.in_bulk(
+        [subtopic_rollup_id(form, subtopic_id) for subtopic_id in subtopic_ids]
+    )
+    return class_rollup, student_rollups, subtopic_rollups
+
+
+# BKT rows also move between classes or disappear without going through bkt.save_row or bkt.delete_rows: when a
+# student is saved with a different form, and when a student (or their user) or a subtopic is deleted along with
+# its BKT rows. The classes those rows were counted in are noted before the change, and rebuilt from the BKT table
+# once it has been made. Classes that have never been built are left to be built when they are first read.
+# Changes made with QuerySet.update() do not send these signals, so rebuildrollups should be run after them.
+
+@receiver(pre_save, sender=Student)
+def note_form_change(sender, instance, raw=False, **kwargs):
+    instance.rollup_classes = set()
+    if raw:
+        return
+    previous_form = Student.objects.filter(student_id=instance.student_id).values_list('form', flat=True).first()
+    if previous_form is not None and previous_form != instance.form:
+        subject_ids = set(BKT.objects.filter(student_id=instance.student_id).values_list('subject_id', flat=True))
+        instance.rollup_classes = {
+            (form, subject_id) for subject_id in subject_ids for form in (previous_form, instance.form)
+        }
+
+
+@receiver(pre_delete, sender=Student)
+@receiver(pre_delete, sender=Subtopic)
+def note_deleted_classes(sender, instance, **kwargs):
+    rows = BKT.objects.filter(**{'student_id' if sender is Student else 'subtopic_id': instance.pk})
+    instance.rollup_classes = set(rows.values_list('student__form', 'subject_id'))
+
+
+@receiver(post_save, sender=Student)
+@receiver(post_delete, sender=Student)
+@receiver(post_delete, sender=Subtopic)
+def rebuild_noted_classes(sender, instance, **kwargs):
+    for form, subject_id in sorted(getattr(instance, 'rollup_classes', ())):
+        if ClassMastery.objects.filter(form=form, subject_id=subject_id).exists():
+            rebuild_class_rollups(form, subject_id)
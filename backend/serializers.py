@@ -3,13 +3,14 @@
 # Each model is imported and all fields are serialised.
 
 from rest_framework import serializers
-from .models import User, Teacher, Student, Subject, Subtopic, Question, BKT, Quiz
+from .models import User, Teacher, Student, Subject, Subtopic, Question, BKT, Quiz, Job
 
 
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
         fields = '__all__'
+        extra_kwargs = {'password': {'write_only': True}}
 
 
 class TeacherSerializer(serializers.ModelSerializer):
@@ -46,12 +47,22 @@ class BKTSerializer(serializers.ModelSerializer):
     class Meta:
         model = BKT
         fields = '__all__'
+        read_only_fields = ['version']
 
 
+# A quiz's score and completion are only set by submitQuiz, which scores the answers itself.
+
 class QuizSerializer(serializers.ModelSerializer):
     class Meta:
         model = Quiz
         fields = '__all__'
+        read_only_fields = ['completed', 'score', 'total_questions', 'completed_at']
+
+
+class JobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Job
+        fields = '__all__'
 
 
 # Login serialiser for authentication is set, but not as a model serialiser.
@@ -59,4 +70,4 @@ class QuizSerializer(serializers.ModelSerializer):
 
 class LoginSerializer(serializers.Serializer):
     email = serializers.EmailField()
-    password = serializers.CharField(max_length=16)
+    password = serializers.CharField(max_length=128)
@@ -0,0 +1,62 @@
+# A small school used by the tests: one subject with three subtopics, a teacher for form 7A and three students,
+# two in 7A and one in 7B. Every student has a BKT row for every subtopic, and every subtopic has two questions
+# whose correct answer is "a". The password is hashed once and given to every user, as hashing is deliberately slow.
+
+from backend.auth import hash_password
+from backend.models import BKT, Question, Student, Subject, Subtopic, Teacher, User
+from backend.provisioning import bkt_id
+
+
+def make_school():
+    subject = Subject.objects.create(subject_id='MATHS', subject_name='Maths')
+    subtopics = [
+        Subtopic.objects.create(subtopic_id=f"M{number}", subtopic_name=f"Topic {number}", subject=subject)
+        for number in range(3)
+    ]
+
+    password = hash_password('password')
+    teacher_user = User.objects.create(
+        user_id='U0', email='teacher@school.example', password=password, user_type='teacher',
+        first_name='Teacher', surname='Smith'
+    )
+    teacher = Teacher.objects.create(teacher_id='T0', user_id=teacher_user, form='7A', subject=subject)
+
+    students = []
+    for number, form in enumerate(['7A', '7A', '7B']):
+        user = User.objects.create(
+            user_id=f"U{number + 1}", email=f"student{number}@school.example", password=password,
+            user_type='student', first_name=f"Student{number}", surname='Jones'
+        )
+        students.append(Student.objects.create(student_id=f"ST{number}", user_id=user, form=form))
+
+    BKT.objects.bulk_create(
+        BKT(
+            bkt_id=bkt_id(student.student_id, subtopic.subtopic_id),
+            student=student,
+            subject=subject,
+            subtopic=subtopic,
+            p_initial_knowledge=0.3,
+            p_will_learn=0.1,
+            p_slip=0.1,
+            p_guess=0.2,
+            p_known=0.3
+        )
+        for student in students
+        for subtopic in subtopics
+    )
+    Question.objects.bulk_create(
+        Question(
+            question_id=f"{subtopic.subtopic_id}Q{number}",
+            subject=subject,
+            subtopic=subtopic,
+            question_text=f"Question {number}",
+            answer_1='a',
+            answer_2='b',
+            answer_3='c',
+            answer_4='d',
+            correct_answer='a'
+        )
+        for subtopic in subtopics
+        for number in range(2)
+    )
+    return subject, subtopics, teacher, students
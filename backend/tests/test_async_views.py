@@ -0,0 +1,52 @@
+# Tests that the async views under /api/async/ answer in the same way as the normal views they mirror.
+
+from unittest import mock
+
+from django.test import TestCase
+from rest_framework.test import APIClient
+
+from backend import cache, conditional
+from backend.models import Quiz
+from backend.tests.school import make_school
+
+
+class AsyncViewTests(TestCase):
+    def setUp(self):
+        self.subject, self.subtopics, self.teacher, self.students = make_school()
+        cache.get_cache().clear()
+        self.client = APIClient()
+        clock = mock.patch.object(conditional, 'time', mock.Mock(time=mock.Mock(return_value=1000.0)))
+        clock.start()
+        self.addCleanup(clock.stop)
+
+    def test_generate_quiz(self):
+        paths = ['/api/quiz/generateQuiz/', '/api/async/quiz/generateQuiz/']
+        for path, student in zip(paths, self.students):
+            quiz = Quiz.objects.create(teacher=self.teacher, student=student, subject=self.subject)
+            response = self.client.get(f"{path}?quiz_id={quiz.quiz_id}&student_id={student.student_id}")
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.json()['questions'])
+            self.assertEqual(self.client.get(f"{path}?quiz_id={quiz.quiz_id}&student_id=ST2").status_code, 404)
+
+    def test_update_bkt(self):
+        for path in ['/api/bktvalues/updateBKT/', '/api/async/bktvalues/updateBKT/']:
+            response = self.client.post(
+                path, {'student_id': 'ST0', 'question_id': 'M0Q0', 'selected_answer': 'a'}, format='json'
+            )
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.json()['correct'])
+
+            for student_id, question_id in [('missing', 'M0Q0'), ('ST0', 'missing')]:
+                response = self.client.post(
+                    path, {'student_id': student_id, 'question_id': question_id, 'selected_answer': 'a'}, format='json'
+                )
+                self.assertEqual(response.status_code, 404)
+
+    def test_get_quizzes(self):
+        Quiz.objects.create(teacher=self.teacher, student=self.students[0], subject=self.subject)
+        for path in ['/api/quiz/getQuizzes/', '/api/async/quiz/getQuizzes/']:
+            first = self.client.get(f"{path}?student_id=ST0")
+            self.assertEqual(first.status_code, 200)
+            self.assertEqual(first.json()['total_count'], 1)
+            self.assertEqual(self.client.get(f"{path}?student_id=ST0", HTTP_IF_NONE_MATCH=first['ETag']).status_code, 304)
+            self.assertEqual(self.client.get(f"{path}?student_id=ST0&cursor=x").status_code, 400)
@@ -0,0 +1,170 @@
+# Tests for saving BKT values when answers for the same subtopic arrive at the same time: the optimistic retry for
+# single answers, and the version check for batches of answers.
+
+import types
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase, skipUnlessDBFeature
+from rest_framework.test import APIClient
+
+from backend import bkt, rollups
+from backend.bkt import BKTUpdateConflict, apply_answer, apply_answers, calculate_p_known
+from backend.models import BKT, Question
+from backend.tests.school import make_school
+
+
+# Another answer is saved between reading the BKT row and writing it, by changing the row the first time (or
+# every time) the new value is calculated.
+
+def interrupted(bkt_id, times):
+    calls = []
+
+    def calculate(row, correct):
+        if len(calls) < times:
+            BKT.objects.filter(bkt_id=bkt_id).update(p_known=0.5, version=row.version + 1)
+        calls.append(row.p_known)
+        return calculate_p_known(row, correct)
+    return calculate, calls
+
+
+class ApplyAnswerTests(TestCase):
+    def setUp(self):
+        self.subject, self.subtopics, self.teacher, self.students = make_school()
+        rollups.rebuild_rollups()
+        self.student = self.students[0]
+        self.question = Question.objects.get(question_id='M0Q0')
+
+    def test_retries_when_row_changed(self):
+        calculate, calls = interrupted('ST0-M0', times=1)
+        with mock.patch.object(bkt, 'calculate_p_known', calculate):
+            correct, saved, previous_p_known = apply_answer(self.student, self.question, 'a')
+
+        expected = calculate_p_known(types.SimpleNamespace(p_known=0.5, p_slip=0.1, p_guess=0.2, p_will_learn=0.1), True)
+        self.assertTrue(correct)
+        self.assertEqual(calls, [0.3, 0.5])
+        self.assertEqual(previous_p_known, 0.5)
+        self.assertEqual(BKT.objects.get(bkt_id='ST0-M0').p_known, expected)
+        self.assertEqual(BKT.objects.get(bkt_id='ST0-M0').version, 2)
+
+    def test_conflict_after_every_attempt_clashes(self):
+        calculate, calls = interrupted('ST0-M0', times=3)
+        with mock.patch.object(bkt, 'calculate_p_known', calculate):
+            with self.assertRaises(BKTUpdateConflict):
+                apply_answer(self.student, self.question, 'a', attempts=3)
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(BKT.objects.get(bkt_id='ST0-M0').p_known, 0.5)
+
+    def test_rollups_match_after_answers(self):
+        for question_id, answer in [('M0Q0', 'a'), ('M0Q1', 'b'), ('M1Q0', 'a')]:
+            apply_answer(self.student, Question.objects.get(question_id=question_id), answer)
+        self.assertEqual(rollups.compare_rollups(), [])
+
+
+# Answers that are not a list of objects with question ids, or a student that does not exist, are turned away.
+
+class SubmitAnswersTests(TestCase):
+    def setUp(self):
+        make_school()
+        self.client = APIClient()
+
+    def test_invalid_answers(self):
+        for answers in [[1], 'x', [{'selected_answer': 'a'}], [{'question_id': ['M0Q0']}], None]:
+            response = self.client.post(
+                '/api/bktvalues/submitAnswers/', {'student_id': 'ST0', 'answers': answers}, format='json'
+            )
+            self.assertEqual(response.status_code, 400, answers)
+        self.assertEqual(BKT.objects.filter(version__gt=0).count(), 0)
+
+    def test_unknown_student(self):
+        response = self.client.post('/api/bktvalues/submitAnswers/', {
+            'student_id': 'missing', 'answers': [{'question_id': 'M0Q0', 'selected_answer': 'a'}]
+        }, format='json')
+        self.assertEqual(response.status_code, 404)
+
+    def test_answers_saved(self):
+        response = self.client.post('/api/bktvalues/submitAnswers/', {
+            'student_id': 'ST0', 'answers': [{'question_id': 'M0Q0', 'selected_answer': 'a'}]
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['score'], 1)
+
+
+# The same checks for a batch of answers. Row locks are ignored by SQLite, so these show that a batch which read
+# a row before another answer changed it is refused and saves nothing, rather than overwriting that answer.
+# The other answer is made in the same transaction here, so it is rolled back along with the batch.
+
+class ApplyAnswersTests(TestCase):
+    def setUp(self):
+        self.subject, self.subtopics, self.teacher, self.students = make_school()
+        rollups.rebuild_rollups()
+        self.student = self.students[0]
+        self.client = APIClient()
+
+    def test_batch_saves_each_row_once(self):
+        with transaction.atomic():
+            answered = apply_answers(self.student, [('M0Q0', 'a'), ('M0Q1', 'a'), ('M1Q0', 'b')])
+        self.assertEqual(len(answered), 3)
+        self.assertEqual(BKT.objects.get(bkt_id='ST0-M0').version, 1)
+        self.assertEqual(BKT.objects.get(bkt_id='ST0-M0').p_known, answered[1][4])
+        self.assertEqual(BKT.objects.get(bkt_id='ST0-M1').version, 1)
+        self.assertEqual(rollups.compare_rollups(), [])
+
+    def test_batch_refused_when_row_changed(self):
+        calculate, calls = interrupted('ST0-M0', times=1)
+        with mock.patch.object(bkt, 'calculate_p_known', calculate):
+            with self.assertRaises(BKTUpdateConflict):
+                with transaction.atomic():
+                    apply_answers(self.student, [('M0Q0', 'a'), ('M1Q0', 'a')])
+        self.assertEqual(BKT.objects.get(bkt_id='ST0-M1').p_known, 0.3)
+        self.assertEqual(BKT.objects.get(bkt_id='ST0-M1').version, 0)
+        self.assertEqual(rollups.compare_rollups(), [])
+
+    def test_submit_answers_returns_conflict(self):
+        calculate, calls = interrupted('ST0-M0', times=1)
+        with mock.patch.object(bkt, 'calculate_p_known', calculate):
+            response = self.client.post('/api/bktvalues/submitAnswers/', {
+                'student_id': 'ST0',
+                'answers': [{'question_id': 'M0Q0', 'selected_answer': 'a'}]
+            }, format='json')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(BKT.objects.get(bkt_id='ST0-M0').version, 0)
+
+
+# Many correct answers are applied to one BKT value from a pool of threads, and the final value is compared with
+# applying the same answers one after another. As every answer is correct, the order does not change the result,
+# so any difference means an update was lost. Answers that still clash after every attempt are left out of the
+# expected value. This needs a database that lets several connections write at once, so is skipped on SQLite.
+
+class ConcurrentAnswerTests(TransactionTestCase):
+    ANSWERS = 100
+    THREADS = 8
+
+    @skipUnlessDBFeature('has_select_for_update')
+    def test_no_answers_lost(self):
+        student = make_school()[3][0]
+        rollups.rebuild_rollups()
+        question = Question.objects.get(question_id='M0Q0')
+        original = BKT.objects.get(bkt_id='ST0-M0')
+
+        def answer(_):
+            try:
+                apply_answer(student, question, 'a', attempts=50)
+                return True
+            except BKTUpdateConflict:
+                return False
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=self.THREADS) as pool:
+            saved = sum(pool.map(answer, range(self.ANSWERS)))
+
+        expected = types.SimpleNamespace(p_known=original.p_known, p_slip=0.1, p_guess=0.2, p_will_learn=0.1)
+        for _ in range(saved):
+            expected.p_known = calculate_p_known(expected, True)
+
+        final = BKT.objects.get(bkt_id='ST0-M0')
+        self.assertEqual(final.version - original.version, saved)
+        self.assertEqual(final.p_known, expected.p_known)
+        self.assertEqual(rollups.compare_rollups(), [])
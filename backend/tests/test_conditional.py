@@ -0,0 +1,56 @@
+# Tests for ETags on the read-heavy GET actions: unchanged data returns 304, and changes made with bulk updates
+# or by rebuilding the rollups give a new ETag. The ETag window is held still so that it cannot roll over
+# part way through a test.
+
+from unittest import mock
+
+from django.test import TestCase
+
+from rest_framework.test import APIClient
+
+from backend import cache, conditional, rollups
+from backend.models import Quiz, Student
+from backend.tests.school import make_school
+
+
+class ETagTests(TestCase):
+    def setUp(self):
+        self.subject, self.subtopics, self.teacher, self.students = make_school()
+        cache.get_cache().clear()
+        self.client = APIClient()
+        clock = mock.patch.object(conditional, 'time', mock.Mock(time=mock.Mock(return_value=1000.0)))
+        clock.start()
+        self.addCleanup(clock.stop)
+
+    def get(self, path, etag=None):
+        headers = {'HTTP_IF_NONE_MATCH': etag} if etag else {}
+        return self.client.get(path, **headers)
+
+    def test_quizzes_changed_by_bulk_update(self):
+        Quiz.objects.create(teacher=self.teacher, student=self.students[0], subject=self.subject)
+        path = '/api/quiz/getQuizzes/?student_id=ST0'
+        first = self.get(path)
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(self.get(path, first['ETag']).status_code, 304)
+
+        Quiz.objects.filter(student=self.students[0]).update(completed=True)
+        changed = self.get(path, first['ETag'])
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed['ETag'], first['ETag'])
+
+    def test_progress_changed_by_rebuild(self):
+        path = '/api/teacher/getProgressData/?teacher_id=T0'
+        self.get(path)
+        first = self.get(path)
+        self.assertEqual(self.get(path, first['ETag']).status_code, 304)
+
+        rollups.rebuild_rollups()
+        self.assertEqual(self.get(path, first['ETag']).status_code, 200)
+
+    def test_students_changed_by_new_student(self):
+        path = '/api/quiz/getStudents/?teacher_id=T0'
+        first = self.get(path)
+        self.assertEqual(self.get(path, first['ETag']).status_code, 304)
+
+        Student.objects.filter(student_id='ST2').update(form='7A')
+        self.assertEqual(self.get(path, first['ETag']).status_code, 200)
@@ -0,0 +1,44 @@
+# Tests for importing questions, checking that bad rows are reported without stopping the import.
+
+import csv
+import json
+import os
+import tempfile
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase
+
+from backend.models import Question
+from backend.tests.school import make_school
+
+
+def question(question_id):
+    return {
+        'question_id': question_id, 'subject_id': 'MATHS', 'subtopic_id': 'M0', 'question_text': 'Pick a',
+        'answer_1': 'a', 'answer_2': 'b', 'answer_3': 'c', 'answer_4': 'd', 'correct_answer': 'a',
+    }
+
+
+class ImportJsonLinesTests(TestCase):
+    def setUp(self):
+        make_school()
+        directory = tempfile.mkdtemp()
+        self.path = os.path.join(directory, 'questions.jsonl')
+        self.errors = os.path.join(directory, 'errors.csv')
+
+    def test_invalid_line_reported(self):
+        with open(self.path, 'w', encoding='utf-8') as file:
+            file.write(json.dumps(question('NEW0')) + '\n')
+            file.write('{"question_id": "NEW1",\n')
+            file.write(json.dumps(question('NEW2')) + '\n')
+
+        output = StringIO()
+        call_command('importquestions', self.path, '--chunk-size', '1', '--errors', self.errors, stdout=output)
+        self.assertIn('Imported 2 questions, 1 rows could not be imported', output.getvalue())
+        self.assertEqual(Question.objects.filter(question_id__in=['NEW0', 'NEW2']).count(), 2)
+
+        with open(self.errors, newline='') as file:
+            rows = list(csv.reader(file))
+        self.assertEqual(rows[1][0], '2')
+        self.assertIn('not valid JSON', rows[1][2])
@@ -0,0 +1,102 @@
+# Tests for background jobs: queueing the same work twice, claiming, retrying and failing, and jobs left behind
+# by a worker that stopped. TransactionTestCase is used as run_job closes its database connection when it finishes.
+
+from datetime import timedelta
+from unittest import mock
+
+from django.test import TransactionTestCase, override_settings
+from django.utils import timezone
+
+from backend import jobs
+from backend.models import ClassMastery, Job
+from backend.tests.school import make_school
+
+
+class EnqueueTests(TransactionTestCase):
+    def test_same_work_returns_existing_job(self):
+        job, created = jobs.enqueue('rebuild_rollups', {'form': '7A', 'subject_id': 'MATHS'})
+        again, created_again = jobs.enqueue('rebuild_rollups', {'subject_id': 'MATHS', 'form': '7A'})
+        self.assertTrue(created)
+        self.assertFalse(created_again)
+        self.assertEqual(again.job_id, job.job_id)
+
+    def test_finished_job_can_be_queued_again(self):
+        job, _ = jobs.enqueue('rebuild_rollups')
+        Job.objects.filter(job_id=job.job_id).update(status='succeeded')
+        self.assertTrue(jobs.enqueue('rebuild_rollups')[1])
+
+    def test_invalid_jobs_are_turned_away(self):
+        with self.assertRaises(jobs.InvalidJob):
+            jobs.enqueue('unknown')
+        with self.assertRaises(jobs.InvalidJob):
+            jobs.enqueue('rebuild_rollups', {'unknown': 1})
+
+
+class RunJobTests(TransactionTestCase):
+    def setUp(self):
+        make_school()
+
+    def test_job_can_only_be_claimed_once(self):
+        job, _ = jobs.enqueue('rebuild_rollups')
+        self.assertEqual(jobs.ready_jobs(10), [job.job_id])
+        self.assertTrue(jobs.claim(job.job_id))
+        self.assertFalse(jobs.claim(job.job_id))
+        self.assertEqual(jobs.ready_jobs(10), [])
+
+    def test_job_succeeds(self):
+        job, _ = jobs.enqueue('rebuild_rollups', {'form': '7A', 'subject_id': 'MATHS'})
+        jobs.claim(job.job_id)
+        self.assertEqual(jobs.run_job(job.job_id), 'succeeded')
+        job.refresh_from_db()
+        self.assertEqual(job.progress, 1)
+        self.assertEqual(job.result['rebuilt']['ClassMastery'], 1)
+        self.assertTrue(ClassMastery.objects.filter(form='7A', subject_id='MATHS').exists())
+
+    @override_settings(JOB_RETRY_DELAY=10)
+    def test_failed_job_is_retried_then_failed(self):
+        failing = mock.Mock(side_effect=RuntimeError('database unavailable'))
+        with mock.patch.dict(jobs.HANDLERS, {'rebuild_rollups': failing}):
+            job, _ = jobs.enqueue('rebuild_rollups', max_attempts=2)
+            jobs.claim(job.job_id)
+            self.assertEqual(jobs.run_job(job.job_id), 'queued')
+            job.refresh_from_db()
+            self.assertGreater(job.run_after, timezone.now() + timedelta(seconds=5))
+            self.assertEqual(jobs.ready_jobs(10), [])
+
+            Job.objects.filter(job_id=job.job_id).update(run_after=timezone.now())
+            jobs.claim(job.job_id)
+            self.assertEqual(jobs.run_job(job.job_id), 'failed')
+        job.refresh_from_db()
+        self.assertIn('database unavailable', job.error)
+
+    def test_job_failed_error_is_not_retried(self):
+        job, _ = jobs.enqueue('create_quizzes', {'teacher_id': 'missing'})
+        jobs.claim(job.job_id)
+        self.assertEqual(jobs.run_job(job.job_id), 'failed')
+
+    def test_stale_job_is_queued_again(self):
+        job, _ = jobs.enqueue('rebuild_rollups')
+        jobs.claim(job.job_id)
+        Job.objects.filter(job_id=job.job_id).update(heartbeat_at=timezone.now() - timedelta(seconds=600))
+        self.assertEqual(jobs.requeue_stale(300), (1, 0))
+        self.assertEqual(jobs.ready_jobs(10), [job.job_id])
+
+
+    # A worker that was thought to have stopped finishes after its job was queued again and claimed by another
+    # worker. Its result must not overwrite the new run.
+
+    def test_old_run_does_not_overwrite_new_run(self):
+        def slow_handler(progress):
+            Job.objects.filter(job_id=job.job_id).update(heartbeat_at=timezone.now() - timedelta(seconds=600))
+            jobs.requeue_stale(300)
+            jobs.claim(job.job_id)
+            return {'from': 'old run'}
+
+        with mock.patch.dict(jobs.HANDLERS, {'rebuild_rollups': slow_handler}):
+            job, _ = jobs.enqueue('rebuild_rollups')
+            jobs.claim(job.job_id)
+            jobs.run_job(job.job_id)
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'running')
+        self.assertEqual(job.attempts, 2)
+        self.assertIsNone(job.result)
@@ -0,0 +1,29 @@
+# Tests for logging in, through both the DRF view and the async view.
+
+from django.test import TestCase
+from rest_framework.test import APIClient
+
+from backend import cache
+from backend.tests.school import make_school
+
+
+class CheckLoginTests(TestCase):
+    def setUp(self):
+        make_school()
+        cache.get_cache().clear()
+        self.client = APIClient()
+
+    def test_login(self):
+        for path in ['/api/login/checkLogin/', '/api/async/login/checkLogin/']:
+            response = self.client.post(path, {'email': 'teacher@school.example', 'password': 'password'}, format='json')
+            self.assertEqual(response.status_code, 200)
+            response = self.client.post(path, {'email': 'teacher@school.example', 'password': 'wrong'}, format='json')
+            self.assertEqual(response.status_code, 401)
+
+    def test_fields_must_be_text(self):
+        for path in ['/api/login/checkLogin/', '/api/async/login/checkLogin/']:
+            for data in [{'email': 'teacher@school.example', 'password': 123},
+                         {'email': ['teacher@school.example'], 'password': 'password'},
+                         {'email': 'teacher@school.example'}]:
+                response = self.client.post(path, data, format='json')
+                self.assertEqual(response.status_code, 400)
@@ -0,0 +1,22 @@
+# Tests for packing p_known snapshots into mastery series.
+
+from datetime import timedelta
+
+from django.test import SimpleTestCase
+from django.utils import timezone
+
+from backend import mastery_series
+from backend.models import MasterySeries
+
+
+class AppendSnapshotTests(SimpleTestCase):
+    def test_values_stored_as_whole_percentages(self):
+        series = MasterySeries()
+        taken_at = timezone.now()
+        mastery_series.append_snapshot(series, {'M0': 0.123456, 'M1': 0.5}, taken_at)
+        mastery_series.append_snapshot(series, {'M0': 1.7, 'M1': -0.2, 'M2': 0.996}, taken_at + timedelta(seconds=5))
+
+        times, matrix = mastery_series.decode_series(series)
+        self.assertEqual(list(times - times[0]), [0, 5])
+        self.assertEqual(matrix[0, :2].tolist(), [12.0, 50.0])
+        self.assertEqual(matrix[1].tolist(), [100.0, 0.0, 100.0])
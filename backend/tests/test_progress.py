@@ -0,0 +1,25 @@
+# Tests for the teacher progress data, which is read from the progress rollups.
+
+from django.test import TestCase
+from rest_framework.test import APIClient
+
+from backend import cache
+from backend.tests.school import make_school
+
+
+class ProgressDataTests(TestCase):
+    def setUp(self):
+        make_school()
+        cache.get_cache().clear()
+        self.client = APIClient()
+
+    def test_class_averages(self):
+        response = self.client.get('/api/teacher/getProgressData/?teacher_id=T0')
+        self.assertEqual(response.status_code, 200)
+        subject = response.data[0]['subject']
+        self.assertEqual([student['student_id'] for student in subject['students']], ['ST0', 'ST1'])
+        self.assertEqual(subject['class_average_p_known'], 30.0)
+
+    def test_unknown_teacher_not_found(self):
+        for path in ['/api/teacher/getProgressData/?teacher_id=missing', '/api/teacher/getProgressData/']:
+            self.assertEqual(self.client.get(path).status_code, 404)
@@ -0,0 +1,51 @@
+# Tests for taking quizzes: a quiz's score is only ever set by submitQuiz, which scores the answers itself.
+
+from django.test import TestCase
+from rest_framework.test import APIClient
+
+from backend.models import Quiz
+from backend.tests.school import make_school
+
+
+class QuizScoreTests(TestCase):
+    def setUp(self):
+        self.subject, self.subtopics, self.teacher, self.students = make_school()
+        self.quiz = Quiz.objects.create(teacher=self.teacher, student=self.students[0], subject=self.subject)
+        self.client = APIClient()
+
+    def test_score_cannot_be_sent_by_client(self):
+        response = self.client.post('/api/quiz/markCompleted/', {
+            'assigned_quiz_id': self.quiz.quiz_id, 'score': 999, 'total_questions': 1
+        }, format='json')
+        self.assertNotEqual(response.status_code, 200)
+
+        self.client.patch(f"/api/quiz/{self.quiz.quiz_id}/", {'score': 999, 'completed': True}, format='json')
+        self.quiz.refresh_from_db()
+        self.assertFalse(self.quiz.completed)
+        self.assertIsNone(self.quiz.score)
+
+    def test_submit_quiz_scores_answers(self):
+        session = self.client.get(
+            f"/api/quiz/generateQuiz/?quiz_id={self.quiz.quiz_id}&student_id=ST0"
+        ).data
+        question_ids = [question['question_id'] for question in session['questions']]
+        response = self.client.post('/api/quiz/submitQuiz/', {
+            'session_id': session['session_id'],
+            'answers': [{'question_id': question_id, 'selected_answer': 'a'} for question_id in question_ids]
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.quiz.refresh_from_db()
+        self.assertTrue(self.quiz.completed)
+        self.assertEqual(self.quiz.score, len(question_ids))
+
+    def test_invalid_answers(self):
+        session = self.client.get(
+            f"/api/quiz/generateQuiz/?quiz_id={self.quiz.quiz_id}&student_id=ST0"
+        ).data
+        for answers in [[1], 'x', [{'question_id': {}}]]:
+            response = self.client.post(
+                '/api/quiz/submitQuiz/', {'session_id': session['session_id'], 'answers': answers}, format='json'
+            )
+            self.assertEqual(response.status_code, 400, answers)
+        self.quiz.refresh_from_db()
+        self.assertFalse(self.quiz.completed)
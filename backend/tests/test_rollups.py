@@ -0,0 +1,125 @@
+# Tests for the progress rollups: ids that cannot clash, classes being built the first time they are changed,
+# revisions being carried on when rollups are rebuilt, and BKT rows edited through the API.
+
+from django.db import transaction
+from django.test import TestCase
+from rest_framework.test import APIClient
+
+from backend import rollups
+from backend.models import BKT, ClassMastery, StudentMastery
+from backend.tests.school import make_school
+
+
+class RollupIdTests(TestCase):
+    def test_ids_do_not_clash(self):
+        self.assertNotEqual(rollups.student_rollup_id('A-B', 'C'), rollups.student_rollup_id('A', 'B-C'))
+        self.assertNotEqual(rollups.class_rollup_id('7-A', 'B'), rollups.class_rollup_id('7', 'A-B'))
+
+    def test_longest_ids_fit(self):
+        rollup_id = rollups.student_rollup_id('S' * 5, 'X' * 20)
+        self.assertLessEqual(len(rollup_id), StudentMastery._meta.get_field('rollup_id').max_length)
+
+
+class ApplyChangesTests(TestCase):
+    def setUp(self):
+        self.subject, self.subtopics, self.teacher, self.students = make_school()
+
+    def test_missing_class_is_built_without_counting_twice(self):
+        student = self.students[0]
+        rollups.build_class_rollups('7B', 'MATHS')
+        with transaction.atomic():
+            BKT.objects.filter(bkt_id='ST0-M0').update(p_known=0.8)
+            rollups.apply_changes([(student.student_id, '7A', 'MATHS', 'M0', 0.5, 0)])
+        self.assertEqual(rollups.compare_rollups(), [])
+
+    def test_changes_are_added_to_existing_rollups(self):
+        rollups.rebuild_rollups()
+        revision = ClassMastery.objects.get(rollup_id=rollups.class_rollup_id('7A', 'MATHS')).revision
+        with transaction.atomic():
+            BKT.objects.filter(bkt_id__in=['ST0-M0', 'ST1-M0']).update(p_known=0.4)
+            rollups.apply_changes([
+                ('ST0', '7A', 'MATHS', 'M0', 0.1, 0),
+                ('ST1', '7A', 'MATHS', 'M0', 0.1, 0)
+            ])
+        self.assertEqual(rollups.compare_rollups(), [])
+        class_rollup = ClassMastery.objects.get(rollup_id=rollups.class_rollup_id('7A', 'MATHS'))
+        self.assertEqual(class_rollup.revision, revision + 1)
+
+    def test_rebuild_carries_revisions_on(self):
+        rollups.rebuild_rollups()
+        rollups.rebuild_class_rollups('7A', 'MATHS')
+        rollups.rebuild_rollups()
+        revisions = dict(ClassMastery.objects.values_list('form', 'revision'))
+        self.assertEqual(revisions, {'7A': 3, '7B': 2})
+
+
+# BKT rows created, edited, moved and deleted through the API are reflected in the rollups, and the version
+# cannot be set by the client.
+
+class BKTViewSetTests(TestCase):
+    def setUp(self):
+        make_school()
+        rollups.rebuild_rollups()
+        self.client = APIClient()
+
+    def test_update_keeps_rollups(self):
+        response = self.client.patch('/api/bktvalues/ST0-M0/', {'p_known': 0.9, 'version': 50}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(BKT.objects.get(bkt_id='ST0-M0').version, 1)
+        self.assertEqual(rollups.compare_rollups(), [])
+
+    def test_move_to_another_student_keeps_rollups(self):
+        BKT.objects.filter(bkt_id='ST2-M1').delete()
+        rollups.rebuild_rollups()
+        response = self.client.patch('/api/bktvalues/ST0-M1/', {'student': 'ST2'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(rollups.compare_rollups(), [])
+
+    def test_create_and_delete_keep_rollups(self):
+        BKT.objects.filter(bkt_id='ST1-M2').delete()
+        rollups.rebuild_rollups()
+        response = self.client.post('/api/bktvalues/', {
+            'bkt_id': 'ST1-M2', 'student': 'ST1', 'subject': 'MATHS', 'subtopic': 'M2', 'p_initial_knowledge': 0.3,
+            'p_will_learn': 0.1, 'p_slip': 0.1, 'p_guess': 0.2, 'p_known': 0.7
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(rollups.compare_rollups(), [])
+
+        self.assertEqual(self.client.delete('/api/bktvalues/ST0-M2/').status_code, 204)
+        self.assertEqual(rollups.compare_rollups(), [])
+
+
+# Moving a student to another form with save(), and deleting students, users and subtopics, rebuild the classes
+# their BKT rows were counted in. save() and delete() are used rather than QuerySet.update(), as only they send
+# the signals that keep the rollups in step.
+
+class StudentChangeTests(TestCase):
+    def setUp(self):
+        self.subject, self.subtopics, self.teacher, self.students = make_school()
+        rollups.rebuild_rollups()
+        self.client = APIClient()
+
+    def progress_students(self):
+        response = self.client.get('/api/teacher/getProgressData/?teacher_id=T0')
+        return [student['student_id'] for student in response.data[0]['subject']['students']]
+
+    def test_form_change_moves_rollups(self):
+        self.assertEqual(self.progress_students(), ['ST0', 'ST1'])
+        student = self.students[0]
+        student.form = '7B'
+        student.save()
+
+        self.assertEqual(rollups.compare_rollups(), [])
+        self.assertEqual(ClassMastery.objects.get(rollup_id=rollups.class_rollup_id('7A', 'MATHS')).bkt_count, 3)
+        self.assertEqual(ClassMastery.objects.get(rollup_id=rollups.class_rollup_id('7B', 'MATHS')).bkt_count, 6)
+        self.assertEqual(self.progress_students(), ['ST1'])
+
+    def test_deleting_user_removes_rows_from_rollups(self):
+        self.students[0].user_id.delete()
+        self.assertEqual(rollups.compare_rollups(), [])
+        self.assertEqual(ClassMastery.objects.get(rollup_id=rollups.class_rollup_id('7A', 'MATHS')).bkt_count, 3)
+
+    def test_deleting_subtopic_removes_rows_from_rollups(self):
+        self.subtopics[0].delete()
+        self.assertEqual(rollups.compare_rollups(), [])
+        self.assertEqual(ClassMastery.objects.get(rollup_id=rollups.class_rollup_id('7A', 'MATHS')).bkt_count, 4)
@@ -2,30 +2,42 @@
 from django.contrib import admin
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
+from . import async_views
 from .views import (
     Login, 
     BKTViewSet, 
     QuizViewSet, 
-    TeacherViewSet
+    TeacherViewSet,
+    MetricsViewSet,
+    ExportViewSet,
+    JobViewSet
 )
 
 
 # DRF Router for all API endpoints creates quick url routing without
 # explicit definition.
 
-# Login has a basename due to it being a non-model view.
+# Login, metrics and export have a basename due to them being non-model views.
 
 router = DefaultRouter()
 router.register(r'login', Login, basename='login')
 router.register(r'teacher', TeacherViewSet)
 router.register(r'bktvalues', BKTViewSet)
 router.register(r'quiz', QuizViewSet)
+router.register(r'metrics', MetricsViewSet, basename='metrics')
+router.register(r'export', ExportViewSet, basename='export')
+router.register(r'jobs', JobViewSet)
 
 
 # Patterns for admin portal and standard are included in the patterns array.
+# The async versions of the busiest actions are served under api/async/ when running under ASGI.
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('api/async/login/checkLogin/', async_views.check_login, name='async-checkLogin'),
+    path('api/async/quiz/generateQuiz/', async_views.generate_quiz, name='async-generateQuiz'),
+    path('api/async/quiz/getQuizzes/', async_views.get_quizzes, name='async-getQuizzes'),
+    path('api/async/bktvalues/updateBKT/', async_views.update_bkt, name='async-updateBKT'),
     path('api/', include(router.urls)),
 ]
 
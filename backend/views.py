@@ -1,12 +1,18 @@
 # Repsonse is imported from DRF to handle returning data.
 # Viewserts helps create the API views
 # Action allows for custom actions to be created to enhance functionality
-# Random is used to shuffle questions and quizzes
+# Transaction allows several database writes to be saved together
+# bisect_right finds where a page starts in a sorted list
 
 from rest_framework.response import Response
-from rest_framework import viewsets
+from rest_framework import status, viewsets
 from rest_framework.decorators import action
-import random
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from bisect import bisect_right
+from datetime import datetime, timezone as dt_timezone
 
 
 # All backend models are imported so that they can be accessed.
@@ -15,25 +21,55 @@ from backend.models import (
     Teacher,
     Student, 
     BKT, 
-    Subject, 
     Subtopic, 
-    User, 
     Question, 
-    Quiz
+    Quiz,
+    QuizSession,
+    Job
 )
+from backend import (
+    assignment, auth, cache, conditional, events, exports, jobs, mastery_series, metrics, pregeneration, provisioning,
+    question_bank, rollups
+)
+from backend.bkt import BKTUpdateConflict, apply_answer, apply_answers, delete_rows, save_row
 
 
 # Serialisers are imported for the required models where data needs to be sent to the frontend.
 
 from backend.serializers import (
-    UserSerializer, 
     TeacherSerializer, 
     BKTSerializer, 
-    QuizSerializer
-    
+    QuizSerializer,
+    JobSerializer
 )
 
 
+# Lists are returned a page at a time. The page size can be chosen with the limit parameter, up to a maximum.
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+
+
+def page_size(request):
+    query_params = getattr(request, 'query_params', request.GET)
+    try:
+        limit = int(query_params.get('limit', DEFAULT_PAGE_SIZE))
+    except ValueError:
+        limit = DEFAULT_PAGE_SIZE
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+
+# Answers sent in a request must be a list of objects, each with a question id.
+# Returns (question id, selected answer) pairs, or None if the answers are not in that form.
+
+def answer_pairs(answers):
+    if not isinstance(answers, list):
+        return None
+    if not all(isinstance(answer, dict) and isinstance(answer.get('question_id'), str) for answer in answers):
+        return None
+    return [(answer['question_id'], answer.get('selected_answer')) for answer in answers]
+
+
 # Standard viewset for login in made, triggered by the frontend when login is attempted.
 # This handles the authentication and checks if the user is valid.
 
@@ -42,21 +78,54 @@ class Login(viewsets.ViewSet):
     def checkLogin(self, request):
         email = request.data.get('email')
         password = request.data.get('password')
-        user = User.objects.get(email=email)
-        user_serializer = UserSerializer(user)
-        user_data = user_serializer.data
+        if not isinstance(email, str) or not isinstance(password, str):
+            return Response({'error': 'Email and password are required'}, status=status.HTTP_400_BAD_REQUEST)
+
+
+        # The password is checked against the stored hash, and the user is then read from the cache, which
+        # also holds their teacher or student id. The password is not included in the user data sent back to
+        # the frontend. Emails with too many failed logins, and logins while too many are already being
+        # checked, are turned away before the password is hashed. An email or password that is not text is
+        # turned away before any of this.
+
+        try:
+            login = auth.authenticate(email, password)
+        except auth.LoginThrottled as error:
+            return Response(
+                {'error': str(error)},
+                status=status.HTTP_429_TOO_MANY_REQUESTS,
+                headers={'Retry-After': str(error.retry_after)}
+            )
+        except auth.LoginBusy as error:
+            return Response({'error': str(error)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+        if login is None:
+            return Response({'error': 'Invalid login'}, status=status.HTTP_401_UNAUTHORIZED)
 
-        # If the user is a teacher, add teacher_id to the user data
-        if user.user_type == 'teacher':
-            teacher = Teacher.objects.get(user_id=user.user_id)
-            user_data['teacher_id'] = teacher.teacher_id
+        return Response({'user': login_user_data(login)})
 
-        # If the user is a student, add student_id to the user data (optional, for symmetry)
-        elif user.user_type == 'student':
-            student = Student.objects.get(user_id=user.user_id)
-            user_data['student_id'] = student.student_id
 
-        return Response({'user': user_data})
+# The user data sent to the frontend after logging in is built from the cached login.
+# This is shared with the async login view.
+
+def login_user_data(login):
+    user_data = {
+        'user_id': login['user_id'],
+        'email': login['email'],
+        'user_type': login['user_type'],
+        'first_name': login['first_name'],
+        'surname': login['surname']
+    }
+
+    # If the user is a teacher, add teacher_id to the user data
+    if login['user_type'] == 'teacher':
+        user_data['teacher_id'] = login['teacher__teacher_id']
+
+    # If the user is a student, add student_id to the user data (optional, for symmetry)
+    elif login['user_type'] == 'student':
+        user_data['student_id'] = login['student__student_id']
+
+    return user_data
 
 
 
@@ -66,6 +135,20 @@ class Login(viewsets.ViewSet):
 class BKTViewSet(viewsets.ModelViewSet):
     queryset = BKT.objects.all()
     serializer_class = BKTSerializer
+
+
+    # BKT rows created, edited or deleted through the API are saved along with the progress rollups.
+
+    def perform_create(self, serializer):
+        bkt_id = serializer.validated_data.get('bkt_id')
+        save_row(bkt_id, lambda version: serializer.save(version=version))
+
+    def perform_update(self, serializer):
+        bkt_id = serializer.validated_data.get('bkt_id', serializer.instance.bkt_id)
+        save_row(bkt_id, lambda version: serializer.save(version=version))
+
+    def perform_destroy(self, instance):
+        delete_rows(BKT.objects.filter(bkt_id=instance.bkt_id))
     
 
     # Function to update the p_known value is made, which runs when a student answers a question.
@@ -73,53 +156,280 @@ class BKTViewSet(viewsets.ModelViewSet):
 
     @action(detail=False, methods=['post'])
     def updateBKT(self, request):
-        student_id = request.data.get('student_id')
-        question_id = request.data.get('question_id')
-        selected_answer = request.data.get('selected_answer')
-
-        question = Question.objects.get(question_id=question_id)
-        subtopic = question.subtopic
-        student = Student.objects.get(student_id=student_id)
-        bkt = BKT.objects.get(student=student, subtopic=subtopic)
-        
-    
-        # Correct is set where the selected answer from the frontend directly matches the correct answer
-        # From the backend.
+        data, status_code = answer_question(
+            request.data.get('student_id'),
+            request.data.get('question_id'),
+            request.data.get('selected_answer')
+        )
+        return Response(data, status=status_code)
 
-        correct = (selected_answer == question.correct_answer)
-        
 
-        # If the value is correct, the BKT formula (taken from the dissertation) is used for a correct answer.
+    # Function to update the BKT values for several answers at once is made, so that a whole quiz can be
+    # submitted in one request. The answers are a list of question ids and selected answers for one student.
 
-        if correct:
-            top_value = bkt.p_known * (1 - bkt.p_slip)
-            bottom_value = top_value + (1 - bkt.p_known) * bkt.p_guess
+    @action(detail=False, methods=['post'])
+    def submitAnswers(self, request):
+        student_id = request.data.get('student_id')
+        answers = answer_pairs(request.data.get('answers', []))
+        if answers is None:
+            return Response(
+                {'error': 'answers must be a list of objects with a question_id'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
 
+        student = Student.objects.filter(student_id=student_id).first()
+        if student is None:
+            return Response({'error': 'Student not found'}, status=status.HTTP_404_NOT_FOUND)
 
-        # If the answer is incorrect, the formula for incorrect answers is used.
-           
-        else:
-            top_value = bkt.p_known * bkt.p_slip
-            bottom_value = top_value + (1 - bkt.p_known) * (1 - bkt.p_guess)
 
+        # The answers are applied in the order they were given, with each BKT row written once and the
+        # rollups updated in the same transaction. If another answer changed one of the rows at the same time,
+        # nothing is saved and a conflict is returned.
 
+        with transaction.atomic():
+            try:
+                answered = apply_answers(student, answers)
+            except BKTUpdateConflict:
+                transaction.set_rollback(True)
+                return Response(
+                    {'error': 'Answers could not be saved, please try again'},
+                    status=status.HTTP_409_CONFLICT
+                )
+        results = record_answers(student, answered)
 
-        # The "answer" value is taken by dividing value 1 by value 2.
-        # The new p_known value is then calculated using the final part of the formula with the calculated 
-        # p_answer value. 
 
-        p_answer = top_value / bottom_value
-        bkt.p_known = round(min(1.0, max(0.0, p_answer + (1 - p_answer) * bkt.p_will_learn)), 2)
-        bkt.save()
-        
-        
-        # The calculated values are then returned in the response for the frontend.
+        # The result for each answer is returned, along with the score for the submission.
 
         return Response({
+            'results': results,
+            'score': sum(1 for result in results if result['correct']),
+            'total_questions': len(results)
+        })
+
+
+# One answer is applied for a student, for updateBKT and its async version. Returns the data for the frontend
+# and the status code.
+
+def answer_question(student_id, question_id, selected_answer):
+    question = Question.objects.filter(question_id=question_id).first()
+    student = Student.objects.filter(student_id=student_id).first()
+    if question is None or student is None:
+        return {'error': 'Student or question not found'}, status.HTTP_404_NOT_FOUND
+
+
+    # Correct is set where the selected answer from the frontend directly matches the correct answer
+    # From the backend. The new p_known value is then calculated using the BKT formula, and saved
+    # along with the progress rollups. If another answer for the same subtopic is saved at the same time,
+    # the update is tried again, and a conflict is returned if it still cannot be saved.
+
+    try:
+        correct, bkt, previous_p_known = apply_answer(student, question, selected_answer)
+    except BKTUpdateConflict:
+        return {'error': 'Answer could not be saved, please try again'}, status.HTTP_409_CONFLICT
+
+
+    # The answer is recorded in the answer history, which is written in batches.
+
+    events.writer.record(student.student_id, question, selected_answer, correct, previous_p_known, bkt.p_known)
+
+
+    # The calculated values are then returned for the frontend.
+
+    return {
+        'correct': correct,
+        'correct_answer': question.correct_answer,
+        'p_known': round(bkt.p_known, 3)
+    }, status.HTTP_200_OK
+
+
+# Each answer is recorded in the answer history once the transaction it was applied in has been saved,
+# and the result for each answer is returned for the frontend.
+
+def record_answers(student, answered):
+    results = []
+    for question, selected_answer, correct, prior_p_known, posterior_p_known in answered:
+        events.writer.record(
+            student.student_id, question, selected_answer, correct, prior_p_known, posterior_p_known
+        )
+        results.append({
+            'question_id': question.question_id,
             'correct': correct,
             'correct_answer': question.correct_answer,
-            'p_known': round(bkt.p_known, 3)
+            'p_known': round(posterior_p_known, 3)
         })
+    return results
+
+
+# The questions sent to the frontend for a quiz, without their correct answers.
+
+def quiz_question_data(questions):
+    return [
+        {
+            'question_id': question.question_id, 
+            'question_text': question.question_text, 
+            'answer_1': question.answer_1, 
+            'answer_2': question.answer_2, 
+            'answer_3': question.answer_3, 
+            'answer_4': question.answer_4
+        } for question in questions
+    ]
+
+
+# The columns read for each assigned quiz, and the data sent to the frontend for them.
+
+ASSIGNED_QUIZ_FIELDS = (
+    'quiz_id',
+    'subject_id',
+    'subject__subject_name',
+    'teacher_id',
+    'teacher__user_id__first_name',
+    'teacher__user_id__surname'
+)
+
+
+def assigned_quiz_data(rows):
+    return [
+        {
+            'quiz_id': quiz['quiz_id'],
+            'subject_id': quiz['subject_id'],
+            'subject_name': quiz['subject__subject_name'],
+            'teacher_id': quiz['teacher_id'],
+            'teacher_name': f"{quiz['teacher__user_id__first_name']} {quiz['teacher__user_id__surname']}"
+        }
+        for quiz in rows
+    ]
+
+
+# A quiz is started for a student, for generateQuiz and its async version. Returns the data for the frontend
+# and the status code.
+
+def start_quiz(quiz_id, student_id):
+    quiz = None
+    if quiz_id and quiz_id.isdigit():
+        quiz = Quiz.objects.select_related('subject').filter(quiz_id=quiz_id).first()
+    if quiz is None or quiz.student_id != student_id:
+        return {'error': 'Quiz not found'}, status.HTTP_404_NOT_FOUND
+    if quiz.completed:
+        return {'error': 'This quiz has already been completed'}, status.HTTP_409_CONFLICT
+
+    student_id = quiz.student_id
+    subject = quiz.subject
+
+
+    # The p_known values for every subtopic in the subject are retrieved for the student in one query.
+    # If questions were chosen when the quiz was assigned and the student's p_known values have not moved
+    # far since then, those questions are used. Otherwise they are chosen from the question bank, which holds
+    # the question ids for each subtopic in memory. Only the chosen questions are then retrieved.
+
+    p_known_values = dict(
+        BKT.objects
+        .filter(student_id=student_id, subject=subject)
+        .values_list('subtopic_id', 'p_known')
+    )
+
+
+    # The subject's subtopics are read from the cache, and BKT rows are created for any the student
+    # does not have yet, so that a new student can be given a quiz straight away.
+
+    missing = [
+        subtopic_id
+        for subtopic_id, _ in cache.subject(subject.subject_id)['subtopics']
+        if subtopic_id not in p_known_values
+    ]
+    if missing and provisioning.provision([student_id], missing):
+        p_known_values = dict(
+            BKT.objects
+            .filter(student_id=student_id, subject=subject)
+            .values_list('subtopic_id', 'p_known')
+        )
+
+    if pregeneration.is_current(quiz, p_known_values):
+        question_ids = quiz.question_ids
+    else:
+        question_ids = question_bank.choose_questions(subject.subject_id, sorted(p_known_values.items()))
+
+    questions = Question.objects.only(
+        'question_id', 'question_text', 'answer_1', 'answer_2', 'answer_3', 'answer_4'
+    ).in_bulk(question_ids)
+    questionList = [questions[question_id] for question_id in question_ids if question_id in questions]
+
+
+    # dictionary is created to hold the question data, taking all of them in order. This makes the quiz
+    # ready to pass to the frontend.
+
+    question_data = quiz_question_data(questionList)
+
+
+    # A session is created holding the questions given, so that the answers can be submitted and scored
+    # together once the quiz is finished.
+
+    session = QuizSession.objects.create(
+        quiz=quiz,
+        student_id=student_id,
+        question_ids=[question.question_id for question in questionList]
+    )
+
+
+    # The data to be sent to the frontend is created, containing the quiz data,
+    # The amount of questions and the subject.
+
+    return {
+        'session_id': str(session.session_id),
+        'questions': question_data,
+        'total_questions': len(question_data),
+        'subject_name': subject.subject_name,
+        'quiz_type': 'assigned'
+    }, status.HTTP_200_OK
+
+
+# A student's open quizzes, for getQuizzes and its async version. Returns the data for the frontend, the status
+# code and the ETag headers, with no data if the frontend already has the current version.
+
+def quizzes_data(request):
+    student_id = request.GET.get('student_id')
+    return conditional.conditional_data(
+        request,
+        conditional.quizzes_stamp(student_id),
+        lambda: quiz_list(request, student_id)
+    )
+
+
+def quiz_list(request, student_id):
+    subject_id = request.GET.get('subject_id')
+    cursor = request.GET.get('cursor')
+    limit = page_size(request)
+
+    quizzes = Quiz.objects.filter(
+        student_id=student_id,
+        completed=False
+    )
+    if subject_id:
+        quizzes = quizzes.filter(subject_id=subject_id)
+    total_count = quizzes.count()
+
+
+    # Only the columns needed are retrieved, with the subject and teacher names joined in the same query.
+    # One more quiz than the page size is fetched, to tell whether there is another page.
+
+    if cursor:
+        if not cursor.isdigit():
+            return {'error': 'Invalid cursor'}, status.HTTP_400_BAD_REQUEST
+        quizzes = quizzes.filter(quiz_id__gt=int(cursor))
+    rows = list(
+        quizzes
+        .order_by('quiz_id')
+        .values(*ASSIGNED_QUIZ_FIELDS)[:limit + 1]
+    )
+    more = len(rows) > limit
+    rows = rows[:limit]
+
+    quiz_data = assigned_quiz_data(rows)
+
+    return {
+        'assigned_quizzes': quiz_data,
+        'total_count': total_count,
+        'next_cursor': rows[-1]['quiz_id'] if rows and more else None
+    }, status.HTTP_200_OK
 
 
 # Viewset for quizzes is created, with all data being made available in the queryset.
@@ -130,184 +440,187 @@ class QuizViewSet(viewsets.ModelViewSet):
     
     # Quiz generator is created, using the data retrieved from the frontend request.
 # It can only get quizzes that have been assigned, so there will always be a quiz id.
+    # The quiz must belong to the student asking for it, and a quiz that is already completed cannot be started
+    # again. The student is always taken from the quiz, so a session can only ever score the quiz's own student.
 
     @action(detail=False, methods=['get'])
     def generateQuiz(self, request):
-        student_id = request.query_params.get('student_id')
-        quiz_id = request.query_params.get('quiz_id')
-
-        student = Student.objects.get(student_id=student_id)
-        quiz = Quiz.objects.get(quiz_id=quiz_id)
-        subject = quiz.subject
-        
-
-        # All relevant subtopics for the particular subject are filtered.
-        # A blank array for the question list is initialised, ready to be populated.
-
-        subtopics = Subtopic.objects.filter(subject=subject)
-        questionList = []
-        
-
-        # Loop through each subtopic is completed, retrieving all BKT_known values for a student.
-        # For this prototype, there will be six subtopics.
-        # The value of p_known is then used to determine how many questions from each subtopic
-        # are needed.
-
-        for subtopic in subtopics:
-            subtopic_bkt_values = BKT.objects.get(student=student, subtopic=subtopic)
-            p_known = subtopic_bkt_values.p_known
-            
-            if p_known <= 0.4:
-                question_amount = 3
-            elif p_known > 0.4 and p_known < 0.8:
-                question_amount = 2
-            else:
-                question_amount = 1
-
-        # The current subtopic is filtered in the questions and the questions are randomised.
-        # Then the required number of questions (if available) are added to the question list.
-
-            subtopic_questions = list(Question.objects.filter(subject=subject, subtopic=subtopic))
-            random.shuffle(subtopic_questions)
-            questionList.extend(subtopic_questions[:question_amount])
-
-
-# The generated list of questions is shuffled to ensure it is random (so that students
-# cannot just memorise answers). 
-
-        random.shuffle(questionList)
-
-
-        # dictionary is created to hold the question data, taking all of them in order. This makes the quiz
-        # ready to pass to the frontend.
-
-        question_data = [
-            {
-                'question_id': question.question_id, 
-                'question_text': question.question_text, 
-                'answer_1': question.answer_1, 
-                'answer_2': question.answer_2, 
-                'answer_3': question.answer_3, 
-                'answer_4': question.answer_4
-            } for question in questionList
-        ]
-        
-
-        # The response to be sent to the frontend is created, containing the quiz data,
-        # The amount of questions and the subject.
-
-        return Response(
-            {
-                'questions': question_data,
-                'total_questions': len(question_data),
-                'subject_name': subject.subject_name,
-                'quiz_type': 'assigned'
-            }
-        )
+        data, status_code = start_quiz(request.query_params.get('quiz_id'), request.query_params.get('student_id'))
+        return Response(data, status=status_code)
 
 
     # teacher data function is created, retrieving all subjects and the classes from 
     # the frontend (should always be one).
+    # Students are returned a page at a time, ordered by student id. The cursor is the last student id
+    # from the previous page, and is returned as next_cursor while there are more students to fetch.
+    # The response has an ETag from the form's students, and is cached for a short time.
+    # A teacher that does not exist or has no subject is not found.
 
     @action(detail=False, methods=['get'])
     def getStudents(self, request):
         teacher_id = request.query_params.get('teacher_id')
-        teacher = Teacher.objects.get(teacher_id=teacher_id)
+        teacher = cache.teacher(teacher_id)
+        if teacher is None or teacher['subject_id'] is None or cache.subject(teacher['subject_id']) is None:
+            return Response({'error': 'Teacher not found'}, status=status.HTTP_404_NOT_FOUND)
+
+        return conditional.conditional_response(
+            request,
+            conditional.students_stamp(teacher_id),
+            lambda: self.student_list(request, teacher_id)
+        )
+
+    def student_list(self, request, teacher_id):
+        cursor = request.query_params.get('cursor')
+        limit = page_size(request)
+        teacher = cache.teacher(teacher_id)
         # Only return the subject and students for this teacher's form
-        subject = teacher.subject
-        students_in_class = Student.objects.filter(form=teacher.form)
+        # The teacher, subject and form roster are all read from the cache.
+        subject = cache.subject(teacher['subject_id'])
+        students_in_class = cache.form_roster(teacher['form'])
+
+
+        # The roster is ordered by student id, so the start of the page can be found with a binary search.
+
+        start = bisect_right(students_in_class, (cursor, chr(0x10FFFF))) if cursor else 0
+        page = students_in_class[start:start + limit]
+        more = start + limit < len(students_in_class)
+
         class_data = {
-            'class_id': subject.subject_id,
-            'subject_id': subject.subject_id,
-            'subject_name': subject.subject_name,
+            'class_id': subject['subject_id'],
+            'subject_id': subject['subject_id'],
+            'subject_name': subject['subject_name'],
             'students': [
                 {
-                    'student_id': student.student_id,
-                    'student_name': f"{student.user_id.first_name} {student.user_id.surname}"
+                    'student_id': student_id,
+                    'student_name': student_name
                 }
-                for student in students_in_class
-            ]
+                for student_id, student_name in page
+            ],
+            'total_count': len(students_in_class),
+            'next_cursor': page[-1][0] if page and more else None
         }
         return Response(class_data)
 
     # Function to assign quizzes is created, taking the teacher id and subject id from the frontend request.
+    # Quizzes can also be assigned for several subjects (subject_ids), to several forms (forms) or to a list
+    # of students (student_ids) in one request. If no forms or students are given, the teacher's form is used.
+    # Students who already have an open quiz for a subject are not given another one (see assignment.py).
+    # If background is set, the quizzes are assigned by a background job instead, and the job is returned
+    # so that its progress can be followed at /api/jobs/<job_id>/progress/.
 
     @action(detail=False, methods=['post'])
     def createQuiz(self, request):
         teacher_id = request.data.get('teacher_id')
-        subject_id = request.data.get('subject_id')
         teacher = Teacher.objects.get(teacher_id=teacher_id)
-        subject = Subject.objects.get(subject_id=subject_id)
-        students = Student.objects.filter(form=teacher.form)
-        created_assignments = []
 
-        for student in students:
-            quiz = Quiz.objects.create(
-                teacher=teacher,
-                student=student,
-                subject=subject
-            )
-            created_assignments.append(quiz.quiz_id)
+        subject_ids = request.data.get('subject_ids') or [request.data.get('subject_id') or teacher.subject_id]
+        forms = request.data.get('forms') or []
+        student_ids = request.data.get('student_ids') or []
+
+        if pregeneration.flag_set(request.data.get('background')):
+            job, _ = jobs.enqueue('create_quizzes', {
+                'teacher_id': teacher.teacher_id,
+                'subject_ids': subject_ids,
+                'forms': forms,
+                'student_ids': student_ids,
+                'pregenerate': request.data.get('pregenerate')
+            })
+            return Response(JobSerializer(job).data, status=status.HTTP_202_ACCEPTED)
+
+        new_quizzes, existing_quizzes = assignment.assign_quizzes(teacher, subject_ids, forms, student_ids)
+        created_assignments = [quiz.quiz_id for quiz in new_quizzes]
+
+
+        # If chosen, the questions for each quiz are chosen now in the background rather than when it is opened.
+
+        if pregeneration.pregenerate_enabled(request.data.get('pregenerate')):
+            pregeneration.schedule(created_assignments)
 
         return Response({
             'quiz_ids': created_assignments,
+            'existing_quiz_ids': sorted(existing_quizzes.values()),
             'teacher_id': teacher.teacher_id
         })
     
 
     # Function that retrieves all of the quizzes assigned to a student is made.
-    # Student ID is taken from the frontend request.
+    # Student ID is taken from the frontend request, and the quizzes can be filtered by subject_id.
+    # Quizzes are returned a page at a time, ordered by quiz id. The cursor is the last quiz id from the
+    # previous page, and is returned as next_cursor while there are more quizzes to fetch.
+    # The response has an ETag from when the student's quizzes last changed, and is cached for a short time.
 
     @action(detail=False, methods=['get'])
     def getQuizzes(self, request):
-        student_id = request.query_params.get('student_id')
-        student = Student.objects.get(student_id=student_id)
-        quizzes = Quiz.objects.filter(
-            student=student,
-            completed=False
-        )
-
-        quiz_data = []
-        for quiz in quizzes:
-            quiz_data.append({
-                'quiz_id': quiz.quiz_id,
-                'subject_id': quiz.subject.subject_id,
-                'subject_name': quiz.subject.subject_name,
-                'teacher_id': quiz.teacher.teacher_id,
-                'teacher_name': f"{quiz.teacher.user_id.first_name} {quiz.teacher.user_id.surname}"
-            })
-
-        return Response({
-            'assigned_quizzes': quiz_data,
-            'total_count': len(quiz_data)
-        })
+        data, status_code, headers = quizzes_data(request)
+        return Response(data, status=status_code, headers=headers)
     
 
-    # Function to mark each quiz as completed is created. This takes frontend values in the post request.
+    # Function to submit a whole quiz attempt is made, taking the session id from generateQuiz and a list of
+    # question ids and selected answers. Only the questions given in the session are scored, and any that were
+    # not answered count as incorrect. The BKT values are updated, and the quiz is marked as completed with the
+    # score worked out here, all in one transaction. A session can only be submitted once.
 
     @action(detail=False, methods=['post'])
-    def markCompleted(self, request):
-        quiz_id = request.data.get('assigned_quiz_id')  # Keep old parameter name for frontend compatibility
-        score = request.data.get('score')
-        total_questions = request.data.get('total_questions')
-        
-
-        # The quiz is obtained where the quiz id matches the one provided. Each parameter
-        # is then updated using the previously received values.
-
-        quiz = Quiz.objects.get(quiz_id=quiz_id)
-        quiz.completed = True
-        quiz.score = score
-        quiz.total_questions = total_questions
-        quiz.save()
-        
-        
-        # Response block is set to be sent to the frontend.
+    def submitQuiz(self, request):
+        session_id = request.data.get('session_id')
+        answers = answer_pairs(request.data.get('answers', []))
+        if answers is None:
+            return Response(
+                {'error': 'answers must be a list of objects with a question_id'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        with transaction.atomic():
+            try:
+                session = (
+                    QuizSession.objects
+                    .select_for_update()
+                    .select_related('quiz', 'student')
+                    .get(session_id=session_id)
+                )
+            except (QuizSession.DoesNotExist, ValidationError):
+                return Response({'error': 'Quiz session not found'}, status=status.HTTP_404_NOT_FOUND)
+
+            if session.student_id != session.quiz.student_id:
+                return Response({'error': 'Quiz session not found'}, status=status.HTTP_404_NOT_FOUND)
+            if session.submitted or session.quiz.completed:
+                return Response({'error': 'This quiz has already been submitted'}, status=status.HTTP_409_CONFLICT)
+
+
+            # Each question in the session is only scored once, using the first answer given for it.
+
+            issued = set(session.question_ids)
+            selected_answers = {}
+            for question_id, selected_answer in answers:
+                if question_id in issued and question_id not in selected_answers:
+                    selected_answers[question_id] = selected_answer
+
+            try:
+                answered = apply_answers(session.student, list(selected_answers.items()))
+            except BKTUpdateConflict:
+                transaction.set_rollback(True)
+                return Response(
+                    {'error': 'Quiz could not be saved, please try again'},
+                    status=status.HTTP_409_CONFLICT
+                )
+            score = sum(1 for _, _, correct, _, _ in answered if correct)
+
+            quiz = session.quiz
+            quiz.completed = True
+            quiz.score = score
+            quiz.total_questions = len(session.question_ids)
+            quiz.completed_at = timezone.now()
+            quiz.save(update_fields=['completed', 'score', 'total_questions', 'completed_at', 'updated_at'])
+
+            session.submitted = True
+            session.save(update_fields=['submitted'])
+
+        results = record_answers(session.student, answered)
 
         return Response({
-            'quiz_id': quiz_id,
+            'results': results,
             'score': score,
-            'total_questions': total_questions
+            'total_questions': quiz.total_questions
         })
 
 
@@ -318,65 +631,276 @@ class TeacherViewSet(viewsets.ModelViewSet):
     serializer_class = TeacherSerializer
 
 
-    # Teacherdata function is created, where all subjects are taken for the teacher and an empty
-    # array for the results is made.
+    # Teacherdata function is created, taking the teacher id from the frontend request so that only
+    # the form and subject that the teacher actually teaches are calculated.
+    # The response has an ETag from the class rollup's revision, and is cached for a short time.
+    # A teacher that does not exist is not found.
 
     @action(detail=False, methods=['get'])
     def getProgressData(self, request):
-        subjects = Subject.objects.all()
+        teacher_id = request.query_params.get('teacher_id')
+        if cache.teacher(teacher_id) is None:
+            return Response({'error': 'Teacher not found'}, status=status.HTTP_404_NOT_FOUND)
+
+        return conditional.conditional_response(
+            request,
+            conditional.progress_stamp(teacher_id),
+            lambda: self.progress_data(teacher_id)
+        )
+
+    def progress_data(self, teacher_id):
+        teacher = Teacher.objects.select_related('subject').filter(teacher_id=teacher_id).first()
+        if teacher is None:
+            return Response({'error': 'Teacher not found'}, status=status.HTTP_404_NOT_FOUND)
+        subject = teacher.subject
         result = []
 
+        if subject is None:
+            return Response(result)
+
+
+        # Students in the form are retrieved with their user record joined in the same query,
+        # so that names can be read without a lookup per student.
+
+        students = list(
+            Student.objects
+            .filter(form=teacher.form)
+            .select_related('user_id')
+            .order_by('student_id')
+        )
+
+
+        # Subtopics are retrieved so that their names can be displayed, and the averages are then read
+        # from the progress rollups, which are kept up to date whenever a BKT value changes.
+        # This keeps the number of queries the same however many students are in the form.
+
+        subtopics = list(Subtopic.objects.filter(subject=subject).order_by('subtopic_id'))
+        student_ids = [student.student_id for student in students]
+        subtopic_ids = [subtopic.subtopic_id for subtopic in subtopics]
+        class_rollup, student_rollups, subtopic_rollups = rollups.class_rollups(
+            teacher.form, subject.subject_id, student_ids, subtopic_ids
+        )
 
-        # Loop through students is completed, where all student values are retrieved for the subject.
 
-        for subject in subjects:
-            students = Student.objects.all()
-            student_data = []
-            class_p_known = 0
+        # If the class rollup counts fewer BKT rows than there are students and subtopics, some students are new,
+        # so their BKT rows are created and the rollups are read again.
 
-            for student in students:
-                bkt_values = BKT.objects.filter(student=student)
-                mean_known_score = sum([bkt.p_known for bkt in bkt_values]) / len(bkt_values) if bkt_values else 0
-                class_p_known += mean_known_score
-                student_data.append(
-                    {
-                        'student_id': student.student_id,
-                        'student_name': f"{student.user_id.first_name} {student.user_id.surname}",
-                        'average_p_known': round(mean_known_score * 100, 2)
-                    }
+        if rollups.missing_bkt(class_rollup, len(student_ids) * len(subtopic_ids)):
+            if provisioning.provision(student_ids, subtopic_ids):
+                class_rollup, student_rollups, subtopic_rollups = rollups.class_rollups(
+                    teacher.form, subject.subject_id, student_ids, subtopic_ids
                 )
 
-            class_avg_p_known = round((class_p_known / len(students)) * 100, 2) if students else 0
-
-            subtopics = Subtopic.objects.filter(subject=subject)
-            subtopic_data = []
-
-            for subtopic in subtopics:
-                subtopic_p_known = []
-                for student in students:
-                    bkt = BKT.objects.filter(student=student, subtopic=subtopic).first()
-                    if bkt:
-                        subtopic_p_known.append(bkt.p_known)
-
-                mean_p_known = sum(subtopic_p_known) / len(subtopic_p_known) if subtopic_p_known else 0
-                subtopic_data.append({
-                    'subtopic_id': subtopic.subtopic_id,
-                    'subtopic_name': subtopic.subtopic_name,
-                    'mean_p_known': round(mean_p_known * 100, 2)
-                })
-
-            class_info = {
-                'class_id': subject.subject_id,
-                'class_name': subject.subject_name, 
-                'subject': {
-                    'subject_id': subject.subject_id, 
-                    'subject_name': subject.subject_name, 
-                    'students': student_data,
-                    'class_average_p_known': class_avg_p_known, 
-                    'subtopics': subtopic_data
+        student_data = []
+
+        for student in students:
+            mean_known_score = rollups.average(
+                student_rollups.get(rollups.student_rollup_id(student.student_id, subject.subject_id))
+            )
+            student_data.append(
+                {
+                    'student_id': student.student_id,
+                    'student_name': f"{student.user_id.first_name} {student.user_id.surname}",
+                    'average_p_known': round(mean_known_score * 100, 2)
                 }
+            )
+
+        class_avg_p_known = round(rollups.average(class_rollup) * 100, 2)
+
+        subtopic_data = []
+
+        for subtopic in subtopics:
+            mean_p_known = rollups.average(
+                subtopic_rollups.get(rollups.subtopic_rollup_id(teacher.form, subtopic.subtopic_id))
+            )
+            subtopic_data.append({
+                'subtopic_id': subtopic.subtopic_id,
+                'subtopic_name': subtopic.subtopic_name,
+                'mean_p_known': round(mean_p_known * 100, 2)
+            })
+
+        class_info = {
+            'class_id': subject.subject_id,
+            'class_name': subject.subject_name, 
+            'subject': {
+                'subject_id': subject.subject_id, 
+                'subject_name': subject.subject_name, 
+                'students': student_data,
+                'class_average_p_known': class_avg_p_known, 
+                'subtopics': subtopic_data
             }
-            result.append(class_info)
+        }
+        result.append(class_info)
         return Response(result)
 
 
+    # Trend function is created, returning how the class's p_known values have changed over time from the
+    # mastery series. The series for the whole class are read in one query, and down-sampled to at most
+    # points evenly spaced times between start and end (dates or date-times, defaulting to the first and
+    # last snapshots). Values are percentages, with null where there was no value yet.
+
+    @action(detail=False, methods=['get'])
+    def getProgressTrend(self, request):
+        teacher = cache.teacher(request.query_params.get('teacher_id'))
+        if teacher is None or teacher['subject_id'] is None:
+            return Response({'error': 'Teacher not found'}, status=status.HTTP_404_NOT_FOUND)
+
+        try:
+            start = mastery_series.parse_time(request.query_params.get('start'))
+            end = mastery_series.parse_time(request.query_params.get('end'), end_of_day=True)
+            point_count = int(request.query_params.get('points', mastery_series.DEFAULT_POINTS))
+        except ValueError as error:
+            return Response({'error': str(error)}, status=status.HTTP_400_BAD_REQUEST)
+
+        trend = mastery_series.class_trend(teacher['form'], teacher['subject_id'], start, end, point_count)
+        names = dict(cache.form_roster(teacher['form']))
+        subtopic_names = dict(cache.subject(teacher['subject_id'])['subtopics'])
+
+        return Response({
+            'subject_id': teacher['subject_id'],
+            'times': [datetime.fromtimestamp(point, tz=dt_timezone.utc).isoformat() for point in trend['times']],
+            'class_average': trend['class_average'],
+            'subtopics': [
+                {
+                    'subtopic_id': subtopic_id,
+                    'subtopic_name': subtopic_names.get(subtopic_id, subtopic_id),
+                    'average': average
+                }
+                for subtopic_id, average in trend['subtopics'].items()
+            ],
+            'students': [
+                {
+                    'student_id': student_id,
+                    'student_name': names.get(student_id, student_id),
+                    'average': average
+                }
+                for student_id, average in trend['students'].items()
+            ]
+        })
+
+
+    # Rebuild function is created, queueing a background job that rebuilds the teacher's class progress rollups
+    # from the BKT table (for example after BKT rows were changed in the admin site). The job is returned so that
+    # its progress can be followed.
+
+    @action(detail=False, methods=['post'])
+    def rebuildProgress(self, request):
+        teacher = cache.teacher(request.data.get('teacher_id'))
+        if teacher is None or teacher['subject_id'] is None:
+            return Response({'error': 'Teacher not found'}, status=status.HTTP_404_NOT_FOUND)
+
+        job, _ = jobs.enqueue('rebuild_rollups', {'form': teacher['form'], 'subject_id': teacher['subject_id']})
+        return Response(JobSerializer(job).data, status=status.HTTP_202_ACCEPTED)
+
+
+# Viewset for the API metrics is created, returning the metrics recorded by the metrics middleware
+# along with the cache hit and miss counts.
+# This is only available from the machine the server is running on.
+
+class MetricsViewSet(viewsets.ViewSet):
+    LOCAL_ADDRESSES = ('127.0.0.1', '::1')
+
+    def list(self, request):
+        if request.META.get('REMOTE_ADDR') not in self.LOCAL_ADDRESSES:
+            return Response(status=status.HTTP_403_FORBIDDEN)
+        return Response(dict(metrics.registry.snapshot(), cache=cache.stats.snapshot()))
+
+
+# Viewset for exports is created, streaming BKT values, quiz results or answer history as CSV or NDJSON.
+# Each export can be filtered by form, subject_id and a start and end date, with output choosing the format.
+# Rows are written as they are read from the database, so the whole export is never held in memory.
+
+class ExportViewSet(viewsets.ViewSet):
+    CONTENT_TYPES = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+
+    def stream(self, request, name):
+        output_format = request.query_params.get('output', 'csv')
+        try:
+            if output_format not in self.CONTENT_TYPES:
+                raise exports.ExportError(f"Unknown format {output_format}, choose from {', '.join(exports.FORMATS)}")
+            rows = exports.export_rows(
+                name,
+                form=request.query_params.get('form'),
+                subject_id=request.query_params.get('subject_id'),
+                start=request.query_params.get('start'),
+                end=request.query_params.get('end')
+            )
+        except exports.ExportError as error:
+            return Response({'error': str(error)}, status=status.HTTP_400_BAD_REQUEST)
+
+        response = StreamingHttpResponse(
+            exports.export_lines(name, rows, output_format),
+            content_type=self.CONTENT_TYPES[output_format]
+        )
+        response['Content-Disposition'] = f'attachment; filename="{name}.{output_format}"'
+        return response
+
+    @action(detail=False, methods=['get'])
+    def progress(self, request):
+        return self.stream(request, 'progress')
+
+    @action(detail=False, methods=['get'])
+    def quizzes(self, request):
+        return self.stream(request, 'quizzes')
+
+    @action(detail=False, methods=['get'])
+    def answers(self, request):
+        return self.stream(request, 'answers')
+
+
+# Viewset for background jobs is created, returning each job's status, progress and result.
+# Jobs can be filtered by status and kind, and are returned newest first a page at a time. The cursor is the last
+# job id from the previous page. New jobs can be queued with enqueue, giving the kind and its arguments.
+
+class JobViewSet(viewsets.ReadOnlyModelViewSet):
+    queryset = Job.objects.all()
+    serializer_class = JobSerializer
+
+    def list(self, request):
+        job_list = Job.objects.order_by('-job_id')
+        for field in ('status', 'kind'):
+            if request.query_params.get(field):
+                job_list = job_list.filter(**{field: request.query_params[field]})
+
+        cursor = request.query_params.get('cursor')
+        if cursor:
+            if not cursor.isdigit():
+                return Response({'error': 'Invalid cursor'}, status=status.HTTP_400_BAD_REQUEST)
+            job_list = job_list.filter(job_id__lt=int(cursor))
+
+        limit = page_size(request)
+        page = list(job_list[:limit + 1])
+        more = len(page) > limit
+        page = page[:limit]
+        return Response({
+            'jobs': JobSerializer(page, many=True).data,
+            'next_cursor': page[-1].job_id if page and more else None
+        })
+
+
+    # Progress function is created, returning only what is needed to show a progress bar.
+
+    @action(detail=True, methods=['get'])
+    def progress(self, request, pk=None):
+        job = Job.objects.filter(job_id=pk).values(
+            'job_id', 'kind', 'status', 'progress', 'progress_message', 'attempts', 'max_attempts', 'error'
+        ).first()
+        if job is None:
+            return Response({'error': 'Job not found'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(job)
+
+
+    # Enqueue function is created. If the same job is already queued or running, that job is returned instead,
+    # with created set to false.
+
+    @action(detail=False, methods=['post'])
+    def enqueue(self, request):
+        try:
+            job, created = jobs.enqueue(
+                request.data.get('kind'),
+                request.data.get('arguments') or {},
+                dedup_key=request.data.get('dedup_key')
+            )
+        except jobs.InvalidJob as error:
+            return Response({'error': str(error)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(dict(JobSerializer(job).data, created=created), status=status.HTTP_202_ACCEPTED)
@@ -17,6 +17,8 @@ function Quiz({ user, onComplete }) {
   const [isQuizDisplayed, setIsQuizDisplayed] = useState(false);
   const [userScore, setUserScore] = useState(0);
   const [isQuizCompleted, setIsQuizCompleted] = useState(false);
+  const [sessionId, setSessionId] = useState('');
+  const [quizAnswers, setQuizAnswers] = useState([]);
 
 
   // useEffect is used to fetch all assigned quizzes for the applicable user, obtaining
@@ -35,11 +37,14 @@ function Quiz({ user, onComplete }) {
   // Function to start the quiz is defined, taking the selected quiz for the applicable user from the url.
   // The question data is retrieved and stored in the questions const as an array.
   // The number for the current question is set to 0 and boolean for the display quiz is set to true.
+  // The session id is kept so that the answers can be submitted together at the end of the quiz.
 
   const generateQuiz = async () => {
     const response = await fetch(`/api/quiz/generateQuiz/?quiz_id=${selectedQuizId}&student_id=${user.student_id}`);
     const quizData = await response.json();
     setQuizQuestions(quizData.questions || []);
+    setSessionId(quizData.session_id);
+    setQuizAnswers([]);
     setCurrentQuestionIndex(0);
     setIsQuizDisplayed(true);
   };
@@ -47,51 +52,34 @@ function Quiz({ user, onComplete }) {
 
   // Answer handler takes the answer selected and gets the question from the current index.
   // With question 1 being index 0 and this incrementing as needed.
+  // Each answer is stored until the end of the quiz, rather than being sent to the API straight away.
 
   const handleQuestionAnswer = async (selectedAnswer) => {
     const currentQuestion = quizQuestions[currentQuestionIndex];
-    
-
-    // Response is set to post each of the answers to the api to update the p_known.
-
-    const updateBKT = await fetch('/api/bktvalues/updateBKT/', {
-      method: 'POST',
-      headers: { 'Content-Type': 'application/json' },
-      body: JSON.stringify({
-        student_id: user.student_id,
-        question_id: currentQuestion.question_id,
-        selected_answer: selectedAnswer,
-      })
-    });
-    
-
-    // result (check if correct or not) is set from the JSON response from the API
-
-    const answerChecker = await updateBKT.json();
-    
-
-    // If the result is correct, 1 is added to the score. If not, nothing happens.
-    let updatedScore = userScore;
-    if (answerChecker.correct) {
-      updatedScore = userScore + 1;
-      setUserScore(updatedScore);
-    }
+    const updatedAnswers = [
+      ...quizAnswers,
+      { question_id: currentQuestion.question_id, selected_answer: selectedAnswer }
+    ];
+    setQuizAnswers(updatedAnswers);
 
     
     // Checks whether any questions are left, using current + 1 to get the real number.
+    // Once the last question is answered, the whole quiz is submitted in one request. The API marks the
+    // answers, updates the p_known values and completes the quiz, returning the score.
 
     if (currentQuestionIndex < quizQuestions.length - 1) {
       setCurrentQuestionIndex(currentQuestionIndex + 1);
     } else {
-      await fetch('/api/quiz/markCompleted/', {
+      const submitQuiz = await fetch('/api/quiz/submitQuiz/', {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify({
-          assigned_quiz_id: selectedQuizId,
-          score: updatedScore,
-          total_questions: quizQuestions.length
+          session_id: sessionId,
+          answers: updatedAnswers
         })
       });
+      const quizResult = await submitQuiz.json();
+      setUserScore(quizResult.score || 0);
       setIsQuizCompleted(true);
     }
   };
@@ -106,6 +94,8 @@ function Quiz({ user, onComplete }) {
     setCurrentQuestionIndex(0);
     setSelectedQuizId('');
     setQuizQuestions([]);
+    setSessionId('');
+    setQuizAnswers([]);
     
 
     // Once the quiz is completed, the list of assigned quizzes is set again (incase there